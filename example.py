@@ -5,7 +5,8 @@ Example usage of the spinn_route module to generate routing tables for
 SpiNNaker.
 
 Creates multicast routes from every core and randomly selected destinations and
-generates a routing table file for each router/chip.
+generates a single routing table file containing the tables for every
+router/chip.
 """
 
 import random
@@ -25,7 +26,7 @@ chips = model.make_rectangular_board(20,20)
 # Get a list of all the cores in the system to randomly connect
 all_cores = []
 for position, (router, cores) in chips.iteritems():
-	all_cores.extend(cores)
+	all_cores.extend(cores.itervalues())
 
 # Randomly create some routes between these cores
 for routing_key, source_core in enumerate(all_cores):
@@ -43,10 +44,6 @@ for routing_key, source_core in enumerate(all_cores):
 		model.add_route(route, node_sequence)
 
 
-# Write out routing tables for all routers
-for position, (router, cores) in chips.iteritems():
-	table = table_gen.ybug_table_gen(router)
-	
-	with open("routing_table_%d_%d.bin"%position, "wb") as f:
-		f.write(table)
-
+# Write out routing tables for all routers into a single file
+with open("routing_tables.bin", "wb") as f:
+	table_gen.machine_table_gen(chips, f)
@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+
+"""
+Entry point for running the routing pipeline with python -m spinn_route (see
+the cli module).
+"""
+
+import sys
+
+from spinn_route import cli
+
+sys.exit(cli.main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+Analyses of a routed model which do not require routing tables to be generated.
+"""
+
+import csv
+import array
+import itertools
+
+from collections import namedtuple
+
+import model
+import table_gen
+import simulator
+
+
+"""
+The number of multicast routing table entries available in a SpiNNaker router.
+"""
+ROUTER_TABLE_CAPACITY = 1024
+
+
+"""
+The result of capacity_report:
+* counts: a dict {(x,y): num_entries, ...} for every chip.
+* overflowing: a sorted list of ((x,y), num_entries) for chips whose tables
+  exceed the capacity.
+* histogram: a list of (bin_start, num_chips) tuples counting the chips whose
+  number of entries falls in each bin of the given size.
+* occupancy: a list of rows (indexed by y) of lists (indexed by x) giving the
+  fraction of the table capacity used by each chip (or None where no chip
+  exists), e.g. for plotting as a heatmap.
+* origin: the (x,y) position of the chip at occupancy[0][0].
+"""
+CapacityReport = namedtuple("CapacityReport", ["counts", "overflowing", "histogram", "occupancy", "origin"])
+
+
+def get_entry_counts(chips):
+	"""
+	Returns a dict {(x,y): num_entries, ...} giving the number of (uncompressed)
+	routing table entries each router requires. Entries are counted directly from
+	the routes without generating them; the keys of a RouteGroup count as the
+	number of entries they merge into. Chips of a model.LazyChips which have not
+	been created yet are included (with no entries) but are not created.
+	"""
+	needs_entry = table_gen.needs_entry
+	
+	# {Route: num_entries, ...}
+	route_entries = {}
+	def count(route):
+		if route not in route_entries:
+			route_entries[route] = table_gen.count_key_entries(route.keys)
+		return route_entries[route]
+	
+	def count_router(router):
+		return sum(count(route)
+		           for (route, (incoming_port, outgoing_ports)) in router.routes.iteritems()
+		           if needs_entry(incoming_port, outgoing_ports))
+	
+	counts = {}
+	for position in model.all_positions(chips):
+		chip = model.get_created_chip(chips, position)
+		counts[position] = count_router(chip.router) if chip is not None else 0
+	return counts
+
+
+def capacity_report(chips, capacity = ROUTER_TABLE_CAPACITY, bin_size = 64):
+	"""
+	Produce a CapacityReport describing the routing table occupancy of every
+	router in chips (a dict {(x,y): (router, cores), ...}) given the number of
+	entries available in each router.
+	"""
+	counts = get_entry_counts(chips)
+	
+	overflowing = sorted( (position, count) for (position, count) in counts.iteritems()
+	                      if count > capacity
+	                    )
+	
+	bins = {}
+	for count in counts.itervalues():
+		bin_start = (count // bin_size) * bin_size
+		bins[bin_start] = bins.get(bin_start, 0) + 1
+	histogram = [ (bin_start, bins.get(bin_start, 0))
+	              for bin_start in range(0, max(bins) + 1, bin_size)
+	            ] if bins else []
+	
+	if counts:
+		min_x = min(x for (x,y) in counts)
+		min_y = min(y for (x,y) in counts)
+		width  = max(x for (x,y) in counts) - min_x + 1
+		height = max(y for (x,y) in counts) - min_y + 1
+	else:
+		min_x, min_y, width, height = 0, 0, 0, 0
+	
+	occupancy = [[None] * width for _ in range(height)]
+	for (x,y), count in counts.iteritems():
+		occupancy[y - min_y][x - min_x] = float(count) / capacity
+	
+	return CapacityReport(counts, overflowing, histogram, occupancy, (min_x, min_y))
+
+
+"""
+The result of route_statistics: a set of columns (each an array.array with one
+element per route, in order of route) giving:
+* keys: the (first) key of the route.
+* num_keys: the number of keys following the route (more than one for a
+  RouteGroup).
+* fan_out: the number of sinks of the route.
+* routers: the number of routers the route passes through.
+* links: the number of chip-to-chip links used by the route's tree.
+* max_path_length: the number of links between the source and the furthest
+  sink.
+* mean_path_length: the mean number of links between the source and each sink.
+* latency: the estimated worst-case (uncontended) latency in router clock
+  cycles from the source sending a packet to its arrival at the furthest sink.
+"""
+RouteStatistics = namedtuple("RouteStatistics", [ "keys", "num_keys", "fan_out", "routers"
+                                                , "links", "max_path_length"
+                                                , "mean_path_length", "latency"
+                                                ])
+
+
+def route_statistics( chips
+                    , router_latency = simulator.ROUTER_LATENCY
+                    , link_period = simulator.LINK_PERIOD
+                    , link_latency = simulator.LINK_LATENCY
+                    ):
+	"""
+	Compute a RouteStatistics for every route in chips (a dict {(x,y): (router,
+	cores), ...}). The routes' entries are gathered from every router in a
+	single pass and each route's tree is then walked once.
+	
+	Latency is estimated using the simulator's timing model: every router on
+	the path adds router_latency and every link adds link_period plus
+	link_latency cycles.
+	"""
+	# {Route: {Router: outgoing_ports, ...}, ...}
+	all_entries = {}
+	for router, cores in chips.itervalues():
+		for route, (incoming_port, outgoing_ports) in router.routes.iteritems():
+			all_entries.setdefault(route, {})[router] = outgoing_ports
+	
+	statistics = RouteStatistics( array.array("L"), array.array("L"), array.array("L")
+	                            , array.array("L"), array.array("L"), array.array("L")
+	                            , array.array("d"), array.array("d")
+	                            )
+	
+	for route, (source, sinks) in sorted(model.get_all_routes(chips).iteritems()):
+		entries = all_entries.get(route, {})
+		
+		# Walk the tree recording the number of links to each sink reached
+		path_lengths = []
+		to_visit = [(model.core_to_router(source), 0)]
+		visited = set()
+		while to_visit:
+			router, depth = to_visit.pop()
+			if router in visited or router not in entries:
+				continue
+			visited.add(router)
+			for port in entries[router]:
+				node = router.connections[port]
+				if node is None:
+					continue
+				elif port in model.Router.INTERNAL_PORTS:
+					if node in sinks:
+						path_lengths.append(depth)
+				else:
+					to_visit.append((node, depth + 1))
+		
+		max_path_length = max(path_lengths) if path_lengths else 0
+		
+		statistics.keys.append(route.key)
+		statistics.num_keys.append(len(route.keys))
+		statistics.fan_out.append(len(sinks))
+		statistics.routers.append(len(entries))
+		statistics.links.append(sum(1 for outgoing_ports in entries.itervalues()
+		                              for port in outgoing_ports
+		                              if port in model.Router.EXTERNAL_PORTS))
+		statistics.max_path_length.append(max_path_length)
+		statistics.mean_path_length.append(
+			float(sum(path_lengths)) / len(path_lengths) if path_lengths else 0.0)
+		statistics.latency.append(
+			((max_path_length + 1) * router_latency
+			 + max_path_length * (link_period + link_latency)) if path_lengths else 0.0)
+	
+	return statistics
+
+
+def write_route_statistics(statistics, f):
+	"""
+	Write a RouteStatistics to the file-like object f as CSV with a header row
+	naming the columns.
+	"""
+	writer = csv.writer(f)
+	writer.writerow(RouteStatistics._fields)
+	writer.writerows(itertools.izip(*statistics))
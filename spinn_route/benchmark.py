@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+Performance benchmarks. Usage:
+
+python benchmark.py [--output results.json] [--baseline baseline.json]
+
+Runs the table generator benchmarks and a suite of benchmarks timing the
+stages of building, routing and generating tables for machines of various
+sizes, connection densities and fan-outs. Results may be saved as JSON and
+compared against a previously saved baseline, in which case the exit status is
+non-zero if any stage has regressed.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+
+import model
+import routers
+import table_gen
+
+
+"""
+Table sizes (in entries) to benchmark the table generators with.
+"""
+TABLE_SIZES = [1000, 10000, 100000]
+
+
+def make_router_with_entries(num_entries):
+	"""
+	Produce a router with a routing table requiring the given number of entries
+	(each a route from another chip delivered to a local core).
+	"""
+	router = model.Router((0,0), (0,0))
+	for key in xrange(num_entries):
+		router.routes[model.Route(key)] = (
+			model.Router.EXTERNAL_PORTS[key % len(model.Router.EXTERNAL_PORTS)],
+			[model.Router.INTERNAL_PORTS[key % len(model.Router.INTERNAL_PORTS)]],
+		)
+	return router
+
+
+def concat_table_gen(router):
+	"""
+	Reference implementation of the ybug table generator which produces its
+	output by repeated concatenation.
+	"""
+	table_entries = table_gen.get_router_entries(router)
+	
+	out = ""
+	for entry_num, (route_bits, key, mask) in enumerate(table_entries):
+		out += table_gen.ybug_rtr_entry_t.pack(entry_num, len(table_entries), route_bits, key, mask)
+	out += table_gen.ybug_rtr_entry_t.pack(0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF)
+	
+	return out
+
+
+def time_call(f, *args):
+	"""
+	Returns the wall-clock time (in seconds) taken to call f(*args).
+	"""
+	start = time.time()
+	f(*args)
+	return time.time() - start
+
+
+def time_uncached(router, f, *args):
+	"""
+	Returns the wall-clock time taken to call f(*args) after discarding any
+	table data cached in the router.
+	"""
+	router.invalidate_table_cache()
+	return time_call(f, *args)
+
+
+def benchmark_table_gen(sizes = TABLE_SIZES):
+	"""
+	Time the table generators for tables of the given sizes. Returns a list of
+	(num_entries, {generator_name: seconds, ...}) tuples.
+	"""
+	results = []
+	
+	for num_entries in sizes:
+		router = make_router_with_entries(num_entries)
+		entries = table_gen.get_router_entries(router)
+		
+		timings = {
+			"get_router_entries"    : time_uncached(router, table_gen.get_router_entries, router),
+			"spin1_table_gen"       : time_uncached(router, table_gen.spin1_table_gen, router),
+		}
+		
+		# The ybug format numbers entries using 16-bit fields
+		if num_entries < 0xFFFF:
+			buf = bytearray(table_gen.ybug_table_size(num_entries))
+			timings["concat_table_gen"]     = time_uncached(router, concat_table_gen, router)
+			timings["ybug_table_gen"]       = time_uncached(router, table_gen.ybug_table_gen, router)
+			timings["ybug_table_pack_into"] = time_call(table_gen.ybug_table_pack_into, entries, buf)
+		
+		results.append((num_entries, timings))
+	
+	return results
+
+
+"""
+Machines to benchmark as (name, function returning chips, use_wrap_around)
+tuples.
+"""
+MACHINES = [
+	("2x2",        lambda: model.make_rectangular_board(2, 2), False),
+	("8x6",        lambda: model.make_rectangular_board(8, 6), False),
+	("3-board",    lambda: model.make_multi_board_torus(1, 1), True),
+	("12-board",   lambda: model.make_multi_board_torus(2, 2), True),
+]
+
+"""
+Connection densities (the fraction of cores which source a route) and fan-outs
+(the number of sinks of each route) to benchmark.
+"""
+DENSITIES = [0.1, 0.5]
+FAN_OUTS  = [1, 8]
+
+
+def peak_memory():
+	"""
+	Returns the peak resident memory usage of the process so far (in KiB on
+	Linux). Note that this is a high-water mark for the whole process.
+	"""
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark_stages(make_chips, use_wrap_around, density, fan_out, seed = 0):
+	"""
+	Time each stage of building a machine, routing randomly generated routes
+	through it and generating its routing tables. Returns a dict {stage:
+	{"seconds": wall_time, "peak_memory": kib, "peak_memory_increase": kib},
+	...}.
+	"""
+	rng = random.Random(seed)
+	results = {}
+	state = {}
+	
+	def stage(name, f):
+		memory_before = peak_memory()
+		start = time.time()
+		f()
+		results[name] = { "seconds"              : time.time() - start
+		                , "peak_memory"          : peak_memory()
+		                , "peak_memory_increase" : peak_memory() - memory_before
+		                }
+	
+	def build():
+		state["chips"] = make_chips()
+	
+	def route():
+		chips = state["chips"]
+		all_cores = [core for (router, cores) in chips.itervalues() for core in cores.itervalues()]
+		sources = rng.sample(all_cores, int(len(all_cores) * density))
+		state["routes"] = []
+		for key, source in enumerate(sources):
+			sinks = rng.sample(all_cores, fan_out)
+			node_sequences, unrouted_sinks = routers.dimension_order_route(
+				source, sinks, chips, use_wrap_around = use_wrap_around)
+			state["routes"].append((model.Route(key), node_sequences))
+	
+	def add_routes():
+		for route, node_sequences in state["routes"]:
+			for node_sequence in node_sequences:
+				model.add_route(route, node_sequence)
+	
+	def generate_tables():
+		for router, cores in state["chips"].itervalues():
+			table_gen.ybug_table_gen(router)
+	
+	stage("build", build)
+	stage("route", route)
+	stage("add_route", add_routes)
+	stage("table_gen", generate_tables)
+	
+	return results
+
+
+def run_suite(machines = MACHINES, densities = DENSITIES, fan_outs = FAN_OUTS):
+	"""
+	Run benchmark_stages for every combination of machine, density and fan-out.
+	Returns a dict {benchmark_name: {stage: {...}, ...}, ...}.
+	"""
+	results = {}
+	for machine_name, make_chips, use_wrap_around in machines:
+		for density in densities:
+			for fan_out in fan_outs:
+				name = "%s/density=%s/fan_out=%d"%(machine_name, density, fan_out)
+				results[name] = benchmark_stages(make_chips, use_wrap_around, density, fan_out)
+	return results
+
+
+def compare(results, baseline, tolerance = 0.25, min_seconds = 0.01):
+	"""
+	Compare the results of run_suite against a baseline (of the same form).
+	Returns a sorted list of (benchmark_name, stage, baseline_seconds, seconds)
+	for every stage which took more than (1 + tolerance) times as long as in the
+	baseline. Stages taking under min_seconds in both are ignored as noise.
+	"""
+	regressions = []
+	for name, stages in results.iteritems():
+		for stage, result in stages.iteritems():
+			if stage not in baseline.get(name, {}):
+				continue
+			baseline_seconds = baseline[name][stage]["seconds"]
+			seconds = result["seconds"]
+			if max(seconds, baseline_seconds) < min_seconds:
+				continue
+			if seconds > baseline_seconds * (1.0 + tolerance):
+				regressions.append((name, stage, baseline_seconds, seconds))
+	return sorted(regressions)
+
+
+if __name__=="__main__":
+	parser = argparse.ArgumentParser(description = "Run spinn_route benchmarks.")
+	parser.add_argument("--output", help = "file to save the suite's results to as JSON")
+	parser.add_argument("--baseline", help = "JSON results file to compare against")
+	parser.add_argument("--tolerance", type = float, default = 0.25,
+	                    help = "fractional slow-down counted as a regression")
+	parser.add_argument("--quick", action = "store_true",
+	                    help = "only benchmark the smallest machines")
+	args = parser.parse_args()
+	
+	for num_entries, timings in benchmark_table_gen():
+		for name, seconds in sorted(timings.iteritems()):
+			print "%7d entries  %-22s %8.4fs"%(num_entries, name, seconds)
+	
+	results = run_suite(MACHINES[:2] if args.quick else MACHINES)
+	for name, stages in sorted(results.iteritems()):
+		for stage in ("build", "route", "add_route", "table_gen"):
+			print "%-40s %-10s %8.4fs %8d KiB"%(
+				name, stage, stages[stage]["seconds"], stages[stage]["peak_memory"])
+	
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent = 1, sort_keys = True)
+	
+	if args.baseline:
+		with open(args.baseline, "r") as f:
+			baseline = json.load(f)
+		regressions = compare(results, baseline, args.tolerance)
+		for name, stage, baseline_seconds, seconds in regressions:
+			print "REGRESSION %s %s: %.4fs -> %.4fs"%(name, stage, baseline_seconds, seconds)
+		sys.exit(1 if regressions else 0)
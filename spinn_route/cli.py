@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+"""
+Command-line routing pipeline. Usage:
+
+python -m spinn_route MACHINE NETLIST [options]
+
+Runs the following stages in order, reporting the time taken by each:
+
+* build: construct the machine described by MACHINE (see make_machine).
+* route: read the netlist (see the netlist module) and route every net using
+  the selected algorithm.
+* minimise: (optional) minimise every router's routing table.
+* output: write the routing tables as per-chip files and/or a single
+  machine-wide table file.
+
+The route and minimise stages may be split across several worker processes.
+Only the routing (or minimisation) itself runs in parallel: every result is
+sent back to the main process and added to the model there, and each stage
+starts its own pool of workers (so that the minimise stage sees the routes
+added by the route stage). Workers therefore only pay off when routing each
+net is expensive compared with adding it to the model (e.g. minimal-entry
+routing of nets with many sinks) and when a CPU is free for every worker; for
+cheap algorithms such as dimension order routing a single process is faster.
+
+Once routed, the routes may be queried (e.g. to find which routes use a link)
+using the --query-* options. Progress, timings and problems are reported on
+stderr while the answers to queries are written to stdout.
+"""
+
+import sys
+import argparse
+import contextlib
+import multiprocessing
+
+import model
+import routers
+import table_gen
+import netlist
+import instrument
+import faults
+import index
+
+
+"""
+Routing algorithms selectable from the command line {name: route_fn, ...}.
+"""
+ALGORITHMS = { "dor":           routers.dimension_order_route
+             , "minimal-entry": routers.minimal_entry_route
+             }
+
+
+"""
+The stages of the pipeline in the order they are run.
+"""
+STAGES = ["build", "route", "minimise", "output"]
+
+
+def make_machine(spec, num_cores = 18):
+	"""
+	Construct a machine from a description of the form "kind:size" where kind
+	and size are one of:
+	
+	* "rect:WxH" a rectangular board of W by H chips.
+	* "rect-wrap:WxH" a rectangular board of W by H chips with wrap-around links.
+	* "hex:LAYERS" a hexagonal board with the given number of layers.
+	* "torus:WxH" a torus of W by H threeboards.
+	
+	Returns a tuple (chips, use_wrap_around).
+	"""
+	try:
+		kind, size = spec.split(":")
+		if kind in ("rect", "rect-wrap", "torus"):
+			width, height = map(int, size.split("x"))
+		elif kind == "hex":
+			layers = int(size)
+	except ValueError:
+		raise ValueError("Malformed machine description %s"%(repr(spec)))
+	
+	if kind == "rect":
+		return model.make_rectangular_board(width, height, num_cores = num_cores), False
+	elif kind == "rect-wrap":
+		return model.make_rectangular_board(width, height, wrap_around = True,
+		                                    num_cores = num_cores), True
+	elif kind == "hex":
+		return model.make_hexagonal_board(layers, num_cores = num_cores), False
+	elif kind == "torus":
+		return model.make_multi_board_torus(width, height, num_cores = num_cores), True
+	else:
+		raise ValueError("Unknown machine kind %s"%(repr(kind)))
+
+
+def to_positions(node_sequence):
+	"""
+	Convert a node sequence [Core, Router, ..., Router, Core] into a picklable
+	form (source, [(x,y), ...], sink) where the source and sink are (x, y,
+	core_id) tuples.
+	"""
+	source, sink = node_sequence[0], node_sequence[-1]
+	return ( model.core_to_router(source).position + (source.core_id,)
+	       , [router.position for router in node_sequence[1:-1]]
+	       , model.core_to_router(sink).position + (sink.core_id,)
+	       )
+
+
+def from_positions(chips, (source, router_positions, sink)):
+	"""
+	The inverse of to_positions.
+	"""
+	return ( [chips[source[:2]].cores[source[2]]]
+	       + [chips[position].router for position in router_positions]
+	       + [chips[sink[:2]].cores[sink[2]]]
+	       )
+
+
+"""
+The state shared with worker processes. Workers are forked from the main
+process once the state is set up and so inherit it without copying.
+"""
+_worker_state = {}
+
+
+def _route_net((key, source, sinks)):
+	"""
+	Route a net in a worker process. Returns (key, [positions, ...],
+	[unrouted_sink, ...]) where positions are as produced by to_positions.
+	"""
+	node_sequences, unrouted_sinks = netlist.route_net( source, sinks
+	                                                  , _worker_state["chips"]
+	                                                  , _worker_state["route_fn"]
+	                                                  , **_worker_state["kwargs"]
+	                                                  )
+	return (key, map(to_positions, node_sequences), unrouted_sinks)
+
+
+def _minimise_table(position):
+	"""
+	Minimise the table of the router at the given position in a worker process.
+	"""
+	router = _worker_state["chips"][position].router
+	return position, table_gen.get_minimised_router_entries(router)
+
+
+def route_parallel( nets, chips, route_fn, workers
+                  , batch_size = 1024, **kwargs
+                  ):
+	"""
+	As netlist.route_netlist but with each batch of nets routed by a pool of
+	worker processes. Routing algorithms which depend on the routes already in
+	the model (e.g. minimal_entry_route) see the model as it was when the pool
+	was started.
+	"""
+	_worker_state.update(chips = chips, route_fn = route_fn, kwargs = kwargs)
+	pool = multiprocessing.Pool(workers)
+	try:
+		num_nets = 0
+		unrouted = []
+		for batch in netlist.batches(nets, batch_size):
+			for key, paths, unrouted_sinks in pool.map(_route_net, batch):
+				route = model.Route(key)
+				for positions in paths:
+					model.add_route(route, from_positions(chips, positions))
+				if unrouted_sinks:
+					unrouted.append((key, unrouted_sinks))
+			num_nets += len(batch)
+	finally:
+		pool.terminate()
+		_worker_state.clear()
+	
+	return num_nets, unrouted
+
+
+def minimise_tables(chips, workers = 1):
+	"""
+	Replace every router's table with its minimised equivalent (see
+	table_gen.minimise_entries), optionally using a pool of worker processes.
+	"""
+	positions = sorted(chips)
+	if workers > 1:
+		_worker_state.update(chips = chips)
+		pool = multiprocessing.Pool(workers)
+		try:
+			minimised = pool.map(_minimise_table, positions, chunksize = 16)
+		finally:
+			pool.terminate()
+			_worker_state.clear()
+	else:
+		minimised = [ (position, table_gen.get_minimised_router_entries(chips[position].router))
+		              for position in positions
+		            ]
+	
+	for position, table_entries in minimised:
+		table_gen.set_router_entries(chips[position].router, table_entries)
+
+
+def parse_link(text):
+	"""
+	Parse a link given as "X,Y,DIRECTION" (see faults.DIRECTIONS) into a tuple
+	((x,y), port).
+	"""
+	try:
+		x, y, direction = text.split(",")
+		return ((int(x), int(y)), faults.DIRECTIONS[direction.lower()])
+	except (ValueError, KeyError):
+		raise argparse.ArgumentTypeError("expected X,Y,DIRECTION not %s"%(repr(text)))
+
+
+def run_queries(args, route_index, out):
+	"""
+	Answer the --query-* options using a RouteIndex, writing the answers to out.
+	"""
+	format_keys = lambda keys: " ".join("0x%08x"%key for key in keys) or "(none)"
+	
+	for key in args.query_key:
+		out.write("key 0x%08x passes through %s\n"%(
+			key, " ".join("%d,%d"%position for position in route_index.get_routers(key))
+			     or "(no routers)"))
+	
+	for text, (position, port) in args.query_link:
+		keys = sorted(key for route in route_index.get_link_routes(position, port)
+		                  for key in route.keys)
+		out.write("link %s carries %s\n"%(text, format_keys(keys)))
+	
+	for text, (position, port) in args.query_incoming:
+		keys = route_index.get_incoming_keys(position, port)
+		out.write("link %s delivers %s\n"%(text, format_keys(keys)))
+
+
+def get_parser():
+	parser = argparse.ArgumentParser(
+		prog = "spinn_route",
+		description = "Route a netlist on a SpiNNaker machine and write its routing tables.")
+	parser.add_argument("machine",
+	                    help = "machine to build, e.g. rect:8x8, rect-wrap:8x8, hex:4 or torus:2x2")
+	parser.add_argument("netlist", help = "netlist file (text or binary)")
+	parser.add_argument("--cores", type = int, default = 18,
+	                    help = "number of cores per chip")
+	parser.add_argument("--algorithm", choices = sorted(ALGORITHMS), default = "dor",
+	                    help = "routing algorithm")
+	parser.add_argument("--workers", type = int, default = 1,
+	                    help = "number of worker processes for the route and minimise stages "
+	                           "(only faster for expensive routing such as minimal-entry and "
+	                           "with a CPU free for each worker)")
+	parser.add_argument("--faults",
+	                    help = "fault-list file of dead links and cores to route around")
+	parser.add_argument("--batch-size", type = int, default = 1024,
+	                    help = "number of nets read and routed at a time")
+	parser.add_argument("--minimise", action = "store_true",
+	                    help = "minimise the routing tables before output")
+	parser.add_argument("--output-dir",
+	                    help = "directory to write a routing table file per chip into")
+	parser.add_argument("--format", choices = sorted(table_gen.TABLE_FORMATS), default = "ybug",
+	                    help = "format of the per-chip routing table files")
+	parser.add_argument("--machine-table",
+	                    help = "file to write a single machine-wide routing table file to")
+	parser.add_argument("--query-key", type = lambda text: int(text, 0), action = "append",
+	                    default = [], metavar = "KEY",
+	                    help = "list the routers packets with KEY pass through")
+	parser.add_argument("--query-link", type = lambda text: (text, parse_link(text)),
+	                    action = "append", default = [], metavar = "X,Y,DIRECTION",
+	                    help = "list the keys sent out of chip X,Y in DIRECTION")
+	parser.add_argument("--query-incoming", type = lambda text: (text, parse_link(text)),
+	                    action = "append", default = [], metavar = "X,Y,DIRECTION",
+	                    help = "list the keys arriving at chip X,Y from DIRECTION")
+	parser.add_argument("--profile",
+	                    help = "file to write an instrumentation report to as JSON")
+	return parser
+
+
+def main(argv = None, out = sys.stderr, query_out = sys.stdout):
+	"""
+	Run the pipeline with the given command-line arguments, printing progress
+	and per-stage timings to out and the answers to any queries to query_out.
+	Returns the exit status: non-zero if any sink could not be routed.
+	"""
+	args = get_parser().parse_args(argv)
+	
+	if args.workers > multiprocessing.cpu_count():
+		out.write("warning: %d workers requested but only %d CPUs are available\n"%(
+			args.workers, multiprocessing.cpu_count()))
+	
+	instrument.reset()
+	if args.profile:
+		instrument.enable()
+	
+	# {stage: seconds, ...}
+	timings = {}
+	
+	@contextlib.contextmanager
+	def stage(name):
+		start = instrument.clock()
+		with instrument.Timer("cli.%s"%name):
+			yield
+		timings[name] = instrument.clock() - start
+	
+	with stage("build"):
+		chips, use_wrap_around = make_machine(args.machine, args.cores)
+	
+	with stage("route"):
+		kwargs = {"use_wrap_around": use_wrap_around}
+		if args.faults:
+			kwargs["faults"] = faults.FaultMap.for_machine(chips, use_wrap_around, args.cores)
+			with open(args.faults, "r") as f:
+				kwargs["faults"].load(f)
+		route_fn = ALGORITHMS[args.algorithm]
+		with open(args.netlist, "rb") as f:
+			nets = netlist.read_netlist(f)
+			if args.workers > 1:
+				num_nets, unrouted = route_parallel(nets, chips, route_fn, args.workers,
+				                                    args.batch_size, **kwargs)
+			else:
+				num_nets, unrouted = netlist.route_netlist(nets, chips, route_fn,
+				                                           args.batch_size, **kwargs)
+	
+	if args.minimise:
+		with stage("minimise"):
+			minimise_tables(chips, args.workers)
+	
+	with stage("output"):
+		if args.output_dir:
+			table_gen.write_tables(chips, args.output_dir, table_format = args.format)
+		if args.machine_table:
+			with open(args.machine_table, "wb") as f:
+				table_gen.machine_table_gen(chips, f)
+	
+	out.write("routed %d nets on %d chips\n"%(num_nets, len(chips)))
+	for name in STAGES:
+		if name in timings:
+			out.write("%-10s %8.3fs\n"%(name, timings[name]))
+	
+	for key, sinks in unrouted:
+		out.write("could not route key 0x%08x to %s\n"%(
+			key, ", ".join("%d,%d,%d"%sink for sink in sinks)))
+	
+	if args.query_key or args.query_link or args.query_incoming:
+		run_queries(args, index.RouteIndex(chips), query_out)
+	
+	if args.profile:
+		instrument.disable()
+		with open(args.profile, "w") as f:
+			instrument.write_report(f)
+	
+	return 1 if unrouted else 0
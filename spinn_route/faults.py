@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""
+Bulk modelling of dead links and cores. A FaultMap keeps the liveness of every
+link and core of a machine in a pair of bitmaps which can be loaded from a
+fault-list file, queried in constant time and copied or swapped between
+routing runs without touching the model.
+
+A FaultMap may be passed as the faults argument of the routing algorithms and
+verify.verify_tables. It also behaves as a collection of dead ((x,y), port)
+links and so can be used wherever a blocked_links collection is accepted.
+
+Fault-list files contain one fault per line of the form::
+
+	# Comments and blank lines are ignored
+	link X Y DIRECTION
+	core X Y CORE_ID
+
+where DIRECTION is one of the names in DIRECTIONS (e.g. "north_east").
+"""
+
+import topology
+import model
+
+
+"""
+The names of link directions used in fault-list files {name: direction, ...}.
+"""
+DIRECTIONS = { "east":       topology.EAST
+             , "north_east": topology.NORTH_EAST
+             , "north":      topology.NORTH
+             , "west":       topology.WEST
+             , "south_west": topology.SOUTH_WEST
+             , "south":      topology.SOUTH
+             }
+
+"""
+The number of links of each chip.
+"""
+LINKS_PER_CHIP = 6
+
+
+class FaultMap(object):
+	"""
+	The liveness of the links and cores of a width x height machine whose
+	bottom-left chip is at origin. Bit n of a bitmap is set if the link or core
+	it represents is alive.
+	"""
+	
+	def __init__(self, width, height, wrap_around = False, origin = (0,0), num_cores = 18):
+		self.width       = width
+		self.height      = height
+		self.wrap_around = wrap_around
+		self.origin      = origin
+		self.num_cores   = num_cores
+		
+		self.link_bitmap = bytearray("\xFF" * ((width * height * LINKS_PER_CHIP + 7) // 8))
+		self.core_bitmap = bytearray("\xFF" * ((width * height * num_cores + 7) // 8))
+	
+	
+	@classmethod
+	def for_machine(cls, chips, wrap_around = False, num_cores = 18):
+		"""
+		Produce a FaultMap (with no faults) covering the given chips (a dict
+		{(x,y): (router, cores), ...} or a LazyChips).
+		"""
+		if isinstance(chips, model.LazyChips):
+			return cls( chips.width - chips.origin[0], chips.height - chips.origin[1]
+			          , wrap_around, chips.origin, num_cores
+			          )
+		
+		min_x = min(x for (x,y) in chips.iterkeys())
+		min_y = min(y for (x,y) in chips.iterkeys())
+		width  = max(x for (x,y) in chips.iterkeys()) - min_x + 1
+		height = max(y for (x,y) in chips.iterkeys()) - min_y + 1
+		return cls(width, height, wrap_around, (min_x, min_y), num_cores)
+	
+	
+	def copy(self):
+		"""
+		Returns an independent copy of the fault map.
+		"""
+		fault_map = FaultMap.__new__(FaultMap)
+		fault_map.__dict__.update(self.__dict__)
+		fault_map.link_bitmap = bytearray(self.link_bitmap)
+		fault_map.core_bitmap = bytearray(self.core_bitmap)
+		return fault_map
+	
+	
+	def _chip_index(self, (x, y)):
+		"""
+		Returns the index of the chip at the given position or None if it is
+		outside the map.
+		"""
+		x -= self.origin[0]
+		y -= self.origin[1]
+		if 0 <= x < self.width and 0 <= y < self.height:
+			return (y * self.width) + x
+		else:
+			return None
+	
+	
+	def _link_bit(self, position, port):
+		chip_index = self._chip_index(position)
+		if chip_index is None:
+			raise KeyError(position)
+		return (chip_index * LINKS_PER_CHIP) + port
+	
+	
+	def _core_bit(self, position, core_id):
+		chip_index = self._chip_index(position)
+		if chip_index is None or not 0 <= core_id < self.num_cores:
+			raise KeyError((position, core_id))
+		return (chip_index * self.num_cores) + core_id
+	
+	
+	def link_alive(self, position, port):
+		"""
+		Is the link leaving the chip at the given position via the given port
+		alive? Links outside the map are considered alive.
+		"""
+		chip_index = self._chip_index(position)
+		if chip_index is None:
+			return True
+		bit = (chip_index * LINKS_PER_CHIP) + port
+		return bool(self.link_bitmap[bit >> 3] & (1 << (bit & 7)))
+	
+	
+	def core_alive(self, position, core_id):
+		"""
+		Is the given core of the chip at the given position alive? Cores outside
+		the map are considered alive.
+		"""
+		chip_index = self._chip_index(position)
+		if chip_index is None or not 0 <= core_id < self.num_cores:
+			return True
+		bit = (chip_index * self.num_cores) + core_id
+		return bool(self.core_bitmap[bit >> 3] & (1 << (bit & 7)))
+	
+	
+	def __contains__(self, (position, port)):
+		"""
+		A FaultMap contains the ((x,y), port) links which are dead.
+		"""
+		return not self.link_alive(position, port)
+	
+	
+	def get_neighbour(self, position, port):
+		"""
+		Returns the position of the chip at the other end of a link.
+		"""
+		x, y = topology.to_xy(topology.add_direction(topology.to_xyz(position), port))
+		if self.wrap_around:
+			x = ((x - self.origin[0]) % self.width)  + self.origin[0]
+			y = ((y - self.origin[1]) % self.height) + self.origin[1]
+		return (x, y)
+	
+	
+	def set_link_alive(self, position, port, alive = True):
+		"""
+		Set the liveness of a link in both directions. Raises a KeyError if the
+		given position is outside the map; the far end of the link is only
+		skipped if it is outside the map (e.g. at the edge of the machine).
+		"""
+		ends = [(position, port), (self.get_neighbour(position, port), topology.opposite(port))]
+		for end_num, (end_position, end_port) in enumerate(ends):
+			if end_num > 0 and self._chip_index(end_position) is None:
+				continue
+			bit = self._link_bit(end_position, end_port)
+			if alive:
+				self.link_bitmap[bit >> 3] |= 1 << (bit & 7)
+			else:
+				self.link_bitmap[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+	
+	
+	def set_core_alive(self, position, core_id, alive = True):
+		"""
+		Set the liveness of a core.
+		"""
+		bit = self._core_bit(position, core_id)
+		if alive:
+			self.core_bitmap[bit >> 3] |= 1 << (bit & 7)
+		else:
+			self.core_bitmap[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+	
+	
+	def dead_links(self):
+		"""
+		Generate the ((x,y), port) of every dead link (in both directions).
+		"""
+		for byte_num, byte in enumerate(self.link_bitmap):
+			if byte == 0xFF:
+				continue
+			for bit in range(byte_num * 8, min((byte_num + 1) * 8, len(self) * LINKS_PER_CHIP)):
+				if not byte & (1 << (bit & 7)):
+					yield (self._position(bit // LINKS_PER_CHIP), bit % LINKS_PER_CHIP)
+	
+	
+	def dead_cores(self):
+		"""
+		Generate the ((x,y), core_id) of every dead core.
+		"""
+		for byte_num, byte in enumerate(self.core_bitmap):
+			if byte == 0xFF:
+				continue
+			for bit in range(byte_num * 8, min((byte_num + 1) * 8, len(self) * self.num_cores)):
+				if not byte & (1 << (bit & 7)):
+					yield (self._position(bit // self.num_cores), bit % self.num_cores)
+	
+	
+	def _position(self, chip_index):
+		return ( (chip_index % self.width)  + self.origin[0]
+		       , (chip_index // self.width) + self.origin[1]
+		       )
+	
+	
+	def __len__(self):
+		"""
+		The number of chips covered by the map.
+		"""
+		return self.width * self.height
+	
+	
+	def load(self, f):
+		"""
+		Mark the links and cores listed in the fault-list file-like object f as
+		dead.
+		"""
+		for line_num, line in enumerate(f, 1):
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			
+			fields = line.split()
+			try:
+				kind, x, y, which = fields
+				position = (int(x), int(y))
+				if kind == "link":
+					self.set_link_alive(position, DIRECTIONS[which.lower()], False)
+				elif kind == "core":
+					self.set_core_alive(position, int(which), False)
+				else:
+					raise ValueError(kind)
+			except (ValueError, KeyError):
+				raise Exception("Malformed fault on line %d of fault list: %s"%(line_num, repr(line)))
+	
+	
+	def write(self, f):
+		"""
+		Write the dead links and cores to the file-like object f as a fault list.
+		Each dead link is listed once.
+		"""
+		names = dict((direction, name) for (name, direction) in DIRECTIONS.iteritems())
+		for position, port in self.dead_links():
+			if port in (topology.EAST, topology.NORTH_EAST, topology.NORTH) \
+			   or (self.get_neighbour(position, port), topology.opposite(port)) not in self:
+				f.write("link %d %d %s\n"%(position + (names[port],)))
+		for position, core_id in self.dead_cores():
+			f.write("core %d %d %d\n"%(position + (core_id,)))
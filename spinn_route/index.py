@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+Indexes for answering queries about the routes in a model (e.g. which routes
+use a given link) in time proportional to the size of the answer rather than
+by scanning every router.
+
+A RouteIndex is built from the routes already in a machine and is kept up to
+date by adding and removing routes through its add_route and remove_route
+methods (which update the model exactly as model.add_route and
+model.remove_route do). Any other change to the routes or their keys (e.g.
+model.add_route, keys.allocate_keys or keys.group_routes) invalidates the
+routers' table caches, which the index notices (via model.Router.changes)
+and rebuilds itself before answering its next query.
+"""
+
+import model
+
+
+class RouteIndex(object):
+	"""
+	Indexes of the routes in a machine by key, link and router.
+	"""
+	
+	def __init__(self, chips):
+		"""
+		Index the routes already present in chips (a dict {(x,y): (router,
+		cores), ...}).
+		"""
+		self.chips = chips
+		self.rebuild()
+	
+	
+	def rebuild(self):
+		"""
+		Re-index every route in the machine. Called automatically once the routes
+		change other than via this index; only required if Router.routes or the
+		keys of a route are changed without invalidating the routers' table
+		caches.
+		"""
+		# The routers each route passes through
+		# {Route: {(x,y): (incoming_port, frozenset(outgoing_ports)), ...}, ...}
+		self.route_entries = {}
+		
+		# {key: set([Route, ...]), ...}
+		self.key_routes = {}
+		
+		# The routes sent down each external link {((x,y), port): set([Route,
+		# ...]), ...}
+		self.link_routes = {}
+		
+		# The routes arriving at each router via each port {((x,y), port):
+		# set([Route, ...]), ...}
+		self.incoming_routes = {}
+		
+		# The routes passing through each router {(x,y): set([Route, ...]), ...}
+		self.router_routes = {}
+		
+		for position, (router, cores) in self.chips.iteritems():
+			for route in router.routes:
+				self._index(route, router)
+		
+		# The value of model.Router.changes when the index was last up to date
+		self.changes = model.Router.changes
+	
+	
+	def _update(self):
+		"""
+		Rebuild the index if the routes have changed other than via this index.
+		"""
+		if self.changes != model.Router.changes:
+			self.rebuild()
+	
+	
+	def _index(self, route, router):
+		"""
+		Add (or update) the index entries for a route in the given router.
+		"""
+		entries = self.route_entries.get(route)
+		if entries is None:
+			entries = self.route_entries[route] = {}
+			for key in route.keys:
+				self.key_routes.setdefault(key, set()).add(route)
+		
+		position = router.position
+		incoming_port, outgoing_ports = router.routes[route]
+		entries[position] = (incoming_port, frozenset(outgoing_ports))
+		
+		self.incoming_routes.setdefault((position, incoming_port), set()).add(route)
+		self.router_routes.setdefault(position, set()).add(route)
+		for port in outgoing_ports:
+			if port in model.Router.EXTERNAL_PORTS:
+				self.link_routes.setdefault((position, port), set()).add(route)
+	
+	
+	def _unindex(self, route):
+		"""
+		Remove every index entry for a route.
+		"""
+		for position, (incoming_port, outgoing_ports) in self.route_entries.pop(route, {}).iteritems():
+			_discard(self.incoming_routes, (position, incoming_port), route)
+			_discard(self.router_routes, position, route)
+			for port in outgoing_ports:
+				_discard(self.link_routes, (position, port), route)
+		
+		for key in route.keys:
+			_discard(self.key_routes, key, route)
+	
+	
+	def add_route(self, route, node_sequence):
+		"""
+		As model.add_route, updating the index.
+		"""
+		self._update()
+		model.add_route(route, node_sequence)
+		for router in node_sequence[1:-1]:
+			self._index(route, router)
+		self.changes = model.Router.changes
+	
+	
+	def remove_route(self, route, source):
+		"""
+		As model.remove_route, updating the index.
+		"""
+		self._update()
+		model.remove_route(route, source)
+		self._unindex(route)
+		self.changes = model.Router.changes
+	
+	
+	def get_routes(self, key):
+		"""
+		Returns the set of Routes (or RouteGroups) carrying the given key.
+		"""
+		self._update()
+		return set(self.key_routes.get(key, ()))
+	
+	
+	def get_routers(self, key):
+		"""
+		Returns a sorted list of the (x,y) positions of the routers which packets
+		with the given key pass through.
+		"""
+		self._update()
+		return sorted(set( position
+		                   for route in self.key_routes.get(key, ())
+		                   for position in self.route_entries[route]
+		                 ))
+	
+	
+	def get_router_routes(self, position):
+		"""
+		Returns the set of Routes passing through the router at the given
+		position.
+		"""
+		self._update()
+		return set(self.router_routes.get(position, ()))
+	
+	
+	def get_link_routes(self, position, port):
+		"""
+		Returns the set of Routes sent out of the given (external) port of the
+		router at the given position.
+		"""
+		self._update()
+		return set(self.link_routes.get((position, port), ()))
+	
+	
+	def get_incoming_routes(self, position, port):
+		"""
+		Returns the set of Routes which arrive at the router at the given position
+		via the given port.
+		"""
+		self._update()
+		return set(self.incoming_routes.get((position, port), ()))
+	
+	
+	def get_incoming_keys(self, position, port):
+		"""
+		Returns a sorted list of the keys which arrive at the router at the given
+		position via the given port.
+		"""
+		self._update()
+		return sorted(key for route in self.incoming_routes.get((position, port), ())
+		                  for key in route.keys)
+
+
+def _discard(index, index_key, route):
+	"""
+	Remove a route from an index {index_key: set([Route, ...]), ...}, removing
+	the entry entirely once empty.
+	"""
+	routes = index.get(index_key)
+	if routes is not None:
+		routes.discard(route)
+		if not routes:
+			del index[index_key]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+Low-overhead instrumentation of the library's main stages. When enabled, the
+model, routers and table_gen modules record counters (e.g. hops walked, port
+lookups, entries generated, bytes packed) and timers (total time and number of
+calls of each stage) which may be exported as a report.
+
+Instrumentation is disabled by default. Instrumented code checks the module's
+enabled flag before recording anything so the cost when disabled is a single
+attribute lookup::
+
+	if instrument.enabled:
+		instrument.count("model.hops", len(node_sequence))
+
+Hooks may be added to feed every recorded value into another profiler or
+metrics system. Each hook is called as hook(kind, name, value) where kind is
+"counter" (value is the amount added) or "timer" (value is the duration of a
+single call in seconds).
+"""
+
+import sys
+import json
+import time
+import functools
+
+
+"""
+Is instrumentation currently enabled? Use enable() and disable() to change.
+"""
+enabled = False
+
+"""
+The counters recorded so far {name: total, ...}.
+"""
+counters = {}
+
+"""
+The timers recorded so far {name: [num_calls, total_seconds], ...}.
+"""
+timers = {}
+
+"""
+The hooks called with every value recorded [hook, ...].
+"""
+hooks = []
+
+
+"""
+The clock used by timers.
+"""
+clock = time.clock if sys.platform == "win32" else time.time
+
+
+def enable():
+	"""
+	Start recording counters and timers.
+	"""
+	global enabled
+	enabled = True
+
+
+def disable():
+	"""
+	Stop recording counters and timers. Values recorded so far are retained.
+	"""
+	global enabled
+	enabled = False
+
+
+def reset():
+	"""
+	Discard all recorded counters and timers.
+	"""
+	counters.clear()
+	timers.clear()
+
+
+def add_hook(hook):
+	"""
+	Call hook(kind, name, value) whenever a value is recorded.
+	"""
+	hooks.append(hook)
+
+
+def remove_hook(hook):
+	"""
+	Stop calling a hook previously added with add_hook.
+	"""
+	hooks.remove(hook)
+
+
+def count(name, amount = 1):
+	"""
+	Add amount to the named counter. Callers should check enabled first.
+	"""
+	counters[name] = counters.get(name, 0) + amount
+	for hook in hooks:
+		hook("counter", name, amount)
+
+
+def record_time(name, seconds):
+	"""
+	Record a single call of the named timer which took the given number of
+	seconds.
+	"""
+	timer = timers.get(name)
+	if timer is None:
+		timer = timers[name] = [0, 0.0]
+	timer[0] += 1
+	timer[1] += seconds
+	for hook in hooks:
+		hook("timer", name, seconds)
+
+
+class Timer(object):
+	"""
+	A context manager which records the time spent within it under the given
+	timer name (if instrumentation is enabled when it is entered).
+	"""
+	
+	def __init__(self, name):
+		self.name  = name
+		self.start = None
+	
+	def __enter__(self):
+		self.start = clock() if enabled else None
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.start is not None:
+			record_time(self.name, clock() - self.start)
+			self.start = None
+
+
+def timed(name):
+	"""
+	A decorator which records the time spent in each call of the decorated
+	function under the given timer name while instrumentation is enabled.
+	"""
+	def decorator(f):
+		@functools.wraps(f)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return f(*args, **kwargs)
+			start = clock()
+			try:
+				return f(*args, **kwargs)
+			finally:
+				record_time(name, clock() - start)
+		return wrapper
+	return decorator
+
+
+def report():
+	"""
+	Returns the values recorded so far as a dict::
+	
+		{ "counters": {name: total, ...}
+		, "timers":   {name: {"calls": num_calls, "seconds": total_seconds}, ...}
+		}
+	"""
+	return { "counters": dict(counters)
+	       , "timers": dict( (name, {"calls": num_calls, "seconds": seconds})
+	                         for (name, (num_calls, seconds)) in timers.iteritems()
+	                       )
+	       }
+
+
+def write_report(f):
+	"""
+	Write the report (see report()) to the file-like object f as JSON.
+	"""
+	json.dump(report(), f, indent = 1, sort_keys = True)
+	f.write("\n")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Routing key allocation. Keys are allocated such that routes with identical
+routing trees are given aligned, contiguous blocks of keys which
+table_gen.minimise_entries can merge into a single entry per router.
+"""
+
+import model
+import table_gen
+
+
+def next_power_of_two(n):
+	"""
+	Returns the smallest power of two greater than or equal to n (and at least 1).
+	"""
+	power = 1
+	while power < n:
+		power <<= 1
+	return power
+
+
+def get_route_trees(chips):
+	"""
+	Given a set of chips (i.e. a dict {(x,y):(router, [cores]),...}), return a
+	dictionary {Route: tree, ...} where tree is a hashable description of every
+	(router, incoming port, outgoing ports) the route passes through. Routes
+	with identical trees require identical routing table entries.
+	"""
+	trees = {}
+	for position, (router, cores) in chips.iteritems():
+		for route, (incoming_port, outgoing_ports) in router.routes.iteritems():
+			trees.setdefault(route, set()).add(
+				(position, incoming_port, frozenset(outgoing_ports)))
+	
+	return dict((route, frozenset(tree)) for (route, tree) in trees.iteritems())
+
+
+def allocate_keys(chips, base_key = 0):
+	"""
+	Assign new keys to every route sourced by a core in chips (a dict {(x,y):
+	(router, cores), ...}).
+	
+	Keys are allocated hierarchically: routes sourced on the same chip are given
+	a contiguous block of keys and, within that, routes with identical routing
+	trees are given a contiguous block aligned to its (power-of-two) size. Each
+	RouteGroup is given its own aligned block of consecutive keys within its
+	tree's block. Blocks are allocated largest first so that every block is
+	naturally aligned; base_key must therefore be a multiple of the largest
+	chip's block size (or a ValueError is raised and no keys are changed).
+	
+	Any cached tables in the routers are invalidated. Returns a dict {Route:
+	key, ...} of the (first) key assigned to each route.
+	"""
+	trees = get_route_trees(chips)
+	
+	# Group routes by source chip and then by tree: {position: {tree: [Route,
+	# ...], ...}, ...}
+	chip_groups = {}
+	for route, (source, sinks) in model.get_all_routes(chips).iteritems():
+		position = model.core_to_router(source).position
+		tree = trees.get(route, frozenset())
+		chip_groups.setdefault(position, {}).setdefault(tree, []).append(route)
+	
+	# The size of the block of keys required by each group and chip
+	chip_blocks = []
+	for position, groups in chip_groups.iteritems():
+		group_blocks = []
+		for routes in groups.itervalues():
+			routes = sorted(routes, key = lambda route: -next_power_of_two(len(route.keys)))
+			size = next_power_of_two(sum(next_power_of_two(len(route.keys)) for route in routes))
+			group_blocks.append((size, routes))
+		group_blocks.sort(key = lambda (size, routes): (-size, min(routes).key))
+		chip_size = next_power_of_two(sum(size for (size, routes) in group_blocks))
+		chip_blocks.append((chip_size, position, group_blocks))
+	chip_blocks.sort(key = lambda (size, position, group_blocks): (-size, position))
+	
+	if chip_blocks and base_key % chip_blocks[0][0] != 0:
+		raise ValueError("base_key 0x%08x is not aligned to the largest block of 0x%x keys"%(
+		                 base_key, chip_blocks[0][0]))
+	
+	# Allocate the keys
+	keys = {}
+	chip_base = base_key
+	for chip_size, position, group_blocks in chip_blocks:
+		group_base = chip_base
+		for group_size, routes in group_blocks:
+			route_base = group_base
+			for route in routes:
+				keys[route] = route_base
+				route_base += next_power_of_two(len(route.keys))
+			group_base += group_size
+		chip_base += chip_size
+	
+	for route, key in keys.iteritems():
+		if isinstance(route, model.RouteGroup):
+			route.group_keys = range(key, key + len(route.group_keys))
+		else:
+			route.key = key
+	
+	for router, cores in chips.itervalues():
+		router.invalidate_table_cache()
+	
+	return keys
+
+
+def get_table_sizes(chips, minimise = True):
+	"""
+	Returns a dict {(x,y): num_entries, ...} giving the number of routing table
+	entries required by each router, optionally after minimisation. Useful for
+	comparing the effectiveness of key allocation strategies.
+	"""
+	if minimise:
+		get_entries = table_gen.get_minimised_router_entries
+	else:
+		get_entries = table_gen.get_router_entries
+	
+	return dict( (position, len(get_entries(router)))
+	             for (position, (router, cores)) in chips.iteritems()
+	           )
+
+
+def group_routes(chips):
+	"""
+	Replace routes in chips (a dict {(x,y): (router, cores), ...}) which share a
+	source core, sinks and routing tree with a single RouteGroup containing all
+	of their keys. Any cached tables in the routers are invalidated.
+	
+	Returns a dict {RouteGroup: [Route, ...], ...} giving the routes replaced by
+	each group created.
+	"""
+	trees = get_route_trees(chips)
+	
+	# {(source, sinks, tree): [Route, ...], ...}
+	identical = {}
+	for route, (source, sinks) in model.get_all_routes(chips).iteritems():
+		signature = (source, frozenset(sinks), trees.get(route, frozenset()))
+		identical.setdefault(signature, []).append(route)
+	
+	# {Route: RouteGroup, ...} for the routes to replace
+	replacements = {}
+	groups = {}
+	for (source, sinks, tree), routes in identical.iteritems():
+		if len(routes) < 2:
+			continue
+		group = model.RouteGroup(sum((route.keys for route in routes), []))
+		groups[group] = sorted(routes)
+		for route in routes:
+			replacements[route] = group
+	
+	replaced = set(replacements)
+	for router, cores in chips.itervalues():
+		for route in replaced.intersection(router.routes):
+			router.routes[replacements[route]] = router.routes.pop(route)
+		router.invalidate_table_cache()
+		
+		for core in cores.itervalues():
+			for route_set in (core.sources, core.sinks):
+				for route in route_set & replaced:
+					route_set.remove(route)
+					route_set.add(replacements[route])
+	
+	return groups
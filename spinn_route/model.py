@@ -6,6 +6,7 @@ and routers with multicast routes mapped out within it.
 """
 
 import topology
+import instrument
 
 from collections import namedtuple
 
@@ -26,6 +27,40 @@ class Route(object):
 	
 	def __lt__(self, other):
 		return self.key < other.key
+	
+	@property
+	def keys(self):
+		"""
+		The list of routing keys which follow this route.
+		"""
+		return [self.key]
+
+
+class RouteGroup(Route):
+	"""
+	A set of routing keys which all follow an identical multicast route, for
+	example several populations on the same core sending to the same sinks. The
+	route is stored (and routing table entries are generated) once for the whole
+	group.
+	"""
+	
+	def __init__(self, keys):
+		assert(len(keys) > 0)
+		self.group_keys = sorted(keys)
+	
+	def __repr__(self):
+		return "RouteGroup(%s)"%(repr(self.group_keys))
+	
+	@property
+	def key(self):
+		"""
+		The lowest key in the group.
+		"""
+		return self.group_keys[0]
+	
+	@property
+	def keys(self):
+		return self.group_keys
 
 
 class Node(object):
@@ -117,6 +152,11 @@ class Router(Node):
 	                 , topology.SOUTH
 	                 ]
 	
+	# The number of times the routes of any router have changed (i.e. the
+	# number of calls to invalidate_table_cache), used to detect stale indexes
+	# of the routes (see index.RouteIndex).
+	changes = 0
+	
 	def __init__(self, position, board):
 		"""
 		position is the (x,y) coordinate of the node in the network.
@@ -131,6 +171,20 @@ class Router(Node):
 		# A dictionary of routes flowing through the router of the form:
 		# {Route: (incoming_port, set(outgoing_ports)), ...}.
 		self.routes = {}
+		
+		# Routing table data generated from the routes (e.g. by table_gen) of the
+		# form {name: data, ...}. Must be invalidated whenever routes is changed.
+		self.table_cache = {}
+	
+	
+	def invalidate_table_cache(self):
+		"""
+		Discard any routing table data generated for this router. Must be called
+		whenever the routes passing through the router (or their keys) change.
+		add_route and remove_route do this automatically.
+		"""
+		self.table_cache.clear()
+		Router.changes += 1
 	
 	
 	def __repr__(self):
@@ -145,12 +199,38 @@ def core_to_router(core):
 	return core.connections[Core.NETWORK_PORT]
 
 
+def get_emergency_route(router, port):
+	"""
+	SpiNNaker routers can route packets around a blocked link using "emergency
+	routing": the packet is sent along the other two sides of the triangle
+	formed by the router, the router at the other end of the blocked link and
+	their common neighbour. The packet leaves via the port counter-clockwise of
+	the blocked one and the neighbour forwards it via the port clockwise of the
+	blocked one, arriving at the intended router.
+	
+	Returns a tuple (first_port, intermediate_router, second_port) describing the
+	emergency route around the given (external) port of the router, or None if
+	either of the links required is not connected.
+	"""
+	first_port  = topology.next_ccw(port)
+	second_port = topology.next_cw(port)
+	
+	intermediate_router = router.connections[first_port]
+	if intermediate_router is None or intermediate_router.connections[second_port] is None:
+		return None
+	
+	return (first_port, intermediate_router, second_port)
+
+
 def make_chip(chip_position = (0,0), chip_board = (0,0), num_cores = 18):
 	"""
 	Create a single, multi-core SpiNNaker chip. Returns a tuple (router, [cores]).
 	"""
 	assert(num_cores <= len(Router.INTERNAL_PORTS))
 	
+	if instrument.enabled:
+		instrument.count("model.chips_built")
+	
 	# Create the router and cores
 	router = Router(chip_position, chip_board)
 	cores = dict((core_id, Core(core_id)) for core_id in range(num_cores))
@@ -188,14 +268,237 @@ def fully_connect_chips(chips, wrap_around = False):
 				router.connect(direction, chips[(next_x, next_y)].router, topology.opposite(direction))
 
 
-def make_rectangular_board(width = 2, height = 2, wrap_around = False, board = (0,0), num_cores = 18):
+class LazyChips(object):
+	"""
+	A machine whose chips are only created when first accessed. Behaves like the
+	dict {(x,y): (router, cores), ...} produced by the make_*_board functions
+	except that:
+	
+	* Looking up (or testing for) any position in the machine is allowed;
+	  looking up a chip which has not yet been created creates it and connects
+	  it to its neighbours which have already been created.
+	* Iterating over the machine (and len) only covers the chips created so far.
+	  all_positions lists every chip in the machine, created or not.
+	
+	Since routing algorithms look up every chip along the paths they produce,
+	only the chips used by an application are created. Note that the links to
+	chips which have not been created are disconnected until they are.
+	"""
+	
+	def __init__(self, width, height, get_board, wrap_around = False, num_cores = 18
+	            , origin = (0,0)
+	            ):
+		"""
+		width and height give the bounds of the machine (as used for wrap-around).
+		get_board is a function which, given an (x,y) position, returns the (x,y)
+		coordinate of the board the chip there is on or None if there is no chip.
+		origin gives the smallest x and y coordinates of any chip (which may be
+		negative, e.g. for a hexagonal board).
+		"""
+		self.width       = width
+		self.height      = height
+		self.get_board   = get_board
+		self.wrap_around = wrap_around
+		self.num_cores   = num_cores
+		self.origin      = origin
+		
+		# The chips created so far {(x,y): (router, cores), ...}
+		self.chips = {}
+	
+	
+	def __getitem__(self, position):
+		chip = self.chips.get(position)
+		if chip is not None:
+			return chip
+		
+		if position not in self:
+			raise KeyError(position)
+		
+		chip = self.chips[position] = self.create_chip(position)
+		
+		# Connect to any neighbours which already exist
+		for direction in Router.EXTERNAL_PORTS:
+			if chip.router.connections[direction] is not None:
+				continue
+			
+			neighbour = self.chips.get(self.get_neighbour(position, direction))
+			if neighbour is not None \
+			   and neighbour.router.connections[topology.opposite(direction)] is None:
+				chip.router.connect(direction, neighbour.router, topology.opposite(direction))
+		
+		return chip
+	
+	
+	def create_chip(self, position):
+		"""
+		Create the (unconnected) chip at the given position in the machine.
+		"""
+		return make_chip(position, self.get_board(position), self.num_cores)
+	
+	
+	def get_neighbour(self, position, direction):
+		"""
+		Returns the position of the chip linked to the given position in the given
+		direction (which need not exist).
+		"""
+		next_x, next_y = topology.to_xy(
+			topology.add_direction(topology.to_xyz(position), direction))
+		if self.wrap_around:
+			next_x %= self.width
+			next_y %= self.height
+		return (next_x, next_y)
+	
+	
+	def __contains__(self, position):
+		return position in self.chips or self.get_board(position) is not None
+	
+	
+	def all_positions(self):
+		"""
+		Returns a sorted list of the positions of every chip in the machine,
+		including those which have not been created yet.
+		"""
+		return [ (x, y)
+		         for x in range(self.origin[0], self.width)
+		         for y in range(self.origin[1], self.height)
+		         if (x, y) in self
+		       ]
+	
+	
+	def get(self, position, default = None):
+		return self[position] if position in self else default
+	
+	
+	def __len__(self):
+		return len(self.chips)
+	
+	
+	def __iter__(self):
+		return iter(self.chips)
+	
+	
+	def iterkeys(self):
+		return self.chips.iterkeys()
+	
+	
+	def itervalues(self):
+		return self.chips.itervalues()
+	
+	
+	def iteritems(self):
+		return self.chips.iteritems()
+	
+	
+	def keys(self):
+		return self.chips.keys()
+	
+	
+	def values(self):
+		return self.chips.values()
+	
+	
+	def items(self):
+		return self.chips.items()
+
+
+class MachineTemplate(object):
+	"""
+	A record of the chips, cores and links of a machine from which any number of
+	fresh copies of the machine (without any routes) can be produced cheaply,
+	e.g. for repeated experiments on the same machine::
+		
+		template = MachineTemplate(make_multi_board_torus(4, 4))
+		for trial in trials:
+			chips = template.clone()
+			...
+	
+	Links which were disconnected in the original machine (e.g. to model
+	faults) are also disconnected in the copies.
+	"""
+	
+	def __init__(self, chips):
+		"""
+		Record the machine chips (a dict {(x,y): (router, cores), ...}). The
+		machine itself is not retained or modified.
+		"""
+		self.width  = max(x for (x,y) in chips.iterkeys()) + 1
+		self.height = max(y for (x,y) in chips.iterkeys()) + 1
+		self.origin = ( min(x for (x,y) in chips.iterkeys())
+		              , min(y for (x,y) in chips.iterkeys())
+		              )
+		
+		# The core IDs of each chip {(x,y): [core_id, ...], ...}
+		self.core_ids = dict( (position, sorted(cores))
+		                      for (position, (router, cores)) in chips.iteritems()
+		                    )
+		
+		# The connected links {((x,y), port): (x,y), ...}
+		self.links = dict( ((position, port), node.position)
+		                   for (position, (router, cores)) in chips.iteritems()
+		                   for (port, node) in router.connections.iteritems()
+		                   if port in Router.EXTERNAL_PORTS and node is not None
+		                 )
+	
+	
+	def clone(self):
+		"""
+		Produce a copy of the machine. The copy is a LazyChips whose chips are
+		created as they are used and so takes constant time to produce.
+		"""
+		return TemplateChips(self)
+
+
+class TemplateChips(LazyChips):
+	"""
+	A copy of a machine produced by MachineTemplate.clone.
+	"""
+	
+	def __init__(self, template):
+		LazyChips.__init__( self, template.width, template.height, None
+		                  , origin = template.origin
+		                  )
+		self.template = template
+	
+	
+	def create_chip(self, position):
+		core_ids = self.template.core_ids[position]
+		chip = make_chip(position, num_cores = 0)
+		for core_id in core_ids:
+			chip.cores[core_id] = Core(core_id)
+			chip.router.connect( Router.INTERNAL_PORTS[core_id]
+			                   , chip.cores[core_id], Core.NETWORK_PORT
+			                   )
+		return chip
+	
+	
+	def get_neighbour(self, position, direction):
+		return self.template.links.get((position, direction))
+	
+	
+	def __contains__(self, position):
+		return position in self.template.core_ids
+	
+	
+	def all_positions(self):
+		return sorted(self.template.core_ids)
+
+
+@instrument.timed("model.make_rectangular_board")
+def make_rectangular_board( width = 2, height = 2, wrap_around = False, board = (0,0), num_cores = 18
+                          , lazy = False
+                          ):
 	"""
 	Produce a system containing a rectangular system of chips (optionally with
 	wrap-around links) of a given width and height. Defaults to a 2x2 board (like
 	the SpiNN-3 "Bunnie Bot" boards). Returns a dict {(x,y): (router, cores),
-	...}.
+	...} or, if lazy is True, an equivalent LazyChips.
 	"""
 	
+	if lazy:
+		def get_board((x,y)):
+			return board if 0 <= x < width and 0 <= y < height else None
+		return LazyChips(width, height, get_board, wrap_around, num_cores)
+	
 	chips = {}
 	
 	for y in range(height):
@@ -207,14 +510,25 @@ def make_rectangular_board(width = 2, height = 2, wrap_around = False, board = (
 	return chips
 
 
-def make_hexagonal_board(layers = 4, board = (0,0), num_cores = 18):
+@instrument.timed("model.make_hexagonal_board")
+def make_hexagonal_board(layers = 4, board = (0,0), num_cores = 18, lazy = False):
 	"""
 	Produce a system containing a hexagonal system of chips (without wrap-around
 	links) of a given number of layers. Defaults to a 4-layer (48 chip) board
 	(like the SpiNN-4/SpiNN-5 boards). Returns a dict {(x,y): (router, cores),
-	...}.
+	...} or, if lazy is True, an equivalent LazyChips.
 	"""
 	
+	if lazy:
+		positions = set(topology.hexagon(layers))
+		def get_board(position):
+			return board if position in positions else None
+		return LazyChips( max(x for (x,y) in positions) + 1
+		                , max(y for (x,y) in positions) + 1
+		                , get_board, False, num_cores
+		                , (min(x for (x,y) in positions), min(y for (x,y) in positions))
+		                )
+	
 	chips = {}
 	
 	for position in topology.hexagon(layers):
@@ -225,12 +539,14 @@ def make_hexagonal_board(layers = 4, board = (0,0), num_cores = 18):
 	return chips
 
 
-def make_multi_board_torus(width = 1, height = 1, layers = 4, num_cores = 18):
+@instrument.timed("model.make_multi_board_torus")
+def make_multi_board_torus(width = 1, height = 1, layers = 4, num_cores = 18, lazy = False):
 	"""
 	Produce a system containing multiple boards arranged as a given number of
 	"threeboards" wide and high arrangement of of boards with the given number of
 	layers. Defaults to a single threeboard system of 48-node boards with 18
-	cores. Returns a dict {(x,y): (router, cores), ...}.
+	cores. Returns a dict {(x,y): (router, cores), ...} or, if lazy is True, an
+	equivalent LazyChips.
 	"""
 	
 	chips = {}
@@ -238,6 +554,26 @@ def make_multi_board_torus(width = 1, height = 1, layers = 4, num_cores = 18):
 	width_nodes  = width*12
 	height_nodes = height*12
 	
+	if lazy:
+		# The position of the (0,0) chip of each board {(x,y): board, ...}
+		origins = {}
+		for (board_x, board_y, board_z) in topology.threeboards(width, height):
+			origins[( ((board_x*4 ) + (board_y*4)) % width_nodes
+			        , ((board_x*-4) + (board_y*8)) % height_nodes
+			        )] = (board_x, board_y)
+		offsets = list(topology.hexagon(layers))
+		
+		def get_board((x,y)):
+			if not (0 <= x < width_nodes and 0 <= y < height_nodes):
+				return None
+			for offset_x, offset_y in offsets:
+				origin = ((x - offset_x) % width_nodes, (y - offset_y) % height_nodes)
+				if origin in origins:
+					return origins[origin]
+			return None
+		
+		return LazyChips(width_nodes, height_nodes, get_board, True, num_cores)
+	
 	for (board_x, board_y, board_z) in topology.threeboards(width, height):
 		assert(board_z == 0)
 		for (x,y) in topology.hexagon(layers):
@@ -254,6 +590,29 @@ def make_multi_board_torus(width = 1, height = 1, layers = 4, num_cores = 18):
 	return chips
 
 
+def all_positions(chips):
+	"""
+	Returns a sorted list of the positions of every chip in chips (a dict
+	{(x,y): (router, cores), ...} or a LazyChips, including the chips it has yet
+	to create).
+	"""
+	if isinstance(chips, LazyChips):
+		return chips.all_positions()
+	else:
+		return sorted(chips.iterkeys())
+
+
+def get_created_chip(chips, position):
+	"""
+	Returns the chip at the given position or None if there is none or, for a
+	LazyChips, it has not been created yet (without creating it).
+	"""
+	if isinstance(chips, LazyChips):
+		return chips.chips.get(position)
+	else:
+		return chips.get(position)
+
+
 def get_all_routes(chips):
 	"""
 	Given a set of chips (i.e. a dict {(x,y):(router, [cores]),...}), return a
@@ -294,6 +653,7 @@ def is_path_connected(node_sequence):
 	return True
 
 
+@instrument.timed("model.add_route")
 def add_route(route, node_sequence):
 	r"""
 	Given a sequence of Nodes of the form [Core, Router, Router, ..., Core], fill
@@ -327,11 +687,17 @@ def add_route(route, node_sequence):
 	ts2.next()
 	sliding_window = zip(ts0, ts1, ts2)
 	
+	if instrument.enabled:
+		instrument.count("model.hops", len(sliding_window))
+	
 	def get_port(router, node):
 		"""
 		Return the port identifier for the port connecting the given router to the
 		given node. If no port connects to this node, throw an Exception.
 		"""
+		if instrument.enabled:
+			instrument.count("model.port_lookups")
+		
 		for port, connection in router.connections.iteritems():
 			if connection == node:
 				return port
@@ -344,6 +710,8 @@ def add_route(route, node_sequence):
 	
 	# Add router entries
 	for prev_node, router, next_node in sliding_window:
+		router.invalidate_table_cache()
+		
 		if route not in router.routes:
 			router.routes[route] = (
 				# Incoming port
@@ -366,3 +734,29 @@ def add_route(route, node_sequence):
 	# Add core source/sink entries
 	node_sequence[0].sources.add(route)
 	node_sequence[-1].sinks.add(route)
+
+
+@instrument.timed("model.remove_route")
+def remove_route(route, source):
+	"""
+	Remove a route from every router it passes through and from the source/sink
+	sets of the Cores it connects, starting from the given source Core. Only the
+	routers the route passes through are visited.
+	"""
+	source.sources.discard(route)
+	
+	to_visit = [core_to_router(source)]
+	while to_visit:
+		router = to_visit.pop()
+		if route not in router.routes:
+			continue
+		
+		incoming_port, outgoing_ports = router.routes.pop(route)
+		router.invalidate_table_cache()
+		
+		for port in outgoing_ports:
+			node = router.connections[port]
+			if port in Router.INTERNAL_PORTS:
+				node.sinks.discard(route)
+			elif node is not None:
+				to_visit.append(node)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Streaming netlist input and output. A netlist describes the multicast nets of
+an application as a series of (key, source, [sink, ...]) tuples where the source
+and sinks are (x, y, core_id) tuples. Netlists are read one net at a time and
+routed in bounded-size batches so that very large applications never need to
+be held in memory in full.
+
+Two formats are supported:
+
+* A line-delimited text format with one net per line giving the key followed
+  by the source and sink cores as comma-separated x,y,core triples, e.g.::
+
+	# key source sink sink ...
+	0x00010000 0,0,1 3,2,4 1,1,7
+
+  Keys may be given in decimal or (0x-prefixed) hexadecimal. Blank lines and
+  lines starting with "#" are ignored.
+
+* A compact binary format consisting of a netlist_header_t followed by the
+  nets, each a netlist_net_t followed by num_sinks netlist_core_t structs.
+"""
+
+import struct
+import itertools
+
+import model
+import routers
+
+
+"""
+The header of a binary netlist file.
+"""
+netlist_header_t = struct.Struct( "<" # Little endian, standard sizes
+                                + "4s" # char[4] magic (NETLIST_MAGIC)
+                                )
+
+"""
+A net in a binary netlist file, followed by num_sinks netlist_core_t structs.
+"""
+netlist_net_t = struct.Struct( "<" # Little endian, standard sizes
+                             + "I" # uint   key
+                             + "h" # short  source x (may be negative)
+                             + "h" # short  source y (may be negative)
+                             + "B" # uchar  source core
+                             + "I" # uint   num_sinks
+                             )
+
+"""
+A sink core in a binary netlist file.
+"""
+netlist_core_t = struct.Struct( "<" # Little endian, standard sizes
+                              + "h" # short  x (may be negative)
+                              + "h" # short  y (may be negative)
+                              + "B" # uchar  core
+                              )
+
+"""
+Magic number at the start of a binary netlist file.
+"""
+NETLIST_MAGIC = "SNET"
+
+
+def _parse_core(text):
+	x, y, core_id = text.split(",")
+	return (int(x), int(y), int(core_id))
+
+
+def read_text_netlist(f):
+	"""
+	Generate (key, source, [sink, ...]) tuples from the text netlist in the
+	file-like object f.
+	"""
+	for line_num, line in enumerate(f, 1):
+		line = line.strip()
+		if not line or line.startswith("#"):
+			continue
+		
+		fields = line.split()
+		try:
+			key = int(fields[0], 0)
+			source = _parse_core(fields[1])
+			sinks = [_parse_core(field) for field in fields[2:]]
+		except (ValueError, IndexError):
+			raise Exception("Malformed net on line %d of netlist: %s"%(line_num, repr(line)))
+		
+		yield (key, source, sinks)
+
+
+def write_text_netlist(nets, f):
+	"""
+	Write an iterable of (key, source, [sink, ...]) tuples to the file-like
+	object f in the text netlist format. Returns the number of nets written.
+	"""
+	num_nets = 0
+	for key, source, sinks in nets:
+		f.write(" ".join(["0x%08x"%key] + ["%d,%d,%d"%core for core in [source] + list(sinks)]))
+		f.write("\n")
+		num_nets += 1
+	return num_nets
+
+
+def read_binary_netlist(f):
+	"""
+	Generate (key, source, [sink, ...]) tuples from the binary netlist in the
+	file-like object f.
+	"""
+	magic, = netlist_header_t.unpack(f.read(netlist_header_t.size))
+	if magic != NETLIST_MAGIC:
+		raise Exception("Not a binary netlist file!")
+	
+	while True:
+		data = f.read(netlist_net_t.size)
+		if not data:
+			break
+		if len(data) != netlist_net_t.size:
+			raise Exception("Truncated binary netlist file!")
+		key, x, y, core_id, num_sinks = netlist_net_t.unpack(data)
+		
+		data = f.read(netlist_core_t.size * num_sinks)
+		if len(data) != netlist_core_t.size * num_sinks:
+			raise Exception("Truncated binary netlist file!")
+		sinks = [ netlist_core_t.unpack_from(data, offset)
+		          for offset in xrange(0, len(data), netlist_core_t.size)
+		        ]
+		
+		yield (key, (x, y, core_id), sinks)
+
+
+def write_binary_netlist(nets, f):
+	"""
+	Write an iterable of (key, source, [sink, ...]) tuples to the file-like
+	object f in the binary netlist format. Returns the number of nets written.
+	"""
+	f.write(netlist_header_t.pack(NETLIST_MAGIC))
+	
+	num_nets = 0
+	for key, (x, y, core_id), sinks in nets:
+		sinks = list(sinks)
+		data = bytearray(netlist_net_t.size + netlist_core_t.size * len(sinks))
+		netlist_net_t.pack_into(data, 0, key, x, y, core_id, len(sinks))
+		offset = netlist_net_t.size
+		for sink in sinks:
+			netlist_core_t.pack_into(data, offset, *sink)
+			offset += netlist_core_t.size
+		f.write(data)
+		num_nets += 1
+	
+	return num_nets
+
+
+def read_netlist(f):
+	"""
+	Generate (key, source, [sink, ...]) tuples from a netlist in either format,
+	detected from the start of the file. f must be a file-like object opened in
+	binary mode which supports seeking.
+	"""
+	start = f.tell()
+	is_binary = f.read(len(NETLIST_MAGIC)) == NETLIST_MAGIC
+	f.seek(start)
+	
+	if is_binary:
+		return read_binary_netlist(f)
+	else:
+		return read_text_netlist(f)
+
+
+def batches(iterable, batch_size):
+	"""
+	Generate lists of up to batch_size consecutive items from the iterable.
+	"""
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, batch_size))
+		if not batch:
+			break
+		yield batch
+
+
+def get_core(chips, (x, y, core_id)):
+	"""
+	Returns the Core at the given (x, y, core_id) or None if chips (a dict
+	{(x,y): (router, cores), ...}) has no such core.
+	"""
+	chip = chips.get((x, y))
+	if chip is None:
+		return None
+	return chip.cores.get(core_id)
+
+
+def route_net(source, sinks, chips, route_fn = routers.dimension_order_route, **kwargs):
+	"""
+	Route a net whose source and sinks are (x, y, core_id) tuples in chips using
+	the given routing algorithm (called with any additional keyword arguments).
+	
+	Returns a tuple ([node_sequence, ...], [sink, ...]) giving the paths found
+	and the (x, y, core_id) sinks which could not be routed, including those not
+	in the machine (or every sink if the source is not).
+	"""
+	source_core = get_core(chips, source)
+	if source_core is None:
+		return [], list(sinks)
+	
+	sink_cores = filter(None, (get_core(chips, sink) for sink in sinks))
+	node_sequences, unrouted_sinks = route_fn(source_core, sink_cores, chips, **kwargs)
+	
+	routed = set(model.core_to_router(sink).position + (sink.core_id,)
+	             for sink in set(sink_cores).difference(unrouted_sinks))
+	return node_sequences, [sink for sink in sinks if tuple(sink) not in routed]
+
+
+def route_netlist( nets, chips, route_fn = routers.dimension_order_route
+                 , batch_size = 1024, **kwargs
+                 ):
+	"""
+	Route an iterable of (key, source, [sink, ...]) tuples (e.g. as produced by
+	read_netlist) in chips (a dict {(x,y): (router, cores), ...}) using the given
+	routing algorithm (called with any additional keyword arguments) and add a
+	Route for each net to the model.
+	
+	Nets are consumed batch_size at a time: each batch is routed and then added
+	to the model before the next is read, so only one batch is held in memory.
+	
+	Returns a tuple (num_nets, unrouted) where unrouted is a list of (key,
+	[sink, ...]) tuples giving the sinks of each net which could not be routed
+	(see route_net).
+	"""
+	num_nets = 0
+	unrouted = []
+	for batch in batches(nets, batch_size):
+		routed = []
+		for key, source, sinks in batch:
+			node_sequences, unrouted_sinks = route_net(source, sinks, chips, route_fn, **kwargs)
+			routed.append((key, node_sequences))
+			
+			if unrouted_sinks:
+				unrouted.append((key, unrouted_sinks))
+		
+		for key, node_sequences in routed:
+			route = model.Route(key)
+			for node_sequence in node_sequences:
+				model.add_route(route, node_sequence)
+		
+		num_nets += len(batch)
+	
+	return num_nets, unrouted
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+Placement of application vertices onto cores. An application is described as a
+list of vertices (any hashable objects) and a list of nets of the form
+(source_vertex, [sink_vertex, ...]). Placements are dicts {vertex: Core, ...}
+so the source and sink cores of each net can be handed directly to the routing
+algorithms in the routers module::
+
+	placements = place.place(vertices, nets, chips)
+	for source, sinks in nets:
+		routers.dimension_order_route( placements[source]
+		                             , [placements[sink] for sink in sinks]
+		                             , chips
+		                             )
+
+The cost of a placement is the total number of hops from each net's source to
+each of its sinks (an upper bound on the number of links used by the net's
+multicast tree).
+"""
+
+import math
+import random
+
+import model
+import topology
+import routers
+
+
+class HopDistance(object):
+	"""
+	The number of hops between chips in a machine, memoised.
+	"""
+	
+	def __init__(self, chips, use_wrap_around = False):
+		self.width, self.height = routers.get_bounds(chips)
+		self.use_wrap_around = use_wrap_around
+		self.cache = {}
+	
+	
+	def __call__(self, source_pos, sink_pos):
+		distance = self.cache.get((source_pos, sink_pos))
+		if distance is None:
+			distance = topology.manhattan(routers.shortest_vector( source_pos, sink_pos
+			                                                     , self.width, self.height
+			                                                     , self.use_wrap_around
+			                                                     ))
+			self.cache[(source_pos, sink_pos)] = distance
+		return distance
+
+
+def get_hop_count(nets, placements, chips, use_wrap_around = False):
+	"""
+	Returns the total number of hops between the source and sink cores of every
+	net given a placement.
+	"""
+	distance = HopDistance(chips, use_wrap_around)
+	position = lambda vertex: model.core_to_router(placements[vertex]).position
+	return sum( distance(position(source), position(sink))
+	            for (source, sinks) in nets
+	            for sink in sinks
+	          )
+
+
+def place( vertices, nets, chips, use_wrap_around = False
+         , iterations = None, cooling = 0.95, seed = None
+         , placements = None
+         ):
+	"""
+	Place each vertex onto a distinct core of chips (a dict {(x,y): (router,
+	cores), ...}) minimising the total hop count of the nets using simulated
+	annealing. Returns a dict {vertex: Core, ...}.
+	
+	Each move relocates a vertex to a randomly chosen core, swapping with the
+	vertex already there (if any). Only the cost of the nets connected to the
+	moved vertices is recalculated. The temperature starts at the mean cost
+	change of a sample of moves and is multiplied by cooling after every
+	len(vertices) moves. iterations is the total number of moves attempted
+	(defaulting to 100 per vertex).
+	
+	placements optionally gives an initial placement {vertex: Core, ...};
+	otherwise vertices are initially placed at random. The best placement seen
+	is returned and so is never worse than the initial placement.
+	
+	Every core of the machine is a candidate and so every chip of a
+	model.LazyChips is created.
+	"""
+	rng = random.Random(seed)
+	distance = HopDistance(chips, use_wrap_around)
+	
+	# Every core as a (position, Core) tuple in a fixed order
+	slots = [ (position, core)
+	          for position in model.all_positions(chips)
+	          for (core_id, core) in sorted(chips[position].cores.iteritems())
+	        ]
+	if len(vertices) > len(slots):
+		raise Exception("Cannot place %d vertices on %d cores!"%(len(vertices), len(slots)))
+	
+	# The slot index of each vertex and the vertex occupying each slot
+	if placements is None:
+		vertex_slot = dict(zip(vertices, rng.sample(xrange(len(slots)), len(vertices))))
+	else:
+		slot_index = dict((core, index) for (index, (position, core)) in enumerate(slots))
+		vertex_slot = dict((vertex, slot_index[placements[vertex]]) for vertex in vertices)
+	slot_vertex = [None] * len(slots)
+	for vertex, slot in vertex_slot.iteritems():
+		slot_vertex[slot] = vertex
+	
+	# The nets connected to each vertex {vertex: [net_num, ...], ...}
+	vertex_nets = dict((vertex, []) for vertex in vertices)
+	for net_num, (source, sinks) in enumerate(nets):
+		for vertex in set([source] + list(sinks)):
+			vertex_nets[vertex].append(net_num)
+	
+	def net_cost(net_num):
+		source, sinks = nets[net_num]
+		source_pos = slots[vertex_slot[source]][0]
+		return sum(distance(source_pos, slots[vertex_slot[sink]][0]) for sink in sinks)
+	
+	def move(vertex, slot):
+		"""
+		Move a vertex to a slot, swapping with any vertex there. Returns the
+		change in cost.
+		"""
+		other = slot_vertex[slot]
+		affected = set(vertex_nets[vertex])
+		if other is not None:
+			affected.update(vertex_nets[other])
+		
+		before = sum(net_cost(net_num) for net_num in affected)
+		
+		old_slot = vertex_slot[vertex]
+		vertex_slot[vertex] = slot
+		slot_vertex[slot] = vertex
+		slot_vertex[old_slot] = other
+		if other is not None:
+			vertex_slot[other] = old_slot
+		
+		return sum(net_cost(net_num) for net_num in affected) - before
+	
+	def random_move():
+		vertex = rng.choice(vertices)
+		return vertex, vertex_slot[vertex], rng.randrange(len(slots))
+	
+	if vertices:
+		# Pick an initial temperature at which most moves are accepted
+		deltas = []
+		for _ in range(min(100, len(vertices))):
+			vertex, old_slot, slot = random_move()
+			deltas.append(abs(move(vertex, slot)))
+			move(vertex, old_slot)
+		temperature = max(1.0, float(sum(deltas)) / len(deltas))
+		
+		if iterations is None:
+			iterations = 100 * len(vertices)
+		
+		# The cost of the current placement and the best placement seen so far
+		cost = sum(net_cost(net_num) for net_num in range(len(nets)))
+		best_cost = cost
+		best_vertex_slot = dict(vertex_slot)
+		
+		for iteration in xrange(iterations):
+			vertex, old_slot, slot = random_move()
+			delta = move(vertex, slot)
+			if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+				move(vertex, old_slot)
+			else:
+				cost += delta
+				if cost < best_cost:
+					best_cost = cost
+					best_vertex_slot = dict(vertex_slot)
+			
+			if (iteration + 1) % len(vertices) == 0:
+				temperature *= cooling
+		
+		vertex_slot = best_vertex_slot
+	
+	return dict((vertex, slots[slot][1]) for (vertex, slot) in vertex_slot.iteritems())
@@ -12,6 +12,9 @@ Where:
 * chips is a list of (Router, [Core,...]) tuples which define the network
   within which to route.
 
+Algorithms also accept an optional faults argument giving a faults.FaultMap of
+links and cores which must not be used.
+
 Returns a two values:
 * A list of sequences of nodes which represent the route. Each sequence
   starts with the source core and ends with a sink core. These routes are not
@@ -21,12 +24,108 @@ Returns a two values:
 """
 
 import operator
+import itertools
 
 import model
 import topology
+import table_gen
+import instrument
+
+
+def get_bounds(chips):
+	"""
+	Calculate the bounds of the system's size (in case wrap_around is used).
+	"""
+	if isinstance(chips, model.LazyChips):
+		return chips.width, chips.height
+	
+	width  = max(x for (x,y) in chips.iterkeys()) + 1
+	height = max(y for (x,y) in chips.iterkeys()) + 1
+	return width, height
+
+
+def shortest_vector(source_pos, sink_pos, width, height, use_wrap_around = False):
+	"""
+	Find the shortest vector from the source to the sink position as a list.
+	"""
+	if use_wrap_around:
+		return list(topology.to_torus_shortest_path(source_pos, sink_pos, (width,height)))
+	else:
+		return list(topology.to_shortest_path(topology.to_xyz(map( operator.sub
+		                                                         , sink_pos
+		                                                         , source_pos
+		                                                         ))))
+
+
+"""
+The directions of a step along each dimension of a vector {(dimension,
+positive): direction, ...}.
+"""
+DIMENSION_DIRECTIONS = { (0, True):  topology.EAST
+                       , (0, False): topology.WEST
+                       , (1, True):  topology.NORTH
+                       , (1, False): topology.SOUTH
+                       , (2, True):  topology.SOUTH_WEST
+                       , (2, False): topology.NORTH_EAST
+                       }
+
+
+def dimension_order_steps(position, vector, width, height, dimension_order=(0,1,2)):
+	"""
+	Returns a list of (direction, (x,y)) tuples giving the direction of each
+	step and the position reached (not including the starting position) when
+	following the given vector from the given position in dimension order. No
+	chips are looked up.
+	"""
+	vector = list(vector)
+	steps = []
+	x, y = position
+	
+	# Route down each dimension in the given order
+	for dimension in dimension_order:
+		while vector[dimension] != 0:
+			vx,vy = topology.to_xy((int(dimension == 0), int(dimension == 1), int(dimension == 2)))
+			
+			positive = vector[dimension] > 0
+			if positive:
+				x += vx
+				y += vy
+				vector[dimension] -= 1
+			else:
+				x -= vx
+				y -= vy
+				vector[dimension] += 1
+			
+			x %= width
+			y %= height
+			
+			steps.append((DIMENSION_DIRECTIONS[(dimension, positive)], (x,y)))
+	
+	return steps
 
 
-def dimension_order_route(source, sinks, chips, use_wrap_around = False, dimension_order=(0,1,2)):
+def dimension_order_path(router, vector, chips, width, height, dimension_order=(0,1,2)):
+	"""
+	Returns the list of routers visited (not including the starting router) when
+	following the given vector from the given router in dimension order.
+	"""
+	routers = [ chips[position].router
+	            for (direction, position) in dimension_order_steps( router.position, vector
+	                                                              , width, height
+	                                                              , dimension_order
+	                                                              )
+	          ]
+	
+	if instrument.enabled:
+		instrument.count("routers.hops", len(routers))
+	
+	return routers
+
+
+@instrument.timed("routers.dimension_order_route")
+def dimension_order_route( source, sinks, chips, use_wrap_around = False, dimension_order=(0,1,2)
+                         , faults = None
+                         ):
 	"""
 	Simple, naive dimension order routing optionally supporting wrap-around links.
 	Note that when two DOR routes exist of equivalent length, one will be chosen
@@ -36,9 +135,7 @@ def dimension_order_route(source, sinks, chips, use_wrap_around = False, dimensi
 	so some routes may fail in the presence of network errors.
 	"""
 	
-	# Calculate the bounds of the system's size (in case wrap_around is used)
-	width  = max(x for (x,y) in chips.iterkeys()) + 1
-	height = max(y for (x,y) in chips.iterkeys()) + 1
+	width, height = get_bounds(chips)
 	
 	node_sequences = []
 	unrouted_sinks = []
@@ -48,43 +145,255 @@ def dimension_order_route(source, sinks, chips, use_wrap_around = False, dimensi
 		sink_pos   = model.core_to_router(sink).position
 		
 		# Find the shortest vector from the source to the sink
-		if use_wrap_around:
-			vector = list(topology.to_torus_shortest_path(source_pos, sink_pos, (width,height)))
-		else:
-			vector = list(topology.to_shortest_path(topology.to_xyz(map( operator.sub
-			                                                           , sink_pos
-			                                                           , source_pos
-			                                                           ))))
+		vector = shortest_vector(source_pos, sink_pos, width, height, use_wrap_around)
 		
 		node_sequence = [source, model.core_to_router(source)]
-		
-		# Route down each dimension in the given order
-		for dimension in dimension_order:
-			while vector[dimension] != 0:
-				vx,vy = topology.to_xy((int(dimension == 0), int(dimension == 1), int(dimension == 2)))
-				x, y  = node_sequence[-1].position
-				
-				if vector[dimension] > 0:
-					x += vx
-					y += vy
-					vector[dimension] -= 1
-				else:
-					x -= vx
-					y -= vy
-					vector[dimension] += 1
-				
-				x %= width
-				y %= height
-				
-				node_sequence.append(chips[(x,y)].router)
+		node_sequence.extend(dimension_order_path( model.core_to_router(source), vector
+		                                         , chips, width, height, dimension_order
+		                                         ))
 		
 		# Add the sink
 		node_sequence.append(sink)
 		
 		# Add the route
-		if model.is_path_connected(node_sequence):
+		if model.is_path_connected(node_sequence) and is_path_live(node_sequence, faults):
 			node_sequences.append(node_sequence)
 		else:
 			unrouted_sinks.append(sink)
 	
 	return node_sequences, unrouted_sinks
+
+
+def is_path_live(node_sequence, faults):
+	"""
+	Given a sequence of Nodes [Core, Router, ..., Router, Core], test whether
+	every link and core it uses is alive according to faults (a
+	faults.FaultMap or None if there are no faults).
+	"""
+	if faults is None:
+		return True
+	
+	source, sink = node_sequence[0], node_sequence[-1]
+	if not faults.core_alive(model.core_to_router(source).position, source.core_id) \
+	   or not faults.core_alive(model.core_to_router(sink).position, sink.core_id):
+		return False
+	
+	for router, next_router in zip(node_sequence[1:-2], node_sequence[2:-1]):
+		if (router.position, get_port(router, next_router)) in faults:
+			return False
+	
+	return True
+
+
+def is_link_connected(chips, position, direction, next_position):
+	"""
+	Test whether the link leaving the given position in the given direction
+	connects to the chip at next_position (or will once the chips at either end
+	are created by a model.LazyChips) without creating any chips.
+	"""
+	if position not in chips or next_position not in chips:
+		return False
+	
+	chip      = model.get_created_chip(chips, position)
+	next_chip = model.get_created_chip(chips, next_position)
+	if chip is not None and next_chip is not None:
+		return chip.router.connections[direction] is next_chip.router
+	
+	# A LazyChips connects a chip to its neighbours when it is created
+	if chip is not None and chip.router.connections[direction] is not None:
+		return False
+	if next_chip is not None and next_chip.router.connections[topology.opposite(direction)] is not None:
+		return False
+	return chips.get_neighbour(position, direction) == next_position
+
+
+def get_port(node, other):
+	"""
+	Returns the port of node connected to other (or None if not connected).
+	"""
+	if instrument.enabled:
+		instrument.count("routers.port_lookups")
+	
+	for port, connection in node.connections.iteritems():
+		if connection is other:
+			return port
+	return None
+
+
+@instrument.timed("routers.minimal_entry_route")
+def minimal_entry_route( source, sinks, chips, use_wrap_around = False
+                       , table_capacity = 1024, full_fraction = 0.9
+                       , faults = None, keys = None
+                       ):
+	"""
+	Shortest-path routing which, amongst the equal-length paths considered to
+	each sink, picks the one requiring the fewest new routing table entries so
+	that default routing is exploited wherever possible.
+	
+	The candidate paths to each sink are the dimension order paths (in every
+	dimension order) from the source and from every router already in the route's
+	tree which lies on a shortest path. Candidates are ranked by the number of
+	new entries they add to routers whose tables are already more than
+	full_fraction of table_capacity entries full, then by the total number of new
+	entries, then by the number of turns.
+	
+	Sinks are routed furthest-first so that later sinks can branch off the
+	longest trunks. Dead links are avoided only where one of the candidate paths
+	avoids them.
+	
+	keys optionally lists the keys the route will carry (e.g. those of a
+	RouteGroup). Each new entry then counts as the number of entries the keys
+	merge into (see table_gen.count_key_entries) and routers which these extra
+	entries would fill are treated as full.
+	"""
+	width, height = get_bounds(chips)
+	
+	# The number of table entries each new entry on the route stands for
+	entries_per_router = table_gen.count_key_entries(keys) if keys else 1
+	
+	source_router = model.core_to_router(source)
+	source_port   = get_port(source_router, source)
+	
+	def distance(router, sink):
+		return topology.manhattan(shortest_vector( router.position
+		                                         , model.core_to_router(sink).position
+		                                         , width, height, use_wrap_around
+		                                         ))
+	
+	# The tree built so far {(x,y): (incoming_port, set(outgoing_ports))} and the
+	# node preceding each router in the tree.
+	tree    = {source_router.position: (source_port, set())}
+	parents = {source_router: source}
+	
+	# The routers in the tree in the order they were added
+	tree_routers = [source_router]
+	
+	def path_to(router):
+		"""Path from the source to a router in the tree."""
+		path = [router]
+		while path[-1] is not source_router:
+			path.append(parents[path[-1]])
+		path.append(source)
+		return path[::-1]
+	
+	def is_full(position):
+		# Chips which have not been created yet have empty tables
+		chip = model.get_created_chip(chips, position)
+		num_entries = len(table_gen.get_router_entries(chip.router)) if chip is not None else 0
+		
+		# Includes the entries needed beyond the one a single key would use
+		return num_entries + entries_per_router - 1 >= table_capacity * full_fraction
+	
+	def cost(hops):
+		"""
+		(new entries in full routers, new entries, turns) for a path given as a list
+		of (position, incoming_port, outgoing_port) tuples for each router it
+		passes through or None if the path would enter a router in the tree from a
+		different direction.
+		"""
+		full_entries = 0
+		new_entries  = 0
+		turns        = 0
+		for position, incoming_port, outgoing_port in hops:
+			if position in tree:
+				old_incoming_port, old_outgoing_ports = tree[position]
+				if old_incoming_port != incoming_port:
+					return None
+				needed_before = table_gen.needs_entry(old_incoming_port, old_outgoing_ports) \
+				                if old_outgoing_ports else False
+				outgoing_ports = old_outgoing_ports | set([outgoing_port])
+			else:
+				needed_before  = False
+				outgoing_ports = set([outgoing_port])
+			
+			if table_gen.needs_entry(incoming_port, outgoing_ports) and not needed_before:
+				new_entries += entries_per_router
+				if is_full(position):
+					full_entries += entries_per_router
+			
+			if incoming_port in model.Router.EXTERNAL_PORTS \
+			   and outgoing_port != topology.opposite(incoming_port):
+				turns += 1
+		
+		return (full_entries, new_entries, turns)
+	
+	def is_live(hops):
+		return faults is None or not any((position, outgoing_port) in faults
+		                                 for (position, incoming_port, outgoing_port) in hops[:-1])
+	
+	node_sequences = []
+	unrouted_sinks = []
+	
+	for sink in sorted(sinks, key = lambda sink: -distance(source_router, sink)):
+		sink_router = model.core_to_router(sink)
+		sink_port   = get_port(sink_router, sink)
+		length = distance(source_router, sink)
+		
+		if faults is not None \
+		   and not ( faults.core_alive(source_router.position, source.core_id)
+		             and faults.core_alive(sink_router.position, sink.core_id)
+		           ):
+			unrouted_sinks.append(sink)
+			continue
+		
+		# Enumerate the candidate paths as (cost, branch_router, [position, ...])
+		# tuples giving the positions of the routers beyond the branch router.
+		# Candidates are considered by position alone so that only the chips on
+		# the chosen path need to be looked up (and so created by a LazyChips).
+		candidates = []
+		for branch_router in tree_routers:
+			prefix = path_to(branch_router)
+			if len(prefix) - 2 + distance(branch_router, sink) != length:
+				continue
+			
+			# The hops through the tree to the branch router
+			prefix_hops = [ (router.position, tree[router.position][0], get_port(router, next_node))
+			                for (router, next_node) in zip(prefix[1:-1], prefix[2:])
+			              ]
+			
+			vector = shortest_vector( branch_router.position, sink_router.position
+			                        , width, height, use_wrap_around
+			                        )
+			for dimension_order in itertools.permutations((0,1,2)):
+				steps = dimension_order_steps( branch_router.position, vector
+				                             , width, height, dimension_order
+				                             )
+				positions = [branch_router.position] + [position for (direction, position) in steps]
+				if positions[-1] != sink_router.position \
+				   or not all(is_link_connected(chips, prev_position, direction, position)
+				              for (prev_position, (direction, position)) in zip(positions, steps)):
+					continue
+				
+				hops = prefix_hops + zip( positions
+				                        , [tree[branch_router.position][0]]
+				                          + [topology.opposite(direction) for (direction, position) in steps]
+				                        , [direction for (direction, position) in steps] + [sink_port]
+				                        )
+				if is_live(hops):
+					candidate_cost = cost(hops)
+					if candidate_cost is not None:
+						candidates.append((candidate_cost, branch_router, positions[1:]))
+		
+		if not candidates:
+			unrouted_sinks.append(sink)
+			continue
+		
+		best_cost, branch_router, positions = min(candidates, key = operator.itemgetter(0))
+		node_sequence = ( path_to(branch_router)
+		                + [chips[position].router for position in positions]
+		                + [sink]
+		                )
+		node_sequences.append(node_sequence)
+		
+		# Add the path to the tree
+		for prev_node, router, next_node in zip( node_sequence
+		                                       , node_sequence[1:]
+		                                       , node_sequence[2:]
+		                                       ):
+			if router.position not in tree:
+				tree[router.position] = (get_port(router, prev_node), set())
+				parents[router] = prev_node
+				tree_routers.append(router)
+			tree[router.position][1].add(get_port(router, next_node))
+	
+	return node_sequences, unrouted_sinks
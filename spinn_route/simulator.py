@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+"""
+A cycle-approximate, packet-level discrete event simulator of the SpiNNaker
+network driven by the routing tables generated for a model.
+
+Each router processes the packets arriving at it one at a time, in order. A
+packet is looked up in the router's table (and default routed on a miss) and is
+then sent to every output required simultaneously. External output ports each
+have a FIFO of limited depth feeding a link which transmits one packet at a
+time. If any of the required output FIFOs is full, the router waits for space;
+if none becomes available within the router's wait time the packet is dropped,
+like the hardware. Packets sent to internal ports are delivered to cores
+immediately.
+
+Links may be marked as blocked (e.g. failed). Packets for a blocked link are
+emergency routed (see model.get_emergency_route): they are sent to the
+neighbouring chip which forwards them, without a table lookup, on to the
+intended chip where they continue as if they had arrived over the blocked link.
+Packets which cannot be emergency routed are dropped.
+
+Traffic is produced by generators (iterables of ascending send times) attached
+to routes. Send times are pulled from each generator lazily so only one pending
+send per route is held in the event queue at a time. All times are given in
+router clock cycles.
+"""
+
+import heapq
+import random
+import itertools
+
+from collections import deque
+
+import topology
+import model
+import table_gen
+import verify
+
+
+"""
+Default timing parameters (in router clock cycles).
+"""
+ROUTER_PERIOD  = 1    # Time between packets being processed by a router
+ROUTER_LATENCY = 4    # Time for a packet to pass through the router pipeline
+LINK_PERIOD    = 8    # Time taken to transmit a packet over a link
+LINK_LATENCY   = 2    # Additional time for a packet to cross a link
+FIFO_DEPTH     = 4    # Number of packets each output FIFO can hold
+WAIT_CYCLES    = 256  # Time a router waits for a blocked output before dropping
+
+
+################################################################################
+# Traffic generators
+################################################################################
+
+def periodic(period, start = 0, count = None):
+	"""
+	Generate send times every period cycles from start (forever or count times).
+	"""
+	times = itertools.count(start, period)
+	return times if count is None else itertools.islice(times, count)
+
+
+def poisson(rate, start = 0, count = None, seed = None):
+	"""
+	Generate send times of a Poisson process with the given rate (packets per
+	cycle) from start (forever or count times).
+	"""
+	rng = random.Random(seed)
+	time = start
+	n = 0
+	while count is None or n < count:
+		time += rng.expovariate(rate)
+		yield time
+		n += 1
+
+
+def bursty(burst_size, burst_period, start = 0, count = None):
+	"""
+	Generate bursts of burst_size packets sent simultaneously every burst_period
+	cycles from start (forever or count bursts).
+	"""
+	for burst_time in periodic(burst_period, start, count):
+		for _ in range(burst_size):
+			yield burst_time
+
+
+################################################################################
+# Simulator
+################################################################################
+
+class Statistics(object):
+	"""
+	Counters collected during a simulation.
+	"""
+	
+	def __init__(self):
+		# Number of packets injected by sources
+		self.sent = 0
+		
+		# Number of packets delivered to sink cores (a multicast packet is counted
+		# once per sink)
+		self.delivered = 0
+		
+		# Number of packets dropped by routers (a multicast packet lost on a blocked
+		# link is counted once per link)
+		self.dropped = 0
+		
+		# Number of packets emergency routed around blocked links
+		self.emergency_routed = 0
+		
+		# Sum and maximum of the delivery latencies of delivered packets
+		self.total_latency = 0
+		self.max_latency = 0
+		
+		# Per-route delivery and drop counts {Route: count, ...}
+		self.route_delivered = {}
+		self.route_dropped = {}
+	
+	
+	@property
+	def mean_latency(self):
+		return float(self.total_latency) / self.delivered if self.delivered else 0.0
+	
+	
+	def __repr__(self):
+		return "Statistics(sent=%d, delivered=%d, dropped=%d, emergency_routed=%d, mean_latency=%.2f, max_latency=%s)"%(
+			self.sent, self.delivered, self.dropped, self.emergency_routed, self.mean_latency, self.max_latency)
+
+
+class Simulator(object):
+	"""
+	A packet-level simulation of a set of chips (a dict {(x,y): (router, cores),
+	...}) using either the given tables ({(x,y): table, ...}) or tables generated
+	from the model. blocked_links is a collection of ((x,y), port) links which
+	cannot be used.
+	"""
+	
+	# Event types
+	SEND    = 0 # A route's source injects a packet
+	ARRIVE  = 1 # A packet arrives at a router
+	PROCESS = 2 # A router processes the packet at the head of its queue
+	
+	# Marker used in place of the incoming port of packets arriving at the
+	# intermediate router of an emergency route. The incoming port is given as
+	# (EMERGENCY, blocked_port).
+	EMERGENCY = object()
+	
+	def __init__( self, chips, tables = None
+	            , router_period = ROUTER_PERIOD, router_latency = ROUTER_LATENCY
+	            , link_period = LINK_PERIOD, link_latency = LINK_LATENCY
+	            , fifo_depth = FIFO_DEPTH, wait_cycles = WAIT_CYCLES
+	            , blocked_links = ()
+	            ):
+		self.chips          = chips
+		self.blocked_links  = blocked_links
+		self.router_period  = router_period
+		self.router_latency = router_latency
+		self.link_period    = link_period
+		self.link_latency   = link_latency
+		self.fifo_depth     = fifo_depth
+		self.wait_cycles    = wait_cycles
+		
+		# {Router: TableLookup, ...}
+		self.lookups = {}
+		for position, (router, cores) in chips.iteritems():
+			if tables is None:
+				table = table_gen.get_router_entries(router)
+			else:
+				table = tables.get(position, [])
+			self.lookups[router] = verify.TableLookup(table)
+		
+		# {Router: {(key, incoming_port): outputs, ...}, ...} cache of the outputs
+		# found by _get_outputs
+		self.lookup_cache = dict((router, {}) for router in self.lookups)
+		
+		# Queue of (packet, incoming_port, arrival_time) at each router and whether
+		# the router has a PROCESS event pending.
+		self.queues = dict((router, deque()) for router in self.lookups)
+		self.busy = set()
+		
+		# The time at which the packet at the head of each router's queue got there
+		self.head_since = {}
+		
+		# For each (router, port) a deque of the times at which each packet in its
+		# output FIFO will have been sent and the time at which its link is next
+		# free.
+		self.fifos = {}
+		self.link_free_at = {}
+		
+		# The event queue of (time, sequence_number, event_type, args) tuples
+		self.events = []
+		self.sequence = itertools.count()
+		
+		# {Route: (source Core, iterator of send times), ...}
+		self.traffic = {}
+		self.sources = model.get_all_routes(chips)
+		
+		self.time = 0
+		self.stats = Statistics()
+	
+	
+	def schedule(self, time, event_type, *args):
+		heapq.heappush(self.events, (time, next(self.sequence), event_type, args))
+	
+	
+	def add_traffic(self, route, send_times):
+		"""
+		Make the source of the given route send packets at the given (ascending)
+		times. Every key of the route (e.g. of a RouteGroup) is sent at each time.
+		"""
+		source, sinks = self.sources[route]
+		send_times = iter(send_times)
+		self.traffic[route] = (source, send_times)
+		self._schedule_next_send(route)
+	
+	
+	def _schedule_next_send(self, route):
+		source, send_times = self.traffic[route]
+		for time in send_times:
+			self.schedule(time, Simulator.SEND, route)
+			break
+	
+	
+	def run(self, until = None):
+		"""
+		Run the simulation until no events remain or the given time is reached.
+		Returns the Statistics collected so far.
+		"""
+		events = self.events
+		handlers = { Simulator.SEND    : self._send
+		           , Simulator.ARRIVE  : self._arrive
+		           , Simulator.PROCESS : self._process
+		           }
+		
+		while events:
+			if until is not None and events[0][0] > until:
+				self.time = until
+				break
+			
+			# Handle every event occurring at the same time as a batch
+			self.time = events[0][0]
+			while events and events[0][0] == self.time:
+				time, sequence_number, event_type, args = heapq.heappop(events)
+				handlers[event_type](*args)
+		
+		return self.stats
+	
+	
+	def _send(self, route):
+		source, send_times = self.traffic[route]
+		router = model.core_to_router(source)
+		for port, node in router.connections.iteritems():
+			if node is source:
+				break
+		
+		for key in route.keys:
+			self.stats.sent += 1
+			self._arrive(router, (route, key, self.time), port)
+		
+		self._schedule_next_send(route)
+	
+	
+	def _arrive(self, router, packet, incoming_port):
+		self.queues[router].append((packet, incoming_port, self.time))
+		if router not in self.busy:
+			self.busy.add(router)
+			self.schedule(self.time, Simulator.PROCESS, router)
+	
+	
+	def _is_usable(self, router, port):
+		"""
+		Returns True if the given external link of the router can be used.
+		"""
+		return router.connections[port] is not None \
+		       and (router.position, port) not in self.blocked_links
+	
+	
+	def _get_outputs(self, router, key, incoming_port):
+		"""
+		Returns a tuple ([sink Core, ...], [(port, arrival_port), ...], num_lost,
+		num_emergency) giving the cores a packet is delivered to, the external
+		ports it is sent down (and the incoming port it will be treated as arriving
+		on at the other end), the number of copies lost on blocked links and the
+		number emergency routed. Returns None if the packet must be dropped. Results
+		are cached.
+		"""
+		cache = self.lookup_cache[router]
+		cache_key = (key, incoming_port)
+		if cache_key in cache:
+			return cache[cache_key]
+		
+		if isinstance(incoming_port, tuple):
+			# Second leg of an emergency route, forwarded without a lookup
+			emergency, blocked_port = incoming_port
+			port = topology.next_cw(blocked_port)
+			if self._is_usable(router, port):
+				outputs = ([], [(port, topology.opposite(blocked_port))], 0, 0)
+			else:
+				outputs = None
+			cache[cache_key] = outputs
+			return outputs
+		
+		route_bits = self.lookups[router].lookup(key)
+		if route_bits is None:
+			if incoming_port in model.Router.EXTERNAL_PORTS:
+				route_bits = table_gen.LINK_BITS[topology.opposite(incoming_port)]
+		
+		if route_bits is None:
+			outputs = None
+		else:
+			ports = [port for (bit, port) in verify.PORT_BITS if route_bits & bit]
+			cores = [ router.connections[port] for port in ports
+			          if port in model.Router.INTERNAL_PORTS
+			          and router.connections[port] is not None
+			        ]
+			
+			external = []
+			num_lost = 0
+			num_emergency = 0
+			for port in ports:
+				if port not in model.Router.EXTERNAL_PORTS or router.connections[port] is None:
+					continue
+				
+				if self._is_usable(router, port):
+					external.append((port, topology.opposite(port)))
+					continue
+				
+				emergency_route = model.get_emergency_route(router, port)
+				if emergency_route is not None and self._is_usable(router, emergency_route[0]):
+					external.append((emergency_route[0], (Simulator.EMERGENCY, port)))
+					num_emergency += 1
+				else:
+					num_lost += 1
+			
+			outputs = (cores, external, num_lost, num_emergency)
+		
+		cache[cache_key] = outputs
+		return outputs
+	
+	
+	def _get_fifo(self, link):
+		"""
+		Returns the deque of the times at which each packet in the given link's
+		output FIFO will have been sent, discarding packets already sent.
+		"""
+		fifo = self.fifos.get(link)
+		if fifo is None:
+			fifo = self.fifos[link] = deque()
+		while fifo and fifo[0] <= self.time:
+			fifo.popleft()
+		return fifo
+	
+	
+	def _process(self, router):
+		queue = self.queues[router]
+		packet, incoming_port, arrival_time = queue[0]
+		route, key, send_time = packet
+		head_since = self.head_since.setdefault(router, self.time)
+		
+		outputs = self._get_outputs(router, key, incoming_port)
+		if outputs is None:
+			self._drop(router, route)
+		else:
+			cores, external, num_lost, num_emergency = outputs
+			fifos = [self._get_fifo((router, port)) for (port, arrival_port) in external]
+			blocked = [fifo for fifo in fifos if len(fifo) >= self.fifo_depth]
+			
+			if blocked:
+				deadline = head_since + self.wait_cycles
+				if self.time >= deadline:
+					self._drop(router, route)
+				else:
+					# Wait until space may become available
+					self.schedule( min([deadline] + [fifo[0] for fifo in blocked])
+					             , Simulator.PROCESS, router
+					             )
+					return
+			else:
+				queue.popleft()
+				del self.head_since[router]
+				self._forward(router, packet, cores, external, fifos)
+				
+				self.stats.emergency_routed += num_emergency
+				if num_lost:
+					self.stats.dropped += num_lost
+					self.stats.route_dropped[route] = self.stats.route_dropped.get(route, 0) + num_lost
+		
+		if queue:
+			self.schedule(self.time + self.router_period, Simulator.PROCESS, router)
+		else:
+			self.busy.discard(router)
+	
+	
+	def _drop(self, router, route):
+		self.queues[router].popleft()
+		del self.head_since[router]
+		self.stats.dropped += 1
+		self.stats.route_dropped[route] = self.stats.route_dropped.get(route, 0) + 1
+	
+	
+	def _forward(self, router, packet, cores, external, fifos):
+		route, key, send_time = packet
+		ready_time = self.time + self.router_latency
+		
+		if cores:
+			stats = self.stats
+			latency = ready_time - send_time
+			stats.delivered += len(cores)
+			stats.total_latency += latency * len(cores)
+			stats.max_latency = max(stats.max_latency, latency)
+			stats.route_delivered[route] = stats.route_delivered.get(route, 0) + len(cores)
+		
+		for (port, arrival_port), fifo in zip(external, fifos):
+			link = (router, port)
+			departure_time = max(ready_time, self.link_free_at.get(link, 0))
+			sent_time = departure_time + self.link_period
+			self.link_free_at[link] = sent_time
+			fifo.append(sent_time)
+			
+			self.schedule( sent_time + self.link_latency
+			             , Simulator.ARRIVE
+			             , router.connections[port], packet, arrival_port
+			             )
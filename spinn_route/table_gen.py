@@ -3,13 +3,22 @@
 """
 Facilities for producing routing table files for ybug given a model.
 
-Currently does not attempt to compress routing entries.
+Tables are generated uncompressed, minimise_entries may be used to merge
+entries for keys which share a route.
 """
 
+import os
+import sys
+import json
+import mmap
+import array
 import struct
+import hashlib
+import collections
 
 import topology
 import model
+import instrument
 
 """
 The struct interpreted by SC&MP/ybug to describe a routing table entry.
@@ -22,6 +31,12 @@ ybug_rtr_entry_t = struct.Struct( "<" # Little endian, standard sizes (i.e. 2-by
                                 + "I" # uint   mask
                                 )
 
+"""
+The largest number of entries a ybug table can describe (entry numbers and
+the number of entries are 16-bit fields).
+"""
+YBUG_MAX_ENTRIES = 0xFFFF
+
 """
 The struct interpreted by the spin1 API to describe a routing table entry.
 """
@@ -32,6 +47,32 @@ spin1_rtr_entry_t = struct.Struct( "<" # Little endian, standard sizes (i.e. 2-b
                                  )
 
 
+"""
+The header of a machine-wide routing table file produced by machine_table_gen.
+Followed by num_chips machine_table_index_t entries and then the tables
+themselves, each a series of spin1_rtr_entry_t structs.
+"""
+machine_table_header_t = struct.Struct( "<" # Little endian, standard sizes
+                                      + "4s" # char[4] magic (MACHINE_TABLE_MAGIC)
+                                      + "I"  # uint    num_chips
+                                      )
+
+"""
+An entry in the index of a machine-wide routing table file.
+"""
+machine_table_index_t = struct.Struct( "<" # Little endian, standard sizes
+                                     + "h" # short  chip x (may be negative)
+                                     + "h" # short  chip y (may be negative)
+                                     + "I" # uint   offset (bytes from start of file)
+                                     + "I" # uint   count (number of entries)
+                                     )
+
+"""
+Magic number at the start of a machine-wide routing table file.
+"""
+MACHINE_TABLE_MAGIC = "SRTB"
+
+
 """
 Encodings for router link directions.
 """
@@ -47,9 +88,62 @@ for core in range(18):
 	LINK_BITS[model.Router.INTERNAL_PORTS[core]] = 1<<(core + 6)
 
 
+"""
+The array typecode of an unsigned 32-bit word on this platform.
+"""
+WORD_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
+
+
+def needs_entry(incoming_port, outgoing_ports):
+	"""
+	Returns True if a router forwarding a route arriving on incoming_port to the
+	given outgoing ports requires a routing table entry.
+	"""
+	# Routes which simply forward packets without changing their
+	# direction/forking are default routed and do not require a table entry.
+	return not ( incoming_port in model.Router.EXTERNAL_PORTS
+	             and len(outgoing_ports) == 1
+	             and topology.opposite(incoming_port) in outgoing_ports
+	           )
+
+
+def count_key_entries(keys):
+	"""
+	Returns the number of routing table entries a router requires to route the
+	given list of keys (e.g. those of a RouteGroup) in the same direction once
+	merged (see minimise_entries).
+	"""
+	if len(keys) == 1:
+		return 1
+	return len(minimise_entries((0, key, 0xFFFFFFFF) for key in keys))
+
+
+def _cached(router, name, generate):
+	"""
+	Return the value of generate() cached in the router's table cache under the
+	given name, calling it only if no value has been cached since the router's
+	routes last changed.
+	"""
+	if name not in router.table_cache:
+		router.table_cache[name] = generate()
+	return router.table_cache[name]
+
+
 def get_router_entries(router):
 	"""
-	Given a router, returns a list of (route_bits, key, mask) tuples.
+	Given a router, returns a list of (route_bits, key, mask) tuples. The keys of
+	each RouteGroup are merged into as few entries as possible.
+	
+	The list is cached in the router until its routes change and so must not be
+	modified.
+	"""
+	return _cached(router, "entries", lambda: _get_router_entries(router))
+
+
+@instrument.timed("table_gen.get_router_entries")
+def _get_router_entries(router):
+	"""
+	Generate the (uncached) list of (route_bits, key, mask) tuples for a router.
 	"""
 	# A list of (route_bits, key, mask) tuples corresponding to the router entries
 	# required.
@@ -57,50 +151,730 @@ def get_router_entries(router):
 	
 	# Work out what routing entries are required
 	for route, (incoming_port, outgoing_ports) in router.routes.iteritems():
-		# Routes which simply forward packets without changing their
-		# direction/forking are default routed and do not require a table entry.
-		if not ( incoming_port in model.Router.EXTERNAL_PORTS \
-		         and len(outgoing_ports) == 1 \
-		         and topology.opposite(incoming_port) in outgoing_ports
-		       ):
+		if needs_entry(incoming_port, outgoing_ports):
 			route_bits = sum(LINK_BITS[port] for port in outgoing_ports)
-			key = route.key
-			mask = 0xFFFFFFFF
-			table_entries.append((route_bits, key, mask))
+			keys = route.keys
+			if len(keys) == 1:
+				key = keys[0]
+				mask = 0xFFFFFFFF
+				table_entries.append((route_bits, key, mask))
+			else:
+				table_entries.extend(minimise_entries((route_bits, key, 0xFFFFFFFF)
+				                                      for key in keys))
+	
+	if instrument.enabled:
+		instrument.count("table_gen.entries_generated", len(table_entries))
 	
 	return table_entries
 
 
-def ybug_table_gen(router):
+@instrument.timed("table_gen.minimise_entries")
+def minimise_entries(table_entries):
 	"""
-	Generate a routing table description file for a given router based on the
-	format used for loading by ybug.
+	Given a list of (route_bits, key, mask) tuples, merge pairs of entries with
+	the same route and mask whose keys differ in a single (masked) bit into a
+	single entry, repeating until no further merges are possible. Since every
+	merged entry matches exactly the keys of the entries it replaces, the result
+	routes the same keys identically regardless of entry order.
+	
+	Returns a new list of (route_bits, key, mask) tuples sorted by route and key.
 	"""
+	# {route_bits: set([(key, mask), ...]), ...}
+	by_route = {}
+	for route_bits, key, mask in table_entries:
+		by_route.setdefault(route_bits, set()).add((key & mask, mask))
 	
-	table_entries = get_router_entries(router)
+	minimised = []
+	for route_bits, entries in sorted(by_route.iteritems()):
+		merged = True
+		while merged:
+			merged = False
+			for bit_num in range(32):
+				bit = 1<<bit_num
+				new_entries = set()
+				for key, mask in entries:
+					if not mask & bit:
+						new_entries.add((key, mask))
+					elif not key & bit:
+						# Merge with the partner entry if present
+						if (key | bit, mask) in entries:
+							new_entries.add((key, mask & ~bit & 0xFFFFFFFF))
+							merged = True
+						else:
+							new_entries.add((key, mask))
+					elif (key & ~bit, mask) not in entries:
+						# Only keep entries whose partner doesn't exist (otherwise they are
+						# merged above)
+						new_entries.add((key, mask))
+				entries = new_entries
+		
+		minimised.extend((route_bits, key, mask) for (key, mask) in sorted(entries))
+	
+	return minimised
+
+
+def get_minimised_router_entries(router):
+	"""
+	Given a router, returns its entries (as get_router_entries) after being
+	merged by minimise_entries. The list is cached in the router until its routes
+	change and so must not be modified.
+	"""
+	return _cached(router, "minimised", lambda: minimise_entries(get_router_entries(router)))
+
+
+def set_router_entries(router, table_entries):
+	"""
+	Replace the entries generated for a router (as returned by
+	get_router_entries and used by the table generators) with the given list of
+	(route_bits, key, mask) tuples, e.g. a minimised or externally generated
+	table. The replacement is discarded along with the rest of the router's
+	cache when its routes change.
+	"""
+	router.invalidate_table_cache()
+	router.table_cache["entries"] = table_entries
+
+
+def ybug_table_size(num_entries):
+	"""
+	Returns the number of bytes occupied by a ybug table with the given number of
+	entries (including the terminating entry).
+	"""
+	return ybug_rtr_entry_t.size * (num_entries + 1)
+
+
+def ybug_table_pack_into(table_entries, buf, offset = 0):
+	"""
+	Pack a list of (route_bits, key, mask) tuples into the writable buffer buf
+	(e.g. a bytearray, memoryview or mmap) starting at the given offset in the
+	format used for loading by ybug. The buffer must have at least
+	ybug_table_size(len(table_entries)) bytes available after offset.
+	
+	Returns the offset of the first byte after the packed table.
+	"""
+	num_entries = len(table_entries)
+	_check_ybug_size(num_entries)
+	pack_into   = ybug_rtr_entry_t.pack_into
+	entry_size  = ybug_rtr_entry_t.size
 	
-	# Generate the binary formatted table entries
-	out = ""
 	for entry_num, (route_bits, key, mask) in enumerate(table_entries):
-		out += ybug_rtr_entry_t.pack(entry_num, len(table_entries), route_bits, key, mask)
+		pack_into(buf, offset, entry_num, num_entries, route_bits, key, mask)
+		offset += entry_size
 	
 	# Terminate with an empty all-ones entry
-	out += ybug_rtr_entry_t.pack(0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF)
+	pack_into(buf, offset, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF)
+	
+	if instrument.enabled:
+		instrument.count("table_gen.bytes_packed", entry_size * (num_entries + 1))
+	
+	return offset + entry_size
+
+
+def _check_ybug_size(num_entries):
+	"""
+	Raise a ValueError if a table with the given number of entries cannot be
+	represented in the ybug format.
+	"""
+	if num_entries > YBUG_MAX_ENTRIES:
+		raise ValueError("A ybug table can hold at most %d entries, not %d!"%(
+		                 YBUG_MAX_ENTRIES, num_entries))
+
+
+def spin1_table_size(num_entries):
+	"""
+	Returns the number of bytes occupied by a spin1 table with the given number of
+	entries.
+	"""
+	return spin1_rtr_entry_t.size * num_entries
+
+
+def spin1_table_pack_into(table_entries, buf, offset = 0):
+	"""
+	Pack a list of (route_bits, key, mask) tuples into the writable buffer buf
+	starting at the given offset in the format used by the spin1 API. The buffer
+	must have at least spin1_table_size(len(table_entries)) bytes available after
+	offset.
+	
+	Returns the offset of the first byte after the packed table.
+	"""
+	pack_into  = spin1_rtr_entry_t.pack_into
+	entry_size = spin1_rtr_entry_t.size
+	
+	for route_bits, key, mask in table_entries:
+		pack_into(buf, offset, key, mask, route_bits)
+		offset += entry_size
+	
+	if instrument.enabled:
+		instrument.count("table_gen.bytes_packed", entry_size * len(table_entries))
+	
+	return offset
+
+
+def ybug_table_buffer(router):
+	"""
+	Generate a ybug routing table for the given router into a newly allocated
+	bytearray.
+	"""
+	table_entries = get_router_entries(router)
+	
+	buf = bytearray(ybug_table_size(len(table_entries)))
+	ybug_table_pack_into(table_entries, buf)
+	
+	return buf
+
+
+def spin1_table_buffer(router):
+	"""
+	Generate a spin1 routing table for the given router into a newly allocated
+	bytearray. Returns a tuple (num_entries, bytearray).
+	"""
+	table_entries = get_router_entries(router)
+	
+	buf = bytearray(spin1_table_size(len(table_entries)))
+	spin1_table_pack_into(table_entries, buf)
 	
-	return out
+	return len(table_entries), buf
+
+
+def ybug_table_gen(router):
+	"""
+	Generate a routing table description file for a given router based on the
+	format used for loading by ybug. The result is cached in the router until its
+	routes change.
+	"""
+	return _cached(router, "ybug", lambda: bytes(ybug_table_buffer(router)))
 
 
 def spin1_table_gen(router):
 	"""
 	Generate a routing table description file suitable for loading via the
 	spin1 API. Returns a tuple (num_entries, data) where data is a packed series of
-	tripples key, mask and route.
+	tripples key, mask and route. The result is cached in the router until its
+	routes change.
+	"""
+	def generate():
+		num_entries, buf = spin1_table_buffer(router)
+		return num_entries, bytes(buf)
+	return _cached(router, "spin1", generate)
+
+
+def ybug_table_write(router, f):
+	"""
+	Write the ybug routing table for the given router directly to the file-like
+	object f. Returns the number of bytes written.
 	"""
+	data = ybug_table_gen(router)
+	f.write(data)
+	return len(data)
+
+
+def spin1_table_write(router, f):
+	"""
+	Write the spin1 routing table for the given router directly to the file-like
+	object f. Returns the number of entries written.
+	"""
+	num_entries, data = spin1_table_gen(router)
+	f.write(data)
+	return num_entries
+
+
+@instrument.timed("table_gen.machine_table_gen")
+def machine_table_gen(chips, f):
+	"""
+	Write the routing tables of every router in chips (a dict {(x,y): (router,
+	cores), ...}) to the file-like object f as a single machine-wide table file.
 	
-	table_entries = get_router_entries(router)
+	The file consists of a machine_table_header_t followed by an index of
+	machine_table_index_t entries (one per chip, sorted by position) giving the
+	location of each chip's table which are stored as spin1_rtr_entry_t structs.
+	The whole file is packed into a single buffer and written in one go. Returns
+	the number of bytes written.
+	"""
+	positions = sorted(chips.iterkeys())
+	all_entries = [get_router_entries(chips[position].router) for position in positions]
 	
-	out = ""
-	for entry_num, (route_bits, key, mask) in enumerate(table_entries):
-		out += spin1_rtr_entry_t.pack(key, mask, route_bits)
+	# Lay out the tables after the header and index
+	offset = machine_table_header_t.size + (machine_table_index_t.size * len(positions))
+	offsets = []
+	for table_entries in all_entries:
+		offsets.append(offset)
+		offset += spin1_table_size(len(table_entries))
+	
+	buf = bytearray(offset)
+	
+	machine_table_header_t.pack_into(buf, 0, MACHINE_TABLE_MAGIC, len(positions))
+	index_offset = machine_table_header_t.size
+	for (x,y), table_offset, table_entries in zip(positions, offsets, all_entries):
+		machine_table_index_t.pack_into(buf, index_offset, x, y, table_offset, len(table_entries))
+		index_offset += machine_table_index_t.size
+		
+		spin1_table_pack_into(table_entries, buf, table_offset)
+	
+	f.write(buf)
+	
+	return len(buf)
+
+
+class MachineTableFile(object):
+	"""
+	A read-only, memory-mapped view of a file produced by machine_table_gen.
+	Only the index is read when the file is opened, individual chips' tables are
+	read from the mapping on demand.
+	"""
+	
+	def __init__(self, filename):
+		with open(filename, "rb") as f:
+			self.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		
+		magic, num_chips = machine_table_header_t.unpack_from(self.mmap, 0)
+		if magic != MACHINE_TABLE_MAGIC:
+			self.mmap.close()
+			raise Exception("%s is not a machine routing table file!"%(repr(filename)))
+		
+		# The index of the file {(x,y): (offset, count), ...}
+		self.index = {}
+		index_offset = machine_table_header_t.size
+		for _ in range(num_chips):
+			x, y, offset, count = machine_table_index_t.unpack_from(self.mmap, index_offset)
+			self.index[(x,y)] = (offset, count)
+			index_offset += machine_table_index_t.size
+	
+	
+	def __enter__(self):
+		return self
+	
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+	
+	
+	def close(self):
+		self.mmap.close()
+	
+	
+	def __contains__(self, position):
+		return position in self.index
+	
+	
+	def __len__(self):
+		return len(self.index)
+	
+	
+	def positions(self):
+		"""
+		Returns a sorted list of the (x,y) positions of the chips in the file.
+		"""
+		return sorted(self.index.iterkeys())
+	
+	
+	def get_spin1_table(self, position):
+		"""
+		Returns a tuple (num_entries, data) for the chip at the given position where
+		data is a (zero-copy) buffer into the file in the same format as produced
+		by spin1_table_gen.
+		"""
+		offset, count = self.index[position]
+		return count, buffer(self.mmap, offset, spin1_table_size(count))
+	
+	
+	def get_entries(self, position):
+		"""
+		Returns a list of (route_bits, key, mask) tuples for the chip at the given
+		position as produced by get_router_entries.
+		"""
+		offset, count = self.index[position]
+		
+		unpack_from = spin1_rtr_entry_t.unpack_from
+		table_entries = []
+		for _ in range(count):
+			key, mask, route_bits = unpack_from(self.mmap, offset)
+			table_entries.append((route_bits, key, mask))
+			offset += spin1_rtr_entry_t.size
+		
+		return table_entries
+
+
+class RoutingTable(object):
+	"""
+	A routing table stored as a flat array of unsigned 32-bit words laid out
+	exactly as a series of spin1_rtr_entry_t structs, i.e. (key, mask, route)
+	triples. Columns of the table are extracted and manipulated using array
+	slicing rather than by iterating over entries in Python.
+	"""
+	
+	# Number of words per entry and the offsets of each field within an entry.
+	WORDS_PER_ENTRY = 3
+	KEY   = 0
+	MASK  = 1
+	ROUTE = 2
+	
+	def __init__(self, words = None):
+		"""
+		words is an optional iterable of words in the layout described above.
+		"""
+		self.words = array.array(WORD_TYPECODE, words if words is not None else [])
+		assert(len(self.words) % RoutingTable.WORDS_PER_ENTRY == 0)
+	
+	
+	@classmethod
+	def from_entries(cls, table_entries):
+		"""
+		Create a table from a list of (route_bits, key, mask) tuples as produced by
+		get_router_entries.
+		"""
+		table = cls()
+		for route_bits, key, mask in table_entries:
+			table.words.extend((key, mask, route_bits))
+		return table
+	
+	
+	@classmethod
+	def from_columns(cls, keys, masks, routes):
+		"""
+		Create a table from three equal-length sequences of keys, masks and route
+		bits.
+		"""
+		assert(len(keys) == len(masks) == len(routes))
+		table = cls(array.array(WORD_TYPECODE, [0]) * (len(keys) * RoutingTable.WORDS_PER_ENTRY))
+		table.words[RoutingTable.KEY::RoutingTable.WORDS_PER_ENTRY]   = array.array(WORD_TYPECODE, keys)
+		table.words[RoutingTable.MASK::RoutingTable.WORDS_PER_ENTRY]  = array.array(WORD_TYPECODE, masks)
+		table.words[RoutingTable.ROUTE::RoutingTable.WORDS_PER_ENTRY] = array.array(WORD_TYPECODE, routes)
+		return table
+	
+	
+	def __len__(self):
+		return len(self.words) // RoutingTable.WORDS_PER_ENTRY
+	
+	
+	def __getitem__(self, entry_num):
+		"""
+		Returns the given entry as a (route_bits, key, mask) tuple.
+		"""
+		start = entry_num * RoutingTable.WORDS_PER_ENTRY
+		key, mask, route_bits = self.words[start:start + RoutingTable.WORDS_PER_ENTRY]
+		return (route_bits, key, mask)
+	
+	
+	def __iter__(self):
+		"""
+		Iterate over the table as (route_bits, key, mask) tuples.
+		"""
+		return iter(zip(self.routes, self.keys, self.masks))
+	
+	
+	def __eq__(self, other):
+		return isinstance(other, RoutingTable) and self.words == other.words
+	
+	
+	def __ne__(self, other):
+		return not (self == other)
+	
+	
+	def __repr__(self):
+		return "RoutingTable(%s)"%(repr(list(self)))
+	
+	
+	@property
+	def keys(self):
+		"""
+		An array of the keys of every entry.
+		"""
+		return self.words[RoutingTable.KEY::RoutingTable.WORDS_PER_ENTRY]
+	
+	
+	@property
+	def masks(self):
+		"""
+		An array of the masks of every entry.
+		"""
+		return self.words[RoutingTable.MASK::RoutingTable.WORDS_PER_ENTRY]
+	
+	
+	@property
+	def routes(self):
+		"""
+		An array of the route bits of every entry.
+		"""
+		return self.words[RoutingTable.ROUTE::RoutingTable.WORDS_PER_ENTRY]
+	
+	
+	def select(self, entry_nums):
+		"""
+		Returns a new table containing only the given entries (in the order given).
+		"""
+		keys   = self.keys
+		masks  = self.masks
+		routes = self.routes
+		return RoutingTable.from_columns( map(keys.__getitem__, entry_nums)
+		                                , map(masks.__getitem__, entry_nums)
+		                                , map(routes.__getitem__, entry_nums)
+		                                )
+	
+	
+	def sorted(self, column = KEY, reverse = False):
+		"""
+		Returns a new table sorted (stably) by the given column (one of
+		RoutingTable.KEY, MASK or ROUTE).
+		"""
+		values = self.words[column::RoutingTable.WORDS_PER_ENTRY]
+		return self.select(sorted(xrange(len(values)), key = values.__getitem__, reverse = reverse))
+	
+	
+	def filter(self, predicate, column = ROUTE):
+		"""
+		Returns a new table containing only those entries whose value in the given
+		column satisfies the predicate.
+		"""
+		values = self.words[column::RoutingTable.WORDS_PER_ENTRY]
+		return self.select([n for n, value in enumerate(values) if predicate(value)])
+	
+	
+	def count(self, column = ROUTE):
+		"""
+		Returns a dictionary {value: count, ...} giving the number of entries with
+		each value in the given column.
+		"""
+		return collections.Counter(self.words[column::RoutingTable.WORDS_PER_ENTRY])
+	
+	
+	def spin1_buffer(self):
+		"""
+		Returns the table in the format produced by spin1_table_gen. On
+		little-endian hosts this is a buffer sharing the table's memory.
+		"""
+		if sys.byteorder == "little":
+			return buffer(self.words)
+		else:
+			words = array.array(WORD_TYPECODE, self.words)
+			words.byteswap()
+			return buffer(words)
+	
+	
+	def ybug_buffer(self):
+		"""
+		Returns the table as a bytearray in the format produced by ybug_table_gen.
+		"""
+		num_entries = len(self)
+		_check_ybug_size(num_entries)
+		
+		# The table is laid out as four words per entry, the first holding the
+		# entry number and the total number of entries.
+		words = array.array(WORD_TYPECODE, [0xFFFFFFFF]) * ((num_entries + 1) * 4)
+		words[0:num_entries*4:4] = array.array(WORD_TYPECODE, xrange(num_entries<<16, (num_entries<<16) + num_entries))
+		words[1:num_entries*4:4] = self.routes
+		words[2:num_entries*4:4] = self.keys
+		words[3:num_entries*4:4] = self.masks
+		
+		if sys.byteorder != "little":
+			words.byteswap()
+		return bytearray(buffer(words))
+
+
+def get_router_table(router):
+	"""
+	Given a router, returns a RoutingTable containing the entries produced by
+	get_router_entries.
+	"""
+	return RoutingTable.from_entries(get_router_entries(router))
+
+
+def _map_file(filename):
+	"""
+	Returns a read-only memory mapping of the given file (or an empty string for
+	empty files which cannot be mapped).
+	"""
+	with open(filename, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return ""
+		return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+def _words_from_buffer(data):
+	"""
+	Returns an array of the little-endian 32-bit words in the given buffer.
+	"""
+	words = array.array(WORD_TYPECODE)
+	words.fromstring(data)
+	if sys.byteorder != "little":
+		words.byteswap()
+	return words
+
+
+def load_ybug_table(filename):
+	"""
+	Load a routing table file in the format produced by ybug_table_gen and
+	return it as a RoutingTable. The file is memory-mapped and converted in bulk
+	rather than parsed entry-by-entry.
+	"""
+	data = _map_file(filename)
+	try:
+		# The number of entries is given in every entry, the terminating entry
+		# marks it as 0xFFFF.
+		next_, free = struct.unpack_from("<HH", data, 0)
+		num_entries = 0 if next_ == 0xFFFF else free
+		
+		if len(data) < ybug_table_size(num_entries):
+			raise Exception("%s is truncated!"%(repr(filename)))
+		
+		words = _words_from_buffer(buffer(data, 0, ybug_rtr_entry_t.size * num_entries))
+	finally:
+		if not isinstance(data, str):
+			data.close()
+	
+	return RoutingTable.from_columns(words[2::4], words[3::4], words[1::4])
+
+
+def load_spin1_table(filename):
+	"""
+	Load a routing table file containing the data produced by spin1_table_gen
+	(i.e. a series of key, mask, route triples) and return it as a RoutingTable.
+	"""
+	data = _map_file(filename)
+	try:
+		if len(data) % spin1_rtr_entry_t.size != 0:
+			raise Exception("%s is not a whole number of entries long!"%(repr(filename)))
+		
+		words = _words_from_buffer(buffer(data))
+	finally:
+		if not isinstance(data, str):
+			data.close()
+	
+	return RoutingTable(words)
+
+
+def populate_routes(chips, tables, sources = None):
+	"""
+	Given a set of chips with empty routing tables and a dict {(x,y): table, ...}
+	of tables (RoutingTables or lists of (route_bits, key, mask) tuples) for those
+	chips, fill in Router.routes, Core.sources and Core.sinks to match the tables.
+	Hops which were default routed (and so have no table entry) are reconstructed
+	by following the links from the routers which send packets towards them.
+	
+	Every entry must have an all-ones mask. Since tables do not record which core
+	sourced a route, sources may optionally give a dict {key: core_id, ...} of the
+	core on the chip at the start of each route which sources it. Routes not
+	listed are sourced by core 0 of that chip as a placeholder.
+	
+	Returns a dict {key: Route, ...} of the routes created.
+	"""
+	if sources is None:
+		sources = {}
+	
+	routes = {}
+	
+	# (router, route, outgoing_ports) for every entry in the tables.
+	entries = []
+	
+	# Create the entries described in the tables
+	for position, table in tables.iteritems():
+		router = chips[position].router
+		for route_bits, key, mask in table:
+			if mask != 0xFFFFFFFF:
+				raise Exception("Cannot reconstruct routes from entries with masks (key 0x%08X at %s)!"%(
+				                key, repr(position)))
+			
+			route = routes.setdefault(key, model.Route(key))
+			outgoing_ports = [port for port in model.Router.INTERNAL_PORTS + model.Router.EXTERNAL_PORTS
+			                  if LINK_BITS[port] & route_bits]
+			router.routes[route] = (None, outgoing_ports)
+			router.invalidate_table_cache()
+			entries.append((router, route, outgoing_ports))
+	
+	# Follow each outgoing link to find the next router with an entry, filling in
+	# default-routed hops along the way.
+	for router, route, outgoing_ports in entries:
+		for port in outgoing_ports:
+			if port in model.Router.INTERNAL_PORTS:
+				router.connections[port].sinks.add(route)
+				continue
+			
+			next_router = router.connections[port]
+			incoming_port = topology.opposite(port)
+			while next_router is not None:
+				if route in next_router.routes:
+					if next_router.routes[route][0] is None:
+						next_router.routes[route] = (incoming_port, next_router.routes[route][1])
+					# The route must only enter a router in one direction.
+					assert(next_router.routes[route][0] == incoming_port)
+					break
+				
+				# Default routed: continue straight on
+				outgoing_port = topology.opposite(incoming_port)
+				next_router.routes[route] = (incoming_port, [outgoing_port])
+				next_router.invalidate_table_cache()
+				next_router = next_router.connections[outgoing_port]
+	
+	# Routes which no other router sends into start at the router in question: attach
+	# their source cores.
+	for router, route, outgoing_ports in entries:
+		if router.routes[route][0] is None:
+			core_id = sources.get(route.key, 0)
+			core = chips[router.position].cores[core_id]
+			router.routes[route] = (model.Router.INTERNAL_PORTS[core_id], outgoing_ports)
+			core.sources.add(route)
+	
+	return routes
+
+
+"""
+Functions producing the contents of a table file in each supported format.
+"""
+TABLE_FORMATS = {
+	"ybug"  : ybug_table_gen,
+	"spin1" : lambda router: spin1_table_gen(router)[1],
+}
+
+
+@instrument.timed("table_gen.write_tables")
+def write_tables( chips, directory = "."
+                , filename_format = "routing_table_%d_%d.bin"
+                , table_format = "ybug"
+                , manifest_filename = "manifest.json"
+                ):
+	"""
+	Write a routing table file for every router in chips (a dict {(x,y): (router,
+	cores), ...}) into the given directory, skipping files whose contents have
+	not changed since they were last written.
+	
+	A manifest giving the SHA-1 hash of each file's contents is kept in the
+	directory. A file is only written if its hash differs from the one in the
+	manifest (or the file is missing).
+	
+	filename_format is formatted with (x,y) to give each file's name and
+	table_format is a key of TABLE_FORMATS.
+	
+	Returns a sorted list of the (x,y) positions of the chips whose tables were
+	written.
+	"""
+	manifest_path = os.path.join(directory, manifest_filename)
+	
+	# The manifest is of the form {filename: hash, ...}
+	try:
+		with open(manifest_path, "r") as f:
+			manifest = json.load(f)
+	except IOError:
+		manifest = {}
+	
+	generate = TABLE_FORMATS[table_format]
+	
+	changed = []
+	for position, (router, cores) in chips.iteritems():
+		data = generate(router)
+		digest = hashlib.sha1(data).hexdigest()
+		
+		filename = filename_format%position
+		path = os.path.join(directory, filename)
+		if manifest.get(filename) == digest and os.path.exists(path):
+			continue
+		
+		with open(path, "wb") as f:
+			f.write(data)
+		manifest[filename] = digest
+		changed.append(position)
+	
+	# Replace the manifest only once all tables have been written
+	if changed:
+		with open(manifest_path + ".tmp", "w") as f:
+			json.dump(manifest, f, indent = 0, sort_keys = True)
+		os.rename(manifest_path + ".tmp", manifest_path)
 	
-	return len(table_entries), out
+	return sorted(changed)
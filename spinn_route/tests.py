@@ -6,13 +6,32 @@ Unit tests. Not comprehensive but just quick and dirty... Usage:
 python tests.py
 """
 
+import os
+import json
+import array
+import random
+import shutil
 import unittest
 import pprint
+import tempfile
+import StringIO
 
 import topology
 import model
 import routers
 import table_gen
+import verify
+import keys
+import analysis
+import traffic
+import simulator
+import benchmark
+import instrument
+import netlist
+import cli
+import place
+import faults
+import index
 
 class TopologyTests(unittest.TestCase):
 	"""
@@ -338,6 +357,24 @@ class UtilTests(unittest.TestCase):
 					self.assertIsNone(chips[other_chip_position].router.connections[topology.opposite(port)])
 	
 	
+	def test_get_emergency_route(self):
+		"""
+		Test that emergency routes travel around the other two sides of the
+		triangle and reach the same router as the blocked link.
+		"""
+		chips = model.make_rectangular_board(3, 3, wrap_around = True)
+		router = chips[(1,1)].router
+		for port in model.Router.EXTERNAL_PORTS:
+			first_port, intermediate_router, second_port = model.get_emergency_route(router, port)
+			self.assertIs(router.connections[first_port], intermediate_router)
+			self.assertIs(intermediate_router.connections[second_port], router.connections[port])
+		
+		# No emergency route exists at the edge of a board without wrap-around
+		chips = model.make_rectangular_board(3, 3)
+		self.assertIsNone(model.get_emergency_route(chips[(0,0)].router, topology.SOUTH))
+		self.assertIsNotNone(model.get_emergency_route(chips[(0,0)].router, topology.EAST))
+	
+	
 	def test_make_rectangular_board(self):
 		"""
 		Test that a model.make_rectangular_board creates the appropriate formation
@@ -617,6 +654,78 @@ class RoutersTests(unittest.TestCase):
 		
 		self.assertFalse(node_sequences)
 		self.assertEqual(len(unrouted_sinks), 1)
+	
+	
+	def test_minimal_entry_route(self):
+		"""
+		Test that minimal-entry routing produces shortest paths which need no more
+		table entries than dimension order routing.
+		"""
+		for wrap_around in (True, False):
+			entries = []
+			for router_fn in (routers.dimension_order_route, routers.minimal_entry_route):
+				chips = model.make_rectangular_board(6, 6, wrap_around = wrap_around)
+				source = chips[(1,1)].cores[0]
+				sinks = [ chips[(4,1)].cores[0], chips[(4,3)].cores[0]
+				        , chips[(4,4)].cores[1], chips[(2,4)].cores[0]
+				        , chips[(1,1)].cores[2]
+				        ]
+				node_sequences, unrouted_sinks = router_fn( source, sinks, chips
+				                                          , use_wrap_around = wrap_around
+				                                          )
+				self.assertFalse(unrouted_sinks)
+				self.assertEqual(set(s[-1] for s in node_sequences), set(sinks))
+				
+				route = model.Route(0)
+				for node_sequence in node_sequences:
+					self.assertEqual(node_sequence[0], source)
+					self.assertTrue(model.is_path_connected(node_sequence))
+					model.add_route(route, node_sequence)
+				
+				self.assertEqual(verify.verify_tables(chips), [])
+				entries.append(sum(len(table_gen.get_router_entries(router))
+				                   for (router, cores) in chips.itervalues()))
+				
+				# Paths are the same length in both cases
+				lengths = sorted(len(s) for s in node_sequences)
+				if router_fn is routers.dimension_order_route:
+					dor_lengths = lengths
+				else:
+					self.assertEqual(lengths, dor_lengths)
+			
+			self.assertLessEqual(entries[1], entries[0])
+	
+	
+	def test_minimal_entry_route_avoids_full_routers(self):
+		"""
+		Test that minimal-entry routing avoids adding entries to full routers.
+		"""
+		chips = model.make_rectangular_board(3, 3)
+		
+		# Fill (1,0)'s table with routes which turn a corner
+		for key in range(10):
+			model.add_route(model.Route(100 + key), [ chips[(1,0)].cores[key]
+			                                        , chips[(1,0)].router
+			                                        , chips[(1,0)].cores[key]
+			                                        ])
+		
+		# The path may turn at (1,0) or (1,1), (1,0) is chosen unless it is full
+		for table_capacity, uses_full_router in ((1024, True), (10, False)):
+			node_sequences, unrouted_sinks = \
+				routers.minimal_entry_route( chips[(0,0)].cores[0], [chips[(2,1)].cores[0]], chips
+				                           , table_capacity = table_capacity
+				                           )
+			self.assertFalse(unrouted_sinks)
+			self.assertEqual(len(node_sequences[0]), 5)
+			self.assertEqual(chips[(1,0)].router in node_sequences[0], uses_full_router)
+		
+		# A group whose entries would fill the router also avoids it
+		for keys, uses_full_router in (([0x1000], True), ([0x1000, 0x2000, 0x4000], False)):
+			node_sequences, unrouted_sinks = \
+				routers.minimal_entry_route( chips[(0,0)].cores[0], [chips[(2,1)].cores[0]], chips
+				                           , table_capacity = 12, keys = keys
+				                           )
+			self.assertEqual(chips[(1,0)].router in node_sequences[0], uses_full_router)
 
 
 
@@ -778,6 +887,1638 @@ class TableGenTests(unittest.TestCase):
 		
 		# No expected entries were missing
 		self.assertEqual(len(EXPECTED_ENTRIES), 0)
+	
+	
+	def test_pack_into(self):
+		"""
+		Ensure that tables can be packed into an existing buffer at an offset
+		and match the tables produced by the generators.
+		"""
+		router = self.chips[(1,1)].router
+		entries = table_gen.get_router_entries(router)
+		
+		# ybug format, packed after some padding
+		buf = bytearray(3 + table_gen.ybug_table_size(len(entries)))
+		end = table_gen.ybug_table_pack_into(entries, buf, 3)
+		self.assertEqual(end, len(buf))
+		self.assertEqual(buf[:3], "\x00"*3)
+		self.assertEqual(buf[3:], table_gen.ybug_table_gen(router))
+		
+		# spin1 format, packed via a memoryview
+		buf = bytearray(table_gen.spin1_table_size(len(entries)))
+		end = table_gen.spin1_table_pack_into(entries, memoryview(buf))
+		self.assertEqual(end, len(buf))
+		self.assertEqual(buf, table_gen.spin1_table_gen(router)[1])
+	
+	
+	def test_table_write(self):
+		"""
+		Ensure that tables written directly to a file match the generated tables.
+		"""
+		router = self.chips[(1,2)].router
+		
+		f = StringIO.StringIO()
+		self.assertEqual(table_gen.ybug_table_write(router, f), 32)
+		self.assertEqual(f.getvalue(), table_gen.ybug_table_gen(router))
+		
+		f = StringIO.StringIO()
+		self.assertEqual(table_gen.spin1_table_write(router, f), 1)
+		self.assertEqual(f.getvalue(), table_gen.spin1_table_gen(router)[1])
+	
+	
+	def test_machine_table(self):
+		"""
+		Ensure that a machine-wide table file contains every router's table and
+		can be read back.
+		"""
+		# Hexagonal boards have negative coordinates
+		hex_chips = model.make_hexagonal_board(2)
+		router = hex_chips[sorted(hex_chips)[0]].router
+		model.add_route(model.Route(0), [ router.connections[model.Router.INTERNAL_PORTS[0]]
+		                                , router
+		                                , router.connections[topology.EAST]
+		                                , router.connections[topology.EAST].connections[
+		                                    model.Router.INTERNAL_PORTS[1]]
+		                                ])
+		self.assertLess(router.position[0], 0)
+		
+		for chips in (self.chips, hex_chips):
+			fd, filename = tempfile.mkstemp()
+			try:
+				with os.fdopen(fd, "wb") as f:
+					size = table_gen.machine_table_gen(chips, f)
+				self.assertEqual(size, os.path.getsize(filename))
+				
+				with table_gen.MachineTableFile(filename) as table_file:
+					self.assertEqual(table_file.positions(), sorted(chips.iterkeys()))
+					
+					for position, (router, cores) in chips.iteritems():
+						self.assertIn(position, table_file)
+						self.assertEqual( table_file.get_entries(position)
+						                , table_gen.get_router_entries(router)
+						                )
+						num_entries, data = table_file.get_spin1_table(position)
+						self.assertEqual( (num_entries, str(data))
+						                , table_gen.spin1_table_gen(router)
+						                )
+			finally:
+				os.remove(filename)
+	
+	
+	def test_routing_table(self):
+		"""
+		Ensure that RoutingTables hold the same entries as get_router_entries and
+		pack into the same formats as the table generators.
+		"""
+		for router, cores in self.chips.itervalues():
+			table = table_gen.get_router_table(router)
+			self.assertEqual(list(table), table_gen.get_router_entries(router))
+			self.assertEqual(str(table.spin1_buffer()), table_gen.spin1_table_gen(router)[1])
+			self.assertEqual(table.ybug_buffer(), table_gen.ybug_table_gen(router))
+		
+		# The ybug format cannot describe more than 0xFFFF entries
+		words = array.array(table_gen.WORD_TYPECODE, [0]) * (3 * table_gen.YBUG_MAX_ENTRIES)
+		self.assertEqual(len(table_gen.RoutingTable(words).ybug_buffer()),
+		                 table_gen.ybug_table_size(table_gen.YBUG_MAX_ENTRIES))
+		
+		table = table_gen.RoutingTable(words + array.array(table_gen.WORD_TYPECODE, [0, 0, 0]))
+		self.assertRaises(ValueError, table.ybug_buffer)
+		self.assertRaises(ValueError, table_gen.ybug_table_pack_into, list(table), bytearray())
+	
+	
+	def test_routing_table_operations(self):
+		"""
+		Ensure that RoutingTables can be sorted, filtered and counted.
+		"""
+		table = table_gen.RoutingTable.from_entries([ (0x40, 3, 0xFFFFFFFF)
+		                                            , (0x01, 1, 0xFFFFFFFF)
+		                                            , (0x40, 2, 0xFFFFFFF0)
+		                                            ])
+		self.assertEqual(len(table), 3)
+		self.assertEqual(table[1], (0x01, 1, 0xFFFFFFFF))
+		self.assertEqual(list(table.keys), [3, 1, 2])
+		self.assertEqual(list(table.masks), [0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFF0])
+		self.assertEqual(list(table.routes), [0x40, 0x01, 0x40])
+		
+		self.assertEqual(list(table.sorted().keys), [1, 2, 3])
+		self.assertEqual( list(table.sorted(table_gen.RoutingTable.ROUTE, reverse = True).keys)
+		                , [3, 2, 1]
+		                )
+		
+		self.assertEqual( table.filter(lambda route: route & 0x40)
+		                , table_gen.RoutingTable.from_entries([ (0x40, 3, 0xFFFFFFFF)
+		                                                      , (0x40, 2, 0xFFFFFFF0)
+		                                                      ])
+		                )
+		self.assertEqual(len(table.filter(lambda mask: mask != 0xFFFFFFFF, table_gen.RoutingTable.MASK)), 1)
+		
+		self.assertEqual(table.count(), {0x40: 2, 0x01: 1})
+	
+	
+	def test_load_tables(self):
+		"""
+		Ensure that table files can be loaded back as RoutingTables.
+		"""
+		fd, filename = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			for router, cores in self.chips.itervalues():
+				with open(filename, "wb") as f:
+					table_gen.ybug_table_write(router, f)
+				self.assertEqual( table_gen.load_ybug_table(filename)
+				                , table_gen.get_router_table(router)
+				                )
+				
+				with open(filename, "wb") as f:
+					table_gen.spin1_table_write(router, f)
+				self.assertEqual( table_gen.load_spin1_table(filename)
+				                , table_gen.get_router_table(router)
+				                )
+		finally:
+			os.remove(filename)
+	
+	
+	def test_populate_routes(self):
+		"""
+		Ensure that routes can be reconstructed from a set of tables, including
+		default-routed hops.
+		"""
+		tables = dict( (position, table_gen.get_router_table(router))
+		               for (position, (router, cores)) in self.chips.iteritems()
+		             )
+		
+		chips = model.make_rectangular_board(3,3)
+		routes = table_gen.populate_routes(chips, tables, sources = {3: 1})
+		self.assertEqual(sorted(routes.iterkeys()), [0,1,2,3])
+		
+		# The same tables are produced again
+		for position, (router, cores) in chips.iteritems():
+			self.assertEqual(sorted(table_gen.get_router_table(router)), sorted(tables[position]))
+		
+		# The default-routed hop is filled in
+		self.assertEqual( chips[(1,0)].router.routes[routes[1]]
+		                , (topology.WEST, [topology.EAST])
+		                )
+		self.assertEqual( chips[(2,0)].router.routes[routes[1]]
+		                , (topology.WEST, [model.Router.INTERNAL_PORTS[0]])
+		                )
+		
+		# Sources default to core 0 unless given
+		self.assertEqual( chips[(0,0)].router.routes[routes[1]]
+		                , (model.Router.INTERNAL_PORTS[0], [topology.EAST])
+		                )
+		self.assertEqual(chips[(0,0)].cores[0].sources, set([routes[1]]))
+		self.assertEqual(chips[(1,1)].cores[1].sources, set([routes[3]]))
+		
+		# Sinks are filled in
+		self.assertEqual(chips[(2,0)].cores[0].sinks, set([routes[1]]))
+		self.assertEqual(chips[(1,1)].cores[1].sinks, set([routes[3]]))
+		
+		# The rebuilt machine is complete enough to verify
+		self.assertEqual(verify.verify_tables(chips), [])
+		self.assertEqual(verify.validate_routes(chips), [])
+		
+		# The same sinks are reached as in the original machine
+		get_sinks = lambda chips: sorted( (route.key, sorted( (model.core_to_router(sink).position, sink.core_id)
+		                                                      for sink in sinks
+		                                                    ))
+		                                  for route, (source, sinks) in model.get_all_routes(chips).iteritems()
+		                                )
+		self.assertEqual(get_sinks(chips), get_sinks(self.chips))
+		self.assertEqual( analysis.route_statistics(chips).max_path_length
+		                , analysis.route_statistics(self.chips).max_path_length
+		                )
+	
+	
+	def test_table_cache(self):
+		"""
+		Ensure that generated tables are cached until the routes through a router
+		change.
+		"""
+		router       = self.chips[(1,1)].router
+		other_router = self.chips[(0,1)].router
+		
+		table       = table_gen.ybug_table_gen(router)
+		other_table = table_gen.ybug_table_gen(other_router)
+		self.assertIs(table_gen.ybug_table_gen(router), table)
+		self.assertIs(table_gen.get_router_entries(router), table_gen.get_router_entries(router))
+		
+		# Adding a route only invalidates the routers it passes through
+		route = model.Route(4)
+		model.add_route(route, [ self.chips[(1,1)].cores[2]
+		                       , router
+		                       , self.chips[(1,2)].router
+		                       , self.chips[(1,2)].cores[2]
+		                       ])
+		self.assertIs(table_gen.ybug_table_gen(other_router), other_table)
+		self.assertEqual(len(table_gen.ybug_table_gen(router)), 16*4)
+		
+		# Removing it restores the original table
+		model.remove_route(route, self.chips[(1,1)].cores[2])
+		self.assertEqual(table_gen.ybug_table_gen(router), table)
+		self.assertIs(table_gen.ybug_table_gen(other_router), other_table)
+		self.assertNotIn(route, self.chips[(1,2)].router.routes)
+		self.assertEqual(self.chips[(1,1)].cores[2].sources, set())
+		self.assertEqual(self.chips[(1,2)].cores[2].sinks, set())
+	
+	
+	def test_write_tables(self):
+		"""
+		Ensure that table files are only rewritten when their contents change.
+		"""
+		directory = tempfile.mkdtemp()
+		try:
+			# Initially everything is written
+			self.assertEqual( table_gen.write_tables(self.chips, directory)
+			                , sorted(self.chips.iterkeys())
+			                )
+			for position, (router, cores) in self.chips.iteritems():
+				with open(os.path.join(directory, "routing_table_%d_%d.bin"%position), "rb") as f:
+					self.assertEqual(f.read(), table_gen.ybug_table_gen(router))
+			
+			# Nothing has changed
+			self.assertEqual(table_gen.write_tables(self.chips, directory), [])
+			
+			# Changing a route only rewrites the affected tables
+			model.add_route(model.Route(4), [ self.chips[(2,2)].cores[0]
+			                                , self.chips[(2,2)].router
+			                                , self.chips[(2,1)].router
+			                                , self.chips[(2,1)].cores[0]
+			                                ])
+			self.assertEqual(table_gen.write_tables(self.chips, directory), [(2,1), (2,2)])
+			
+			# Missing files are rewritten
+			os.remove(os.path.join(directory, "routing_table_0_0.bin"))
+			self.assertEqual(table_gen.write_tables(self.chips, directory), [(0,0)])
+		finally:
+			shutil.rmtree(directory)
+
+
+class VerifyTests(unittest.TestCase):
+	"""
+	Tests the routing table verifier using the network from TableGenTests.
+	"""
+	
+	setUp = TableGenTests.setUp.__func__
+	
+	
+	def test_table_lookup(self):
+		"""
+		Ensure that table lookups return the first matching entry.
+		"""
+		lookup = verify.TableLookup([ (0x1, 0x10, 0xFFFFFFFF)
+		                            , (0x2, 0x10, 0xFFFFFFF0)
+		                            , (0x4, 0x11, 0xFFFFFFFF)
+		                            , (0x8, 0x00, 0x00000000)
+		                            ])
+		self.assertEqual(lookup.lookup(0x10), 0x1)
+		self.assertEqual(lookup.lookup(0x11), 0x2)
+		self.assertEqual(lookup.lookup(0x12), 0x2)
+		self.assertEqual(lookup.lookup(0x20), 0x8)
+		
+		self.assertEqual(verify.TableLookup([]).lookup(0x10), None)
+		
+		# Entries with key bits outside their mask never match
+		lookup = verify.TableLookup([ (0x1, 0x11, 0xFFFFFFF0)
+		                            , (0x2, 0x10, 0xFFFFFFF0)
+		                            ])
+		self.assertEqual(lookup.lookup(0x10), 0x2)
+		self.assertEqual(lookup.lookup(0x11), 0x2)
+		self.assertEqual(verify.TableLookup([(0x1, 0x1, 0x0)]).lookup(0x1), None)
+	
+	
+	def test_verify_generated_tables(self):
+		"""
+		Ensure the generated tables are found to deliver all routes.
+		"""
+		self.assertEqual(verify.verify_tables(self.chips), [])
+	
+	
+	def test_verify_broken_tables(self):
+		"""
+		Ensure that missing and incorrect entries are found.
+		"""
+		tables = dict( (position, table_gen.get_router_entries(router))
+		               for (position, (router, cores)) in self.chips.iteritems()
+		             )
+		
+		# Remove the entry which sends route 1 into the network and deliver route
+		# 3 to the wrong core.
+		tables[(0,0)] = []
+		tables[(1,1)] = [ (route_bits if key != 3 else 0x100, key, mask)
+		                  for (route_bits, key, mask) in tables[(1,1)]
+		                ]
+		
+		problems = verify.verify_tables(self.chips, tables)
+		self.assertEqual(sorted(route.key for (route, problem) in problems), [1, 1, 3, 3])
+	
+	
+	def test_verify_blocked_links(self):
+		"""
+		Ensure routes remain deliverable when blocked links can be emergency
+		routed around.
+		"""
+		blocked_links = set([((1,0), topology.EAST)])
+		self.assertEqual(verify.verify_tables(self.chips, blocked_links = blocked_links), [])
+		
+		blocked_links.add(((1,0), topology.NORTH_EAST))
+		problems = verify.verify_tables(self.chips, blocked_links = blocked_links)
+		self.assertEqual(sorted(route.key for (route, problem) in problems), [1, 1])
+
+
+	def test_validate_routes(self):
+		"""
+		Ensure that valid routes pass validation and broken trees are found.
+		"""
+		self.assertEqual(verify.validate_routes(self.chips), [])
+		
+		router = lambda position: self.chips[position].router
+		routes = dict((route.key, route) for route in model.get_all_routes(self.chips))
+		
+		def problems():
+			return sorted((route.key, problem) for (route, problem)
+			              in verify.validate_routes(self.chips))
+		
+		# A dangling branch
+		router((1,0)).routes[routes[1]][1].append(topology.NORTH)
+		self.assertEqual(problems(), [(1, "route sent to Router((1, 1)) which has no entry for it")])
+		router((1,0)).routes[routes[1]][1].remove(topology.NORTH)
+		
+		# A sink which is not reached and a core reached which is not a sink
+		router((2,0)).routes[routes[1]] = (topology.WEST, [model.Router.INTERNAL_PORTS[1]])
+		self.assertEqual(problems(),
+		                 [ (1, "route reaches %s which is not a sink"%repr(self.chips[(2,0)].cores[1]))
+		                 , (1, "sink %s is not reached"%repr(self.chips[(2,0)].cores[0]))
+		                 ])
+		
+		# A route ending in the network
+		router((2,0)).routes[routes[1]] = (topology.WEST, [])
+		self.assertIn((1, "route ends at Router((2, 0)) without reaching a core"), problems())
+		router((2,0)).routes[routes[1]] = (topology.WEST, [model.Router.INTERNAL_PORTS[0]])
+		self.assertEqual(problems(), [])
+		
+		# An entry not reachable from the source
+		router((2,1)).routes[routes[1]] = (topology.SOUTH, [model.Router.INTERNAL_PORTS[0]])
+		self.assertEqual(problems(), [(1, "entry in Router((2, 1)) is not reachable from the source")])
+		del router((2,1)).routes[routes[1]]
+		
+		# Entering a router other than via its incoming port
+		outgoing_ports = router((1,1)).routes[routes[2]][1]
+		router((1,1)).routes[routes[2]] = (topology.EAST, outgoing_ports)
+		self.assertEqual(problems(), [(2, "route enters Router((1, 1)) other than via its incoming port")])
+		router((1,1)).routes[routes[2]] = (topology.NORTH, outgoing_ports)
+		
+		# A loop
+		outgoing_ports.append(topology.SOUTH)
+		router((1,0)).routes[routes[2]] = (topology.NORTH, [topology.NORTH_EAST])
+		router((2,1)).routes[routes[2]] = (topology.SOUTH_WEST, [topology.WEST])
+		self.assertEqual(problems(), [(2, "route loops back to Router((1, 1))")])
+		
+		# A route with no source
+		self.chips[(0,0)].cores[0].sources.clear()
+		self.assertIn((1, "route has 0 source cores"), problems())
+
+
+class KeysTests(unittest.TestCase):
+	"""
+	Tests minimisation and the key allocator.
+	"""
+	
+	def test_minimise_entries(self):
+		"""
+		Ensure that entries are merged only where they cover exactly the same keys
+		with the same route.
+		"""
+		M = 0xFFFFFFFF
+		self.assertEqual(table_gen.minimise_entries([]), [])
+		
+		# An aligned block of four keys merges into one entry
+		self.assertEqual( table_gen.minimise_entries([(1, 4, M), (1, 5, M), (1, 6, M), (1, 7, M)])
+		                , [(1, 4, M & ~3)]
+		                )
+		
+		# Unaligned or differently routed keys do not merge
+		self.assertEqual( sorted(table_gen.minimise_entries([(1, 3, M), (1, 4, M), (2, 5, M)]))
+		                , [(1, 3, M), (1, 4, M), (2, 5, M)]
+		                )
+		
+		# Partial blocks merge as far as possible
+		self.assertEqual( sorted(table_gen.minimise_entries([(1, 0, M), (1, 1, M), (1, 2, M)]))
+		                , [(1, 0, M & ~1), (1, 2, M)]
+		                )
+	
+	
+	def test_allocate_keys(self):
+		"""
+		Ensure that routes with identical trees are given aligned blocks of keys
+		which merge into single entries.
+		"""
+		chips = model.make_rectangular_board(3,3)
+		
+		# Several routes from each of two cores to the same sinks, given
+		# interleaved keys.
+		routes = {}
+		for core_id in range(2):
+			source = chips[(0,0)].cores[core_id]
+			sinks  = [chips[(2,1)].cores[0], chips[(0,2)].cores[1]]
+			node_sequences, unrouted = routers.dimension_order_route(source, sinks, chips)
+			for n in range(3):
+				route = model.Route(n*2 + core_id)
+				routes[route] = core_id
+				for node_sequence in node_sequences:
+					model.add_route(route, node_sequence)
+		
+		sizes_before = keys.get_table_sizes(chips)
+		
+		# The base must be aligned to the largest (8 key) block
+		self.assertRaises(ValueError, keys.allocate_keys, chips, 0x104)
+		self.assertEqual(sorted(route.key for route in routes), range(6))
+		
+		allocated = keys.allocate_keys(chips, 0x108)
+		
+		# Every route has a unique key from the base onwards
+		self.assertEqual(sorted(allocated.iterkeys()), sorted(routes.iterkeys()))
+		self.assertEqual(min(allocated.itervalues()), 0x108)
+		self.assertEqual(len(set(route.key for route in routes)), len(routes))
+		
+		# Routes from the same core occupy an aligned block of four keys
+		for core_id in range(2):
+			blocks = set(route.key & ~3 for (route, core_id_) in routes.iteritems()
+			             if core_id_ == core_id)
+			self.assertEqual(len(blocks), 1)
+		
+		# Every router now needs at most one entry per source core
+		sizes_after = keys.get_table_sizes(chips)
+		for position, size in sizes_after.iteritems():
+			self.assertLessEqual(size, 2)
+			self.assertLessEqual(size, sizes_before[position])
+		self.assertEqual(keys.get_table_sizes(chips, minimise = False)[(0,0)], 6)
+		
+		# The minimised tables still deliver every route
+		tables = dict( (position, table_gen.get_minimised_router_entries(router))
+		               for (position, (router, cores)) in chips.iteritems()
+		             )
+		self.assertEqual(verify.verify_tables(chips, tables), [])
+	
+	
+	def test_group_routes(self):
+		"""
+		Ensure that routes with identical trees are replaced by a single group
+		whose keys are merged in the tables and which is allocated aligned keys.
+		"""
+		chips = model.make_rectangular_board(3,3)
+		source = chips[(0,0)].cores[0]
+		sinks  = [chips[(2,1)].cores[0], chips[(0,2)].cores[1]]
+		node_sequences, unrouted = routers.dimension_order_route(source, sinks, chips)
+		
+		# Four identical routes and one to a different sink
+		for key in [3, 4, 5, 6]:
+			route = model.Route(key)
+			for node_sequence in node_sequences:
+				model.add_route(route, node_sequence)
+		model.add_route(model.Route(7), node_sequences[0])
+		
+		groups = keys.group_routes(chips)
+		self.assertEqual(len(groups), 1)
+		group, routes = groups.items()[0]
+		self.assertEqual(group.keys, [3, 4, 5, 6])
+		self.assertEqual([route.key for route in routes], [3, 4, 5, 6])
+		
+		# The group replaces the routes throughout the model
+		self.assertEqual(set(r.key for r in source.sources), set([3, 7]))
+		self.assertIn(group, chips[(0,2)].cores[1].sinks)
+		for router, cores in chips.itervalues():
+			for route in routes:
+				self.assertNotIn(route, router.routes)
+		self.assertEqual(verify.verify_tables(chips), [])
+		
+		# Keys in the group are merged as far as possible (4,5,6 and 3)
+		self.assertEqual(len(table_gen.get_router_entries(chips[(0,0)].router)), 3 + 1)
+		
+		# Allocation gives the group an aligned block of keys
+		keys.allocate_keys(chips)
+		self.assertEqual(group.keys[0] % 4, 0)
+		self.assertEqual(len(table_gen.get_router_entries(chips[(0,0)].router)), 1 + 1)
+		self.assertEqual(verify.verify_tables(chips), [])
+
+
+class AnalysisTests(unittest.TestCase):
+	"""
+	Tests the analyses of routed models using the network from TableGenTests.
+	"""
+	
+	setUp = TableGenTests.setUp.__func__
+	
+	def test_entry_counts(self):
+		"""
+		Ensure entry counts match the generated tables.
+		"""
+		# A group whose keys cannot be merged needs an entry per key
+		model.add_route(model.RouteGroup([0x10, 0x20, 0x40]), [ self.chips[(2,1)].cores[0]
+		                                                      , self.chips[(2,1)].router
+		                                                      , self.chips[(2,1)].cores[0]
+		                                                      ])
+		
+		counts = analysis.get_entry_counts(self.chips)
+		self.assertEqual(sorted(counts.iterkeys()), sorted(self.chips.iterkeys()))
+		self.assertEqual(counts[(2,1)], 3)
+		for position, (router, cores) in self.chips.iteritems():
+			self.assertEqual(counts[position], len(table_gen.get_router_entries(router)))
+	
+	
+	def test_capacity_report(self):
+		"""
+		Ensure overflowing chips, the histogram and occupancy are reported.
+		"""
+		report = analysis.capacity_report(self.chips, capacity = 1, bin_size = 2)
+		
+		self.assertEqual(report.overflowing, [((1,1), 2)])
+		self.assertEqual(report.histogram, [(0, 8), (2, 1)])
+		self.assertEqual(report.origin, (0,0))
+		self.assertEqual(report.occupancy, [ [1.0, 0.0, 1.0]
+		                                   , [1.0, 2.0, 0.0]
+		                                   , [1.0, 1.0, 1.0]
+		                                   ])
+		
+		# Hexagonal boards have negative coordinates
+		report = analysis.capacity_report(model.make_hexagonal_board(2))
+		self.assertEqual(report.origin, (-2,-1))
+		self.assertEqual(len(report.occupancy), 4)
+		self.assertEqual(report.occupancy[0], [0.0, 0.0, 0.0, None])
+
+
+	def test_route_statistics(self):
+		statistics = analysis.route_statistics(self.chips)
+		self.assertEqual(list(statistics.keys),             [0, 1, 2, 3])
+		self.assertEqual(list(statistics.num_keys),         [1, 1, 1, 1])
+		self.assertEqual(list(statistics.fan_out),          [1, 1, 3, 1])
+		self.assertEqual(list(statistics.routers),          [1, 3, 4, 1])
+		self.assertEqual(list(statistics.links),            [0, 2, 3, 0])
+		self.assertEqual(list(statistics.max_path_length),  [0, 2, 2, 0])
+		self.assertEqual(list(statistics.mean_path_length), [0.0, 2.0, 5.0/3.0, 0.0])
+		self.assertEqual(list(statistics.latency),          [4.0, 32.0, 32.0, 4.0])
+		
+		# The latency estimate matches an uncontended simulation
+		for route in model.get_all_routes(self.chips):
+			sim = simulator.Simulator(self.chips)
+			sim.add_traffic(route, [0])
+			self.assertEqual(sim.run().max_latency, statistics.latency[route.key])
+		
+		# Written as CSV
+		f = StringIO.StringIO()
+		analysis.write_route_statistics(statistics, f)
+		lines = f.getvalue().splitlines()
+		self.assertEqual(lines[0], "keys,num_keys,fan_out,routers,links,max_path_length,"
+		                           "mean_path_length,latency")
+		self.assertEqual(lines[2], "1,1,1,3,2,2,2.0,32.0")
+		self.assertEqual(len(lines), 5)
+		
+		# Route groups: a second route following route 1's tree is merged with it
+		model.add_route(model.Route(4), [ self.chips[(0,0)].cores[0]
+		                                , self.chips[(0,0)].router
+		                                , self.chips[(1,0)].router
+		                                , self.chips[(2,0)].router
+		                                , self.chips[(2,0)].cores[0]
+		                                ])
+		self.assertEqual(len(analysis.route_statistics(self.chips).keys), 5)
+		keys.group_routes(self.chips)
+		statistics = analysis.route_statistics(self.chips)
+		self.assertEqual(list(statistics.keys),     [0, 1, 2, 3])
+		self.assertEqual(list(statistics.num_keys), [1, 2, 1, 1])
+		self.assertEqual(list(statistics.links),    [0, 2, 3, 0])
+		self.assertEqual(analysis.route_statistics({}), analysis.RouteStatistics(
+			*([array.array("L")] * 6 + [array.array("d")] * 2)))
+
+
+class TrafficTests(unittest.TestCase):
+	"""
+	Tests the flow-level traffic estimates using the network from TableGenTests.
+	"""
+	
+	setUp = TableGenTests.setUp.__func__
+	
+	def test_loads(self):
+		"""
+		Ensure link and router loads account for multicast duplication.
+		"""
+		routes = model.get_all_routes(self.chips)
+		route_1 = [r for r in routes if r.key == 1][0]
+		route_2 = [r for r in routes if r.key == 2][0]
+		
+		loads = traffic.get_loads(self.chips, {route_1: 10.0}, default_rate = 1.0)
+		
+		# Route 1 travels east along the bottom row
+		self.assertEqual(loads.links[((0,0), topology.EAST)], 10.0)
+		self.assertEqual(loads.links[((1,0), topology.EAST)], 10.0)
+		self.assertEqual(loads.routers[(1,0)], 10.0)
+		
+		# Route 2 forks at (1,2), duplicating packets onto two links
+		self.assertEqual(loads.links[((0,2), topology.EAST)], 1.0)
+		self.assertEqual(loads.links[((1,2), topology.EAST)], 1.0)
+		self.assertEqual(loads.links[((1,2), topology.SOUTH)], 1.0)
+		self.assertEqual(loads.link_routes[((1,2), topology.SOUTH)], [(1.0, route_2)])
+		
+		# Router (1,1) carries routes 2 and 3
+		self.assertEqual(loads.routers[(1,1)], 2.0)
+		self.assertEqual(len(loads.links), 5)
+		
+		hottest = traffic.get_hottest_links(loads, 2)
+		self.assertEqual( hottest
+		                , [ (((0,0), topology.EAST), 10.0, [(10.0, route_1)])
+		                  , (((1,0), topology.EAST), 10.0, [(10.0, route_1)])
+		                  ]
+		                )
+	
+	
+	def test_blocked_links(self):
+		"""
+		Ensure traffic for blocked links is emergency routed (or dropped).
+		"""
+		routes = model.get_all_routes(self.chips)
+		route_1 = [r for r in routes if r.key == 1][0]
+		
+		loads = traffic.get_loads( self.chips, {route_1: 10.0}
+		                         , blocked_links = set([((0,0), topology.EAST)])
+		                         )
+		self.assertNotIn(((0,0), topology.EAST), loads.links)
+		self.assertEqual(loads.links[((0,0), topology.NORTH_EAST)], 10.0)
+		self.assertEqual(loads.links[((1,1), topology.SOUTH)], 10.0)
+		self.assertEqual(loads.links[((1,0), topology.EAST)], 10.0)
+		self.assertEqual(loads.routers[(1,1)], 10.0)
+		self.assertEqual(loads.emergency, {((0,0), topology.EAST): 10.0})
+		self.assertEqual(loads.dropped, {})
+		
+		loads = traffic.get_loads( self.chips, {route_1: 10.0}
+		                         , blocked_links = set([ ((0,0), topology.EAST)
+		                                               , ((1,1), topology.SOUTH)
+		                                               ])
+		                         )
+		self.assertEqual(loads.emergency, {})
+		self.assertEqual(loads.dropped, {route_1: 10.0})
+		
+		# Nothing beyond the dropping link is loaded
+		self.assertEqual(loads.links, {})
+		self.assertEqual(loads.routers, {(0,0): 10.0})
+	
+	
+	def test_dropped_traffic(self):
+		"""
+		Ensure traffic dropped on a blocked link with no emergency route loads no
+		links or routers downstream of it.
+		"""
+		chips = model.make_rectangular_board(4,1)
+		route = model.Route(1)
+		model.add_route(route, [chips[(0,0)].cores[0]]
+		                     + [chips[(x,0)].router for x in range(4)]
+		                     + [chips[(3,0)].cores[0]])
+		
+		loads = traffic.get_loads( chips, {route: 10.0}
+		                         , blocked_links = set([((0,0), topology.EAST)])
+		                         )
+		self.assertEqual(loads.dropped, {route: 10.0})
+		self.assertEqual(loads.links, {})
+		self.assertEqual(loads.routers, {(0,0): 10.0})
+	
+	
+	def test_route_group_loads(self):
+		"""
+		Ensure a RouteGroup's rate applies to each of its keys, as in the
+		simulator.
+		"""
+		chips = model.make_rectangular_board(3,1)
+		route = model.RouteGroup([0x10, 0x20, 0x40])
+		model.add_route(route, [chips[(0,0)].cores[0]]
+		                     + [chips[(x,0)].router for x in range(3)]
+		                     + [chips[(2,0)].cores[0]])
+		
+		loads = traffic.get_loads(chips, {route: 2.0})
+		self.assertEqual(loads.links[((0,0), topology.EAST)], 6.0)
+		self.assertEqual(loads.routers[(2,0)], 6.0)
+		self.assertEqual(loads.link_routes[((1,0), topology.EAST)], [(6.0, route)])
+		
+		# The simulator carries the same number of packets
+		sim = simulator.Simulator(chips)
+		sim.add_traffic(route, [0, 1000])
+		sim.run()
+		self.assertEqual(sim.stats.sent, 2 * len(route.keys))
+		self.assertEqual(sim.stats.delivered, 2 * len(route.keys))
+	
+	
+	def test_source_rates(self):
+		"""
+		Ensure per-core rates are applied to every route sourced by the core.
+		"""
+		rates = traffic.get_source_rates(self.chips, {self.chips[(0,2)].cores[0]: 5.0})
+		self.assertEqual([(route.key, rate) for (route, rate) in rates.items()], [(2, 5.0)])
+
+
+class SimulatorTests(unittest.TestCase):
+	"""
+	Tests the packet-level simulator using the network from TableGenTests.
+	"""
+	
+	setUp = TableGenTests.setUp.__func__
+	
+	def get_route(self, key):
+		return [r for r in model.get_all_routes(self.chips) if r.key == key][0]
+	
+	
+	def test_generators(self):
+		self.assertEqual(list(simulator.periodic(10, 5, 3)), [5, 15, 25])
+		self.assertEqual(list(simulator.bursty(2, 10, 0, 2)), [0, 0, 10, 10])
+		times = list(simulator.poisson(0.5, count = 100, seed = 1))
+		self.assertEqual(len(times), 100)
+		self.assertEqual(times, sorted(times))
+	
+	
+	def test_uncongested(self):
+		"""
+		Ensure packets are delivered to every sink with the expected latency.
+		"""
+		sim = simulator.Simulator(self.chips)
+		sim.add_traffic(self.get_route(1), simulator.periodic(100, count = 10))
+		sim.add_traffic(self.get_route(2), simulator.periodic(100, count = 10))
+		stats = sim.run()
+		
+		self.assertEqual(stats.sent, 20)
+		self.assertEqual(stats.delivered, 10 + 30)
+		self.assertEqual(stats.dropped, 0)
+		self.assertEqual(stats.route_delivered[self.get_route(2)], 30)
+		
+		# Three hops, each taking the router latency with two link traversals
+		# between them.
+		self.assertEqual( stats.max_latency
+		                , 3*simulator.ROUTER_LATENCY + 2*(simulator.LINK_PERIOD + simulator.LINK_LATENCY)
+		                )
+	
+	
+	def test_congested(self):
+		"""
+		Ensure packets are dropped when outputs remain blocked and are delivered
+		late when they are blocked only briefly.
+		"""
+		for wait_cycles, expect_drops in ((1, True), (100000, False)):
+			sim = simulator.Simulator(self.chips, wait_cycles = wait_cycles)
+			sim.add_traffic(self.get_route(1), simulator.bursty(20, 1000, count = 2))
+			stats = sim.run()
+			
+			self.assertEqual(stats.sent, 40)
+			self.assertEqual(stats.delivered + stats.dropped, 40)
+			self.assertEqual(stats.dropped > 0, expect_drops)
+		
+		self.assertGreater(stats.max_latency, 20 * simulator.LINK_PERIOD)
+	
+	
+	def test_blocked_links(self):
+		"""
+		Ensure packets are emergency routed around blocked links and dropped
+		when this is not possible.
+		"""
+		route = self.get_route(1)
+		
+		sim = simulator.Simulator(self.chips, blocked_links = set([((1,0), topology.EAST)]))
+		sim.add_traffic(route, simulator.periodic(100, count = 10))
+		stats = sim.run()
+		self.assertEqual(stats.delivered, 10)
+		self.assertEqual(stats.emergency_routed, 10)
+		self.assertEqual( stats.max_latency
+		                , 4*simulator.ROUTER_LATENCY + 3*(simulator.LINK_PERIOD + simulator.LINK_LATENCY)
+		                )
+		
+		# Block the emergency route's second leg too
+		sim = simulator.Simulator(self.chips, blocked_links = set([ ((1,0), topology.EAST)
+		                                                          , ((2,1), topology.SOUTH)
+		                                                          ]))
+		sim.add_traffic(route, simulator.periodic(100, count = 10))
+		stats = sim.run()
+		self.assertEqual(stats.delivered, 0)
+		self.assertEqual(stats.dropped, 10)
+	
+	
+	def test_run_until(self):
+		"""
+		Ensure simulations can be run for a limited time with infinite traffic.
+		"""
+		sim = simulator.Simulator(self.chips)
+		sim.add_traffic(self.get_route(0), simulator.periodic(10))
+		stats = sim.run(until = 995)
+		self.assertEqual(stats.sent, 100)
+		self.assertEqual(sim.time, 995)
+
+
+class BenchmarkTests(unittest.TestCase):
+	"""
+	Tests the benchmark suite's machinery (not the performance measured).
+	"""
+	
+	def test_benchmark_stages(self):
+		results = benchmark.run_suite(benchmark.MACHINES[:1], [0.5], [2])
+		self.assertEqual(results.keys(), ["2x2/density=0.5/fan_out=2"])
+		stages = results["2x2/density=0.5/fan_out=2"]
+		self.assertEqual(sorted(stages), ["add_route", "build", "route", "table_gen"])
+		for stage in stages.itervalues():
+			self.assertGreaterEqual(stage["seconds"], 0.0)
+			self.assertGreater(stage["peak_memory"], 0)
+	
+	
+	def test_compare(self):
+		baseline = {"a": {"build": {"seconds": 1.0}, "route": {"seconds": 0.001}}}
+		results  = {"a": { "build"    : {"seconds": 1.5}
+		                 , "route"    : {"seconds": 0.005}
+		                 , "new_stage": {"seconds": 9.0}
+		                 }
+		           , "b": {"build": {"seconds": 9.0}}
+		           }
+		self.assertEqual(benchmark.compare(results, baseline), [("a", "build", 1.0, 1.5)])
+		self.assertEqual(benchmark.compare(results, baseline, tolerance = 1.0), [])
+
+
+class InstrumentTests(unittest.TestCase):
+	"""
+	Tests the instrumentation of the model, routers and table_gen.
+	"""
+	
+	def setUp(self):
+		instrument.reset()
+		instrument.enable()
+	
+	def tearDown(self):
+		instrument.disable()
+		instrument.reset()
+		del instrument.hooks[:]
+	
+	
+	def route_board(self):
+		chips = model.make_rectangular_board(3, 3, num_cores = 2)
+		source = chips[(0,0)].cores[0]
+		sinks  = [chips[(2,1)].cores[1], chips[(1,2)].cores[0]]
+		node_sequences, unrouted_sinks = routers.dimension_order_route(source, sinks, chips)
+		route = model.Route(0)
+		for node_sequence in node_sequences:
+			model.add_route(route, node_sequence)
+		table_gen.machine_table_gen(chips, StringIO.StringIO())
+		return chips, node_sequences
+	
+	
+	def test_disabled(self):
+		instrument.disable()
+		self.route_board()
+		self.assertEqual(instrument.report(), {"counters": {}, "timers": {}})
+	
+	
+	def test_report(self):
+		chips, node_sequences = self.route_board()
+		report = instrument.report()
+		counters = report["counters"]
+		timers   = report["timers"]
+		
+		self.assertEqual(counters["model.chips_built"], 9)
+		
+		# Each sequence includes the cores and the first router
+		hops = sum(len(node_sequence) - 3 for node_sequence in node_sequences)
+		self.assertEqual(counters["routers.hops"], hops)
+		self.assertEqual(counters["model.hops"], hops + len(node_sequences))
+		self.assertEqual(counters["model.port_lookups"], 2 * (hops + len(node_sequences)))
+		
+		num_entries = sum(len(table_gen.get_router_entries(router))
+		                  for (router, cores) in chips.itervalues())
+		self.assertEqual(counters["table_gen.entries_generated"], num_entries)
+		self.assertEqual(counters["table_gen.bytes_packed"],
+		                 table_gen.spin1_table_size(num_entries))
+		
+		self.assertEqual(timers["model.make_rectangular_board"]["calls"], 1)
+		self.assertEqual(timers["routers.dimension_order_route"]["calls"], 1)
+		self.assertEqual(timers["model.add_route"]["calls"], len(node_sequences))
+		self.assertEqual(timers["table_gen.get_router_entries"]["calls"], 9)
+		self.assertEqual(timers["table_gen.machine_table_gen"]["calls"], 1)
+		for timer in timers.itervalues():
+			self.assertGreaterEqual(timer["seconds"], 0.0)
+		
+		# Written as JSON
+		f = StringIO.StringIO()
+		instrument.write_report(f)
+		self.assertEqual(json.loads(f.getvalue()), report)
+	
+	
+	def test_hooks(self):
+		recorded = []
+		hook = lambda kind, name, value: recorded.append((kind, name, value))
+		instrument.add_hook(hook)
+		
+		instrument.count("a", 3)
+		with instrument.Timer("b"):
+			pass
+		
+		self.assertEqual(recorded[0], ("counter", "a", 3))
+		self.assertEqual(recorded[1][:2], ("timer", "b"))
+		self.assertEqual(instrument.timers["b"][0], 1)
+		
+		instrument.remove_hook(hook)
+		instrument.count("a")
+		self.assertEqual(len(recorded), 2)
+		self.assertEqual(instrument.counters["a"], 4)
+
+
+class NetlistTests(unittest.TestCase):
+	"""
+	Tests the netlist readers, writers and batched routing.
+	"""
+	
+	NETS = [ (0x00010000, (0,0,1), [(1,1,0), (2,0,3)])
+	       , (0x00010001, (2,1,0), [(0,0,0)])
+	       , (5,          (1,0,2), [])
+	       ]
+	
+	def test_text(self):
+		f = StringIO.StringIO()
+		self.assertEqual(netlist.write_text_netlist(self.NETS, f), 3)
+		f.seek(0)
+		self.assertEqual(list(netlist.read_text_netlist(f)), self.NETS)
+		
+		# Comments, blank lines and decimal keys
+		f = StringIO.StringIO("# A comment\n\n  12 1,2,3 4,5,6\n")
+		self.assertEqual(list(netlist.read_text_netlist(f)), [(12, (1,2,3), [(4,5,6)])])
+		
+		f = StringIO.StringIO("12 1,2,3\n12 1,2\n")
+		self.assertRaises(Exception, list, netlist.read_text_netlist(f))
+	
+	
+	def test_binary(self):
+		f = StringIO.StringIO()
+		self.assertEqual(netlist.write_binary_netlist(self.NETS, f), 3)
+		f.seek(0)
+		self.assertEqual(list(netlist.read_binary_netlist(f)), self.NETS)
+		
+		# Truncated
+		f = StringIO.StringIO(f.getvalue()[:-1])
+		self.assertRaises(Exception, list, netlist.read_binary_netlist(f))
+		
+		# Hexagonal boards have negative coordinates
+		chips = model.make_hexagonal_board(2)
+		nets = [(1, (-2,-1,0), [(0,0,1), (0,-1,2)]), (2, (1,1,3), [(-1,-1,0)])]
+		for (key, source, sinks) in nets:
+			for (x,y,core_id) in [source] + sinks:
+				self.assertIn((x,y), chips)
+		f = StringIO.StringIO()
+		netlist.write_binary_netlist(nets, f)
+		f.seek(0)
+		self.assertEqual(list(netlist.read_binary_netlist(f)), nets)
+	
+	
+	def test_read_netlist(self):
+		for write in (netlist.write_text_netlist, netlist.write_binary_netlist):
+			f = StringIO.StringIO()
+			write(self.NETS, f)
+			f.seek(0)
+			self.assertEqual(list(netlist.read_netlist(f)), self.NETS)
+	
+	
+	def test_batches(self):
+		self.assertEqual(list(netlist.batches(xrange(5), 2)), [[0,1], [2,3], [4]])
+		self.assertEqual(list(netlist.batches([], 2)), [])
+	
+	
+	def test_route_netlist(self):
+		chips = model.make_rectangular_board(3, 3, num_cores = 4)
+		
+		# Consumed lazily in batches
+		consumed = []
+		def nets():
+			for net in self.NETS:
+				consumed.append(net)
+				yield net
+		
+		num_nets, unrouted = netlist.route_netlist(nets(), chips, batch_size = 2)
+		self.assertEqual(num_nets, 3)
+		self.assertEqual(unrouted, [])
+		self.assertEqual(consumed, self.NETS)
+		
+		routes = model.get_all_routes(chips)
+		self.assertEqual(sorted(route.key for route in routes), [0x00010000, 0x00010001])
+		for route, (source, sinks) in routes.iteritems():
+			net = [net for net in self.NETS if net[0] == route.key][0]
+			self.assertEqual(model.core_to_router(source).position + (source.core_id,), net[1])
+			self.assertEqual(sorted(model.core_to_router(sink).position + (sink.core_id,)
+			                        for sink in sinks), sorted(net[2]))
+		self.assertEqual(verify.verify_tables(chips), [])
+		
+		# Unroutable sinks are reported
+		chips = model.make_rectangular_board(3, 3, num_cores = 4)
+		chips[(0,0)].router.disconnect(topology.EAST)
+		num_nets, unrouted = netlist.route_netlist(self.NETS[:1], chips)
+		self.assertEqual(unrouted, [(0x00010000, [(2,0,3)])])
+
+
+class CLITests(unittest.TestCase):
+	"""
+	Tests the command-line pipeline.
+	"""
+	
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.netlist_filename = os.path.join(self.directory, "netlist.txt")
+		with open(self.netlist_filename, "w") as f:
+			netlist.write_text_netlist([ (0x10, (0,0,1), [(3,3,2), (5,1,0), (0,0,2)])
+			                           , (0x13, (2,2,0), [(0,0,0)])
+			                           , (0x12, (2,2,1), [(0,0,0)])
+			                           ], f)
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	
+	def test_make_machine(self):
+		chips, use_wrap_around = cli.make_machine("rect:3x2", 2)
+		self.assertEqual(len(chips), 6)
+		self.assertEqual(len(chips[(0,0)].cores), 2)
+		self.assertFalse(use_wrap_around)
+		
+		chips, use_wrap_around = cli.make_machine("rect-wrap:3x2", 2)
+		self.assertTrue(use_wrap_around)
+		self.assertIs(chips[(0,0)].router.connections[topology.WEST], chips[(2,0)].router)
+		
+		self.assertEqual(len(cli.make_machine("hex:4", 1)[0]), 48)
+		self.assertEqual(len(cli.make_machine("torus:1x1", 1)[0]), 144)
+		
+		for spec in ("rect", "rect:3", "hex:x", "cube:3x3"):
+			self.assertRaises(ValueError, cli.make_machine, spec)
+	
+	
+	def test_positions(self):
+		chips = model.make_rectangular_board(3, 3, num_cores = 2)
+		node_sequences, unrouted_sinks = routers.dimension_order_route(
+			chips[(0,0)].cores[0], [chips[(2,1)].cores[1]], chips)
+		positions = cli.to_positions(node_sequences[0])
+		self.assertEqual(positions, ((0,0,0), [(0,0), (1,0), (2,1)], (2,1,1)))
+		self.assertEqual(cli.from_positions(chips, positions), node_sequences[0])
+	
+	
+	def run_cli(self, *args):
+		"""
+		Returns the exit status, the diagnostic output and the query output.
+		"""
+		out = StringIO.StringIO()
+		query_out = StringIO.StringIO()
+		status = cli.main( ["rect-wrap:6x6", self.netlist_filename, "--cores", "4"] + list(args)
+		                 , out, query_out
+		                 )
+		return status, out.getvalue(), query_out.getvalue()
+	
+	
+	def test_pipeline(self):
+		machine_tables = []
+		for workers in ("1", "2"):
+			filename = os.path.join(self.directory, "tables%s.bin"%workers)
+			status, output, query_output = self.run_cli( "--workers", workers, "--minimise"
+			                                           , "--machine-table", filename
+			                                           , "--output-dir", self.directory
+			                                           , "--format", "spin1"
+			                                           )
+			self.assertEqual(status, 0)
+			self.assertIn("routed 3 nets on 36 chips", output)
+			for stage in cli.STAGES:
+				self.assertIn(stage, output)
+			with open(filename, "rb") as f:
+				machine_tables.append(f.read())
+		
+		# Parallel stages produce identical tables
+		self.assertEqual(machine_tables[0], machine_tables[1])
+		self.assertTrue(os.path.exists(os.path.join(self.directory, "routing_table_5_5.bin")))
+		
+		# The two routes from (2,2) to (0,0) have been merged
+		with table_gen.MachineTableFile(os.path.join(self.directory, "tables1.bin")) as tables:
+			keys_masks = [(key, mask) for (route_bits, key, mask) in tables.get_entries((2,2))]
+			self.assertIn((0x12, 0xFFFFFFFE), keys_masks)
+	
+	
+	def test_profile(self):
+		filename = os.path.join(self.directory, "profile.json")
+		status, output, query_output = self.run_cli("--algorithm", "minimal-entry", "--profile", filename)
+		self.assertEqual(status, 0)
+		self.assertNotIn("minimise", output)
+		with open(filename, "r") as f:
+			report = json.load(f)
+		self.assertIn("routers.minimal_entry_route", report["timers"])
+		self.assertIn("cli.route", report["timers"])
+		self.assertFalse(instrument.enabled)
+		instrument.reset()
+	
+	
+	def test_faults(self):
+		filename = os.path.join(self.directory, "faults.txt")
+		with open(filename, "w") as f:
+			f.write("core 0 0 2\n")
+		status, output, query_output = self.run_cli("--faults", filename)
+		self.assertEqual(status, 1)
+		self.assertIn("could not route key 0x00000010 to 0,0,2", output)
+	
+	
+	def test_queries(self):
+		status, output, query_output = self.run_cli( "--query-key", "0x10", "--query-key", "99"
+		                                           , "--query-link", "0,0,west"
+		                                           , "--query-link", "1,1,north"
+		                                           , "--query-incoming", "0,0,NORTH_EAST"
+		                                           )
+		self.assertEqual(status, 0)
+		self.assertEqual( query_output
+		                , "key 0x00000010 passes through 0,0 1,1 2,2 3,3 5,0 5,1\n"
+		                  "key 0x00000063 passes through (no routers)\n"
+		                  "link 0,0,west carries 0x00000010\n"
+		                  "link 1,1,north carries (none)\n"
+		                  "link 0,0,NORTH_EAST delivers 0x00000012 0x00000013\n"
+		                )
+		
+		# Diagnostics are kept separate from the answers
+		self.assertIn("routed 3 nets on 36 chips", output)
+		self.assertNotIn("passes through", output)
+		
+		self.assertRaises(SystemExit, self.run_cli, "--query-link", "0,0,up")
+	
+	
+	def test_unrouted(self):
+		with open(self.netlist_filename, "a") as f:
+			f.write("0x20 0,0,0 9,9,0 1,0,0 0,0,7\n")
+			f.write("0x21 9,9,0 1,0,0\n")
+		
+		# Cores outside the machine are reported as unrouted
+		for workers in ("1", "2"):
+			status, output, query_output = self.run_cli("--workers", workers)
+			self.assertEqual(status, 1)
+			self.assertIn("routed 5 nets on 36 chips", output)
+			self.assertIn("could not route key 0x00000020 to 9,9,0, 0,0,7\n", output)
+			self.assertIn("could not route key 0x00000021 to 1,0,0\n", output)
+
+
+class PlaceTests(unittest.TestCase):
+	"""
+	Tests the placement optimiser.
+	"""
+	
+	def setUp(self):
+		self.chips = model.make_rectangular_board(4, 4, wrap_around = True, num_cores = 2)
+		
+		# A ring of vertices each sending to its two neighbours
+		self.vertices = range(16)
+		self.nets = [ (vertex, [(vertex + 1) % 16, (vertex - 1) % 16])
+		              for vertex in self.vertices
+		            ]
+	
+	
+	def test_get_hop_count(self):
+		placements = { 0: self.chips[(0,0)].cores[0]
+		             , 1: self.chips[(0,0)].cores[1]
+		             , 2: self.chips[(3,3)].cores[0]
+		             }
+		nets = [(0, [1, 2]), (2, [0])]
+		self.assertEqual(place.get_hop_count(nets, placements, self.chips), 3 + 3)
+		self.assertEqual(place.get_hop_count(nets, placements, self.chips, True), 1 + 1)
+	
+	
+	def test_place(self):
+		initial = place.place(self.vertices, self.nets, self.chips, True, iterations = 0, seed = 1)
+		placements = place.place(self.vertices, self.nets, self.chips, True, seed = 1)
+		
+		# Every vertex is placed on a distinct core
+		self.assertEqual(sorted(placements), self.vertices)
+		self.assertEqual(len(set(placements.itervalues())), len(self.vertices))
+		
+		initial_hops = place.get_hop_count(self.nets, initial, self.chips, True)
+		hops = place.get_hop_count(self.nets, placements, self.chips, True)
+		self.assertLess(hops, initial_hops / 2)
+		
+		# An initial placement may be given and is not made worse
+		again = place.place(self.vertices, self.nets, self.chips, True,
+		                    placements = placements, iterations = 0)
+		self.assertEqual(again, placements)
+		for seed in range(5):
+			again = place.place(self.vertices, self.nets, self.chips, True,
+			                    placements = placements, iterations = 200, seed = seed)
+			self.assertLessEqual(place.get_hop_count(self.nets, again, self.chips, True), hops)
+		
+		# The placements can be routed directly
+		for key, (source, sinks) in enumerate(self.nets):
+			node_sequences, unrouted_sinks = routers.dimension_order_route(
+				placements[source], [placements[sink] for sink in sinks], self.chips, True)
+			self.assertEqual(unrouted_sinks, [])
+			route = model.Route(key)
+			for node_sequence in node_sequences:
+				model.add_route(route, node_sequence)
+		self.assertEqual(verify.verify_tables(self.chips), [])
+	
+	
+	def test_too_many_vertices(self):
+		self.assertRaises(Exception, place.place, range(33), [], self.chips)
+
+
+class LazyChipsTests(unittest.TestCase):
+	"""
+	Tests lazily materialised machines.
+	"""
+	
+	MACHINES = [ (model.make_rectangular_board, (3, 4, False))
+	           , (model.make_rectangular_board, (3, 4, True))
+	           , (model.make_rectangular_board, (1, 2, True))
+	           , (model.make_hexagonal_board,   (3,))
+	           , (model.make_multi_board_torus, (1, 2))
+	           ]
+	
+	def get_links(self, chips):
+		"""
+		{(position, port): neighbour_position, ...} for every connected link.
+		"""
+		return dict( ((position, port), node.position)
+		             for (position, (router, cores)) in chips.iteritems()
+		             for (port, node) in router.connections.iteritems()
+		             if port in model.Router.EXTERNAL_PORTS and node is not None
+		           )
+	
+	
+	def test_equivalent(self):
+		for make_machine, args in self.MACHINES:
+			chips = make_machine(*args, num_cores = 2)
+			lazy_chips = make_machine(*args, num_cores = 2, lazy = True)
+			self.assertIsInstance(lazy_chips, model.LazyChips)
+			self.assertEqual(len(lazy_chips), 0)
+			
+			# Every position is in the machine
+			for position in chips:
+				self.assertIn(position, lazy_chips)
+			self.assertNotIn((-10, 100), lazy_chips)
+			self.assertRaises(KeyError, lazy_chips.__getitem__, (-10, 100))
+			self.assertEqual(len(lazy_chips), 0)
+			
+			# Materialise in a random order
+			positions = sorted(chips)
+			random.Random(0).shuffle(positions)
+			for position in positions:
+				router, cores = lazy_chips[position]
+				self.assertEqual(router.position, position)
+				self.assertEqual(len(cores), 2)
+			
+			self.assertEqual(len(lazy_chips), len(chips))
+			self.assertEqual(sorted(lazy_chips.iterkeys()), sorted(chips.iterkeys()))
+			self.assertEqual(self.get_links(lazy_chips), self.get_links(chips))
+			self.assertEqual(routers.get_bounds(lazy_chips), routers.get_bounds(chips))
+	
+	
+	def test_torus_boards(self):
+		lazy_chips = model.make_multi_board_torus(2, 2, lazy = True)
+		boards = {}
+		for x in range(24):
+			for y in range(24):
+				board = lazy_chips.get_board((x,y))
+				boards[board] = boards.get(board, 0) + 1
+		self.assertEqual(len(boards), 12)
+		self.assertEqual(set(boards.itervalues()), set([48]))
+	
+	
+	def test_sparse_routing(self):
+		chips = model.make_multi_board_torus(4, 4, lazy = True)
+		source = chips[(0,0)].cores[1]
+		sinks = [chips[(3,2)].cores[0], chips[(47,47)].cores[2]]
+		node_sequences, unrouted_sinks = routers.dimension_order_route(source, sinks, chips, True)
+		self.assertEqual(unrouted_sinks, [])
+		
+		route = model.Route(0)
+		for node_sequence in node_sequences:
+			model.add_route(route, node_sequence)
+		
+		# Only the chips on the route have been created
+		used = set(router.position for node_sequence in node_sequences
+		           for router in node_sequence[1:-1])
+		self.assertEqual(set(chips), used)
+		self.assertLess(len(chips), 10)
+		
+		self.assertEqual(verify.verify_tables(chips), [])
+		self.assertEqual(sorted(model.get_all_routes(chips)[route][1]), sorted(sinks))
+		
+		f = StringIO.StringIO()
+		table_gen.machine_table_gen(chips, f)
+	
+	
+	def test_whole_machine(self):
+		# Analyses of the whole machine cover the chips not yet created
+		for make_machine, args in self.MACHINES:
+			chips = make_machine(*args, num_cores = 2)
+			lazy_chips = make_machine(*args, num_cores = 2, lazy = True)
+			
+			self.assertEqual(model.all_positions(lazy_chips), model.all_positions(chips))
+			
+			report = analysis.capacity_report(lazy_chips)
+			self.assertEqual(report, analysis.capacity_report(chips))
+			self.assertEqual(len(lazy_chips), 0)
+			
+			fault_map = faults.FaultMap.for_machine(lazy_chips)
+			expected = faults.FaultMap.for_machine(chips)
+			self.assertEqual( (fault_map.width, fault_map.height, fault_map.origin)
+			                , (expected.width, expected.height, expected.origin)
+			                )
+			
+			# Placement uses every core
+			vertices = range(len(chips) * 2)
+			placements = place.place(vertices, [(0, [1])], lazy_chips, iterations = 10, seed = 0)
+			self.assertEqual(len(set(placements.itervalues())), len(vertices))
+			self.assertEqual(len(lazy_chips), len(chips))
+	
+	
+	def test_sparse_minimal_entry_routing(self):
+		# Candidate paths are not created, only the chosen ones
+		for chips in ( model.make_rectangular_board(4, 4, wrap_around = True, lazy = True)
+		             , model.make_multi_board_torus(4, 4, lazy = True)
+		             ):
+			source = chips[(0,0)].cores[0]
+			sinks = [chips[(3,2)].cores[0], chips[(1,3)].cores[0], chips[(2,0)].cores[1]]
+			node_sequences, unrouted_sinks = routers.minimal_entry_route(source, sinks, chips, True)
+			self.assertEqual(unrouted_sinks, [])
+			
+			route = model.Route(0)
+			for node_sequence in node_sequences:
+				model.add_route(route, node_sequence)
+			
+			used = set(router.position for node_sequence in node_sequences
+			           for router in node_sequence[1:-1])
+			self.assertEqual(set(chips), used)
+			self.assertEqual(verify.verify_tables(chips), [])
+	
+	
+	def test_template(self):
+		original = model.make_multi_board_torus(1, 1, num_cores = 3)
+		original[(0,0)].router.disconnect(topology.NORTH)
+		del original[(2,2)].cores[1]
+		template = model.MachineTemplate(original)
+		
+		# Routes in one clone do not affect another
+		chips = template.clone()
+		node_sequences, unrouted_sinks = routers.dimension_order_route(
+			chips[(0,0)].cores[0], [chips[(3,3)].cores[2]], chips, True)
+		route = model.Route(0)
+		for node_sequence in node_sequences:
+			model.add_route(route, node_sequence)
+		self.assertEqual(len(model.get_all_routes(chips)), 1)
+		
+		chips = template.clone()
+		self.assertEqual(len(chips), 0)
+		self.assertEqual(model.get_all_routes(chips), {})
+		self.assertNotIn((20, 20), chips)
+		
+		# Clones are identical to the original machine, including faults
+		for position in original:
+			self.assertEqual(sorted(chips[position].cores), sorted(original[position].cores))
+		self.assertEqual(sorted(chips), sorted(original))
+		self.assertEqual(self.get_links(chips), self.get_links(original))
+		self.assertIsNone(chips[(0,0)].router.connections[topology.NORTH])
+		self.assertEqual(sorted(chips[(2,2)].cores), [0, 2])
+		self.assertEqual(routers.get_bounds(chips), (12, 12))
+	
+	
+	def test_template_whole_machine(self):
+		# A fresh clone can be placed onto and analysed like the original
+		for original in ( model.make_multi_board_torus(1, 1, num_cores = 3)
+		                , model.make_hexagonal_board(2, num_cores = 3)
+		                ):
+			del original[sorted(original)[0]].cores[1]
+			template = model.MachineTemplate(original)
+			
+			chips = template.clone()
+			self.assertEqual(model.all_positions(chips), sorted(original))
+			self.assertEqual(analysis.capacity_report(chips), analysis.capacity_report(original))
+			
+			fault_map = faults.FaultMap.for_machine(chips)
+			self.assertEqual(fault_map.origin, faults.FaultMap.for_machine(original).origin)
+			
+			chips = template.clone()
+			vertices = range(4)
+			placements = place.place(vertices, [(0, [1])], chips, seed = 0)
+			self.assertEqual(len(set(placements.itervalues())), 4)
+			
+			chips = template.clone()
+			vertices = range(sum(len(cores) for (router, cores) in original.itervalues()))
+			placements = place.place(vertices, [(0, [1])], chips, iterations = 10, seed = 0)
+			self.assertEqual(len(set(placements.itervalues())), len(vertices))
+
+
+class FaultsTests(unittest.TestCase):
+	"""
+	Tests the modelling of dead links and cores.
+	"""
+	
+	def setUp(self):
+		self.chips = model.make_rectangular_board(4, 3, wrap_around = True, num_cores = 4)
+		self.faults = faults.FaultMap.for_machine(self.chips, True, 4)
+	
+	
+	def test_fault_map(self):
+		self.assertEqual(len(self.faults), 12)
+		self.assertEqual(list(self.faults.dead_links()), [])
+		self.assertEqual(list(self.faults.dead_cores()), [])
+		
+		# Links die in both directions, including wrap-around links
+		self.faults.set_link_alive((3,2), topology.NORTH_EAST, False)
+		self.assertIn(((3,2), topology.NORTH_EAST), self.faults)
+		self.assertIn(((0,0), topology.SOUTH_WEST), self.faults)
+		self.assertNotIn(((0,0), topology.SOUTH), self.faults)
+		self.assertFalse(self.faults.link_alive((0,0), topology.SOUTH_WEST))
+		self.assertEqual(sorted(self.faults.dead_links()),
+		                 [((0,0), topology.SOUTH_WEST), ((3,2), topology.NORTH_EAST)])
+		
+		self.faults.set_core_alive((2,1), 3, False)
+		self.assertFalse(self.faults.core_alive((2,1), 3))
+		self.assertTrue(self.faults.core_alive((2,1), 2))
+		self.assertEqual(list(self.faults.dead_cores()), [((2,1), 3)])
+		
+		# Outside the map everything is alive
+		self.assertTrue(self.faults.link_alive((10,10), topology.EAST))
+		self.assertTrue(self.faults.core_alive((10,10), 0))
+		self.assertRaises(KeyError, self.faults.set_core_alive, (2,1), 4, False)
+		
+		# Copies are independent
+		copy = self.faults.copy()
+		copy.set_link_alive((0,0), topology.SOUTH_WEST)
+		copy.set_core_alive((2,1), 3)
+		self.assertEqual(list(copy.dead_links()), [])
+		self.assertEqual(list(copy.dead_cores()), [])
+		self.assertEqual(len(list(self.faults.dead_links())), 2)
+		
+		# Negative coordinates
+		fault_map = faults.FaultMap.for_machine(model.make_hexagonal_board(2, num_cores = 1))
+		self.assertEqual(fault_map.origin, (-2,-1))
+		fault_map.set_link_alive((-1,-1), topology.EAST, False)
+		self.assertIn(((0,-1), topology.WEST), fault_map)
+	
+	
+	def test_fault_list(self):
+		self.faults.load(StringIO.StringIO("# Faults\n\nlink 0 0 west\nlink 1 1 NORTH\ncore 2 1 3\n"))
+		self.assertEqual(sorted(self.faults.dead_links()),
+		                 [ ((0,0), topology.WEST), ((1,1), topology.NORTH)
+		                 , ((1,2), topology.SOUTH), ((3,0), topology.EAST)
+		                 ])
+		self.assertEqual(list(self.faults.dead_cores()), [((2,1), 3)])
+		
+		f = StringIO.StringIO()
+		self.faults.write(f)
+		self.assertEqual(sorted(f.getvalue().splitlines()),
+		                 ["core 2 1 3", "link 1 1 north", "link 3 0 east"])
+		
+		# Links leaving the edge of a machine without wrap-around are allowed
+		# while links of chips outside the machine are not
+		fault_map = faults.FaultMap.for_machine(model.make_hexagonal_board(2, lazy = True))
+		fault_map.load(StringIO.StringIO("link -2 -1 west\n"))
+		self.assertEqual(list(fault_map.dead_links()), [((-2,-1), topology.WEST)])
+		self.assertRaises(KeyError, fault_map.set_link_alive, (-3,-1), topology.EAST, False)
+		
+		for bad in ("link 0 0 up", "core 0 0", "chip 0 0 0", "core 0 0 x", "link 99 99 east"):
+			self.assertRaises(Exception, self.faults.load, StringIO.StringIO(bad))
+	
+	
+	def test_routing(self):
+		source = self.chips[(0,0)].cores[0]
+		sinks = [self.chips[(2,1)].cores[1], self.chips[(0,1)].cores[2]]
+		self.faults.set_link_alive((0,0), topology.EAST, False)
+		self.faults.set_core_alive((0,1), 2, False)
+		
+		node_sequences, unrouted_sinks = routers.dimension_order_route(
+			source, sinks, self.chips, faults = self.faults)
+		self.assertEqual(unrouted_sinks, sinks)
+		
+		# Minimal entry routing finds a way around the dead link
+		node_sequences, unrouted_sinks = routers.minimal_entry_route(
+			source, sinks, self.chips, faults = self.faults)
+		self.assertEqual(unrouted_sinks, [sinks[1]])
+		for node_sequence in node_sequences:
+			self.assertTrue(routers.is_path_live(node_sequence, self.faults))
+		
+		# A dead source core cannot send anywhere
+		self.faults.set_core_alive((0,0), 0, False)
+		node_sequences, unrouted_sinks = routers.minimal_entry_route(
+			source, sinks, self.chips, faults = self.faults)
+		self.assertEqual(sorted(unrouted_sinks), sorted(sinks))
+	
+	
+	def test_verify(self):
+		source = self.chips[(0,0)].cores[0]
+		sink = self.chips[(2,0)].cores[1]
+		node_sequences, unrouted_sinks = routers.dimension_order_route(source, [sink], self.chips)
+		route = model.Route(0)
+		for node_sequence in node_sequences:
+			model.add_route(route, node_sequence)
+		self.assertEqual(verify.verify_tables(self.chips, faults = self.faults), [])
+		
+		# The dead link is emergency routed around
+		self.faults.set_link_alive((1,0), topology.EAST, False)
+		self.assertEqual(verify.verify_tables(self.chips, faults = self.faults), [])
+		
+		# But not if the emergency route is also dead
+		problems = verify.verify_tables(self.chips, blocked_links = set([((1,0), topology.NORTH_EAST)]),
+		                                faults = self.faults)
+		self.assertEqual(len(problems), 2)
+		
+		self.faults.set_core_alive((2,0), 1, False)
+		self.assertEqual(verify.verify_tables(self.chips, faults = self.faults),
+		                 [(route, "packet delivered to dead %s"%repr(sink))])
+
+
+class IndexTests(unittest.TestCase):
+	"""
+	Tests the route query index.
+	"""
+	
+	def setUp(self):
+		self.chips = model.make_rectangular_board(4, 4, num_cores = 3)
+		self.index = index.RouteIndex(self.chips)
+		
+		rng = random.Random(0)
+		all_cores = [core for (router, cores) in self.chips.itervalues()
+		             for core in cores.itervalues()]
+		self.routes = []
+		for key in range(20):
+			source = rng.choice(all_cores)
+			sinks = rng.sample(all_cores, 3)
+			route = model.Route(key) if key % 5 else model.RouteGroup([key, key + 100])
+			node_sequences, unrouted_sinks = routers.dimension_order_route(source, sinks, self.chips)
+			for node_sequence in node_sequences:
+				self.index.add_route(route, node_sequence)
+			self.routes.append((route, source))
+	
+	
+	def check_index(self, route_index):
+		"""
+		Compare every query against a scan of the model.
+		"""
+		for route, source in self.routes:
+			for key in route.keys:
+				routers_visited = sorted( position
+				                          for (position, (router, cores)) in self.chips.iteritems()
+				                          if route in router.routes
+				                        )
+				self.assertEqual(route_index.get_routers(key), routers_visited)
+				self.assertEqual(route_index.get_routes(key),
+				                 set([route]) if routers_visited else set())
+		
+		for position, (router, cores) in self.chips.iteritems():
+			self.assertEqual(route_index.get_router_routes(position), set(router.routes))
+			for port in model.Router.EXTERNAL_PORTS:
+				self.assertEqual(route_index.get_link_routes(position, port),
+				                 set(route for (route, (incoming_port, outgoing_ports))
+				                           in router.routes.iteritems()
+				                           if port in outgoing_ports))
+				incoming = set(route for (route, (incoming_port, outgoing_ports))
+				                     in router.routes.iteritems()
+				                     if incoming_port == port)
+				self.assertEqual(route_index.get_incoming_routes(position, port), incoming)
+				self.assertEqual(route_index.get_incoming_keys(position, port),
+				                 sorted(sum((route.keys for route in incoming), [])))
+	
+	
+	def test_queries(self):
+		self.check_index(self.index)
+		self.check_index(index.RouteIndex(self.chips))
+		self.assertEqual(self.index.get_routers(12345), [])
+		self.assertEqual(self.index.get_routes(12345), set())
+	
+	
+	def test_remove_route(self):
+		for route, source in self.routes[::2]:
+			self.index.remove_route(route, source)
+		self.routes = self.routes[1::2]
+		self.check_index(self.index)
+		
+		# Nothing is left indexed once every route is removed
+		for route, source in self.routes:
+			self.index.remove_route(route, source)
+		self.assertEqual(self.index.route_entries, {})
+		self.assertEqual(self.index.key_routes, {})
+		self.assertEqual(self.index.link_routes, {})
+		self.assertEqual(self.index.incoming_routes, {})
+		self.assertEqual(self.index.router_routes, {})
+	
+	
+	def test_external_changes(self):
+		"""
+		Ensure the index notices changes to the routes made without it.
+		"""
+		# Routes added directly to the model
+		source = self.chips[(0,0)].cores[0]
+		sinks = [self.chips[(3,3)].cores[1]]
+		route = model.Route(1000)
+		node_sequences, unrouted_sinks = routers.dimension_order_route(source, sinks, self.chips)
+		for node_sequence in node_sequences:
+			model.add_route(route, node_sequence)
+		self.routes.append((route, source))
+		self.check_index(self.index)
+		
+		# New keys
+		keys.allocate_keys(self.chips, 0x1000)
+		self.check_index(self.index)
+		self.assertEqual(self.index.get_routes(1000), set())
+		
+		# Routes replaced by groups
+		model.add_route(model.Route(2000), node_sequences[0])
+		groups = keys.group_routes(self.chips)
+		self.assertEqual(len(groups), 1)
+		group, = groups
+		self.routes = [(r, s) for (r, s) in self.routes if r is not route] + [(group, source)]
+		self.check_index(self.index)
+		self.assertEqual(self.index.get_routes(2000), set([group]))
 
 
 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Flow-level traffic estimation. Given the rate at which packets are sent along
+each route, estimates the average load on every link and router in the
+network. Multicast routes duplicate packets wherever they fork so every link a
+route uses carries its full rate. Blocked links are modelled using emergency
+routing.
+
+Rates are given per key: as in the simulator, a RouteGroup's source sends a
+packet with each of its keys at the given rate and so the group carries its
+rate multiplied by its number of keys.
+"""
+
+from collections import namedtuple
+
+import model
+
+
+"""
+The result of get_loads:
+* links: a dict {((x,y), port): packets_per_second, ...} giving the load on the
+  outgoing link of every router which carries traffic.
+* routers: a dict {(x,y): packets_per_second, ...} giving the number of packets
+  passing through every router which carries traffic.
+* link_routes: a dict {((x,y), port): [(packets_per_second, Route), ...], ...}
+  giving the routes responsible for the load on each link.
+* emergency: a dict {((x,y), port): packets_per_second, ...} giving the traffic
+  which had to be emergency routed around each blocked link.
+* dropped: a dict {Route: packets_per_second, ...} giving the traffic of each
+  route lost on blocked links which could not be emergency routed around (the
+  route's packets are lost on every branch beyond the link).
+"""
+Loads = namedtuple("Loads", ["links", "routers", "link_routes", "emergency", "dropped"])
+
+
+def get_loads(chips, rates, default_rate = 0.0, blocked_links = ()):
+	"""
+	Estimate the traffic in chips (a dict {(x,y): (router, cores), ...}) given a
+	dict {Route: packets_per_second, ...} of the rate at which each route's source
+	sends packets with each of the route's keys. Routes not listed are assumed
+	to send at default_rate. Returns a Loads tuple whose loads include every key
+	of each RouteGroup.
+	
+	blocked_links is a collection of ((x,y), port) links which cannot be used.
+	Traffic for these links is emergency routed (see
+	model.get_emergency_route) via the neighbouring chip, adding load to its
+	router and the two links used. Routes are not otherwise changed.
+	
+	Each route's tree is walked from the router its source core is attached to
+	so that traffic dropped on a blocked link loads nothing beyond it.
+	"""
+	links       = {}
+	routers     = {}
+	link_routes = {}
+	emergency   = {}
+	dropped     = {}
+	
+	def add_link_load(link, rate, route):
+		links[link] = links.get(link, 0.0) + rate
+		link_routes.setdefault(link, []).append((rate, route))
+	
+	# The entries of every route and the routers at which each route starts (i.e.
+	# where it does not arrive via a link) {Route: {Router: outgoing_ports, ...},
+	# ...} and {Route: [Router, ...], ...}.
+	all_entries = {}
+	all_starts  = {}
+	for router, cores in chips.itervalues():
+		for route, (incoming_port, outgoing_ports) in router.routes.iteritems():
+			all_entries.setdefault(route, {})[router] = outgoing_ports
+			if incoming_port not in model.Router.EXTERNAL_PORTS:
+				all_starts.setdefault(route, []).append(router)
+	
+	for route, starts in all_starts.iteritems():
+		rate = rates.get(route, default_rate) * len(route.keys)
+		if not rate:
+			continue
+		
+		entries  = all_entries[route]
+		visited  = set()
+		to_visit = list(starts)
+		while to_visit:
+			router = to_visit.pop()
+			if router in visited or router not in entries:
+				continue
+			visited.add(router)
+			
+			position = router.position
+			routers[position] = routers.get(position, 0.0) + rate
+			
+			for port in entries[router]:
+				if port not in model.Router.EXTERNAL_PORTS:
+					continue
+				
+				link = (position, port)
+				if link not in blocked_links:
+					add_link_load(link, rate, route)
+					if router.connections[port] is not None:
+						to_visit.append(router.connections[port])
+					continue
+				
+				# Emergency route around the blocked link
+				emergency_route = model.get_emergency_route(router, port)
+				if emergency_route is None or (position, emergency_route[0]) in blocked_links \
+				   or (emergency_route[1].position, emergency_route[2]) in blocked_links:
+					dropped[route] = dropped.get(route, 0.0) + rate
+					continue
+				
+				first_port, intermediate_router, second_port = emergency_route
+				emergency[link] = emergency.get(link, 0.0) + rate
+				add_link_load((position, first_port), rate, route)
+				add_link_load((intermediate_router.position, second_port), rate, route)
+				routers[intermediate_router.position] = \
+					routers.get(intermediate_router.position, 0.0) + rate
+				
+				# Continue at the router the packets were originally headed for
+				to_visit.append(intermediate_router.connections[second_port])
+	
+	return Loads(links, routers, link_routes, emergency, dropped)
+
+
+def get_source_rates(chips, core_rates):
+	"""
+	Given a dict {Core: packets_per_second, ...} of the rate at which each core
+	sends packets with each key of the routes it sources, return the equivalent dict
+	{Route: packets_per_second, ...} for use with get_loads.
+	"""
+	rates = {}
+	for router, cores in chips.itervalues():
+		for core in cores.itervalues():
+			if core in core_rates:
+				for route in core.sources:
+					rates[route] = core_rates[core]
+	return rates
+
+
+def get_hottest_links(loads, num_links = 10):
+	"""
+	Given a Loads tuple, return a list of up to num_links (link, packets_per_second,
+	[(packets_per_second, Route), ...]) tuples for the most heavily loaded links
+	(busiest first), listing the routes responsible for each (largest first).
+	"""
+	hottest = sorted(loads.links.iteritems(), key = lambda (link, rate): (-rate, link))
+	return [ (link, rate, sorted(loads.link_routes[link], reverse = True))
+	         for (link, rate) in hottest[:num_links]
+	       ]
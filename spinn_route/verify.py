@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""
+Facilities for checking that routing tables deliver packets as the model
+requires by simulating the forwarding of packets through the routers, and for
+checking that the routes in the model itself form valid multicast trees.
+"""
+
+import topology
+import model
+import table_gen
+
+
+"""
+A list of (route_bits, port) pairs for every port of a router.
+"""
+PORT_BITS = [ (table_gen.LINK_BITS[port], port)
+              for port in model.Router.INTERNAL_PORTS + model.Router.EXTERNAL_PORTS
+            ]
+
+
+class TableLookup(object):
+	"""
+	A routing table prepared for fast first-match lookups. Entries with all-ones
+	masks are looked up in a dictionary, entries with other masks are tested in
+	order. The result is the same as testing every entry in order.
+	"""
+	
+	def __init__(self, table):
+		"""
+		table is a RoutingTable or a list of (route_bits, key, mask) tuples.
+		"""
+		# {key: (entry_num, route_bits), ...} for the first all-ones-mask entry for
+		# each key.
+		self.exact = {}
+		
+		# [(entry_num, key, mask, route_bits), ...] for all other entries in order.
+		self.masked = []
+		
+		for entry_num, (route_bits, key, mask) in enumerate(table):
+			if mask == 0xFFFFFFFF:
+				if key not in self.exact:
+					self.exact[key] = (entry_num, route_bits)
+			else:
+				self.masked.append((entry_num, key, mask, route_bits))
+	
+	
+	def lookup(self, key):
+		"""
+		Returns the route bits of the first entry matching the key or None if no
+		entry matches.
+		"""
+		entry_num, route_bits = self.exact.get(key, (None, None))
+		
+		for masked_entry_num, entry_key, mask, masked_route_bits in self.masked:
+			if entry_num is not None and masked_entry_num > entry_num:
+				break
+			# Entries with key bits outside their mask never match
+			if key & mask == entry_key:
+				return masked_route_bits
+		
+		return route_bits
+
+
+def forward(key, source, lookups, blocked_links = ()):
+	"""
+	Simulate the forwarding of a packet with the given key from the source Core
+	using the routers' tables. lookups is a dict {Router: TableLookup, ...}.
+	Packets which miss in a router's table are default routed out of the port
+	opposite the one they arrived on.
+	
+	blocked_links is a collection of ((x,y), port) links which cannot be used.
+	Packets sent to a blocked link are emergency routed (see
+	model.get_emergency_route) if possible.
+	
+	Returns a tuple (set(sink_cores), [problem, ...]) where problems are strings
+	describing packets which were dropped or looped.
+	"""
+	delivered = set()
+	problems  = []
+	
+	source_router = model.core_to_router(source)
+	for source_port, node in source_router.connections.iteritems():
+		if node is source:
+			break
+	
+	visited = set()
+	to_visit = [(source_router, source_port)]
+	while to_visit:
+		router, incoming_port = to_visit.pop()
+		
+		# Packets must never return to a router they have already visited.
+		if router in visited:
+			problems.append("packet loops back to %s"%(repr(router)))
+			continue
+		visited.add(router)
+		
+		route_bits = lookups[router].lookup(key)
+		if route_bits is None:
+			if incoming_port not in model.Router.EXTERNAL_PORTS:
+				problems.append("packet dropped by %s (no entry for a locally sourced packet)"%(
+				                repr(router)))
+				continue
+			route_bits = table_gen.LINK_BITS[topology.opposite(incoming_port)]
+		
+		for bit, port in PORT_BITS:
+			if not route_bits & bit:
+				continue
+			
+			node = router.connections[port]
+			if node is None:
+				problems.append("packet sent down a disconnected link %s of %s"%(
+				                repr(port), repr(router)))
+			elif port in model.Router.INTERNAL_PORTS:
+				delivered.add(node)
+			elif (router.position, port) not in blocked_links:
+				to_visit.append((node, topology.opposite(port)))
+			else:
+				# The emergency route arrives as if the blocked link had been used
+				emergency_route = model.get_emergency_route(router, port)
+				if emergency_route is None \
+				   or (router.position, emergency_route[0]) in blocked_links \
+				   or (emergency_route[1].position, emergency_route[2]) in blocked_links:
+					problems.append("packet lost on blocked link %s of %s"%(
+					                repr(port), repr(router)))
+				else:
+					to_visit.append((node, topology.opposite(port)))
+	
+	return delivered, problems
+
+
+class BlockedLinks(object):
+	"""
+	The union of several collections of blocked ((x,y), port) links.
+	"""
+	
+	def __init__(self, *collections):
+		self.collections = collections
+	
+	def __contains__(self, link):
+		return any(link in collection for collection in self.collections)
+
+
+def verify_tables(chips, tables = None, blocked_links = (), faults = None):
+	"""
+	Check that the routing tables of the given chips (a dict {(x,y): (router,
+	cores), ...}) deliver every route's packets (for every key of a RouteGroup)
+	to exactly its sinks.
+	
+	tables is an optional dict {(x,y): table, ...} of RoutingTables or lists of
+	(route_bits, key, mask) tuples to check. If not given, the tables are
+	generated from the model. blocked_links is a collection of ((x,y), port)
+	links which cannot be used (see forward).
+	
+	faults is an optional faults.FaultMap. Its dead links are treated as
+	blocked and packets delivered to its dead cores are reported.
+	
+	Returns a list of (route, problem) tuples where problem is a string; an empty
+	list indicates that all routes are delivered correctly.
+	"""
+	lookups = {}
+	for position, (router, cores) in chips.iteritems():
+		if tables is None:
+			table = table_gen.get_router_entries(router)
+		else:
+			table = tables.get(position, [])
+		lookups[router] = TableLookup(table)
+	
+	if faults is not None:
+		if blocked_links:
+			blocked_links = BlockedLinks(blocked_links, faults)
+		else:
+			blocked_links = faults
+	
+	problems = []
+	for route, (source, sinks) in sorted(model.get_all_routes(chips).iteritems()):
+		for key in route.keys:
+			delivered, route_problems = forward(key, source, lookups, blocked_links)
+			
+			for problem in route_problems:
+				problems.append((route, problem))
+			for sink in sinks - delivered:
+				problems.append((route, "packet not delivered to %s"%(repr(sink))))
+			for core in delivered - sinks:
+				problems.append((route, "packet delivered to %s which is not a sink"%(repr(core))))
+			if faults is not None:
+				for core in delivered:
+					if not faults.core_alive(model.core_to_router(core).position, core.core_id):
+						problems.append((route, "packet delivered to dead %s"%(repr(core))))
+	
+	return problems
+
+
+def validate_routes(chips):
+	"""
+	Check that every route in chips (a dict {(x,y): (router, cores), ...}) forms
+	a valid multicast tree in the model: starting from its source core, each
+	route must enter every router it passes through from a single direction,
+	never revisit a router (i.e. be acyclic), reach every one of its sinks and
+	no other cores, and have no dangling branches (entries not reachable from
+	the source or branches leading nowhere).
+	
+	Unlike verify_tables, routing tables are not generated; the routes are
+	gathered from every router in a single pass and then each route's tree is
+	walked once. Returns a list of (route, problem) tuples where problem is a
+	string; an empty list indicates that all routes are valid.
+	"""
+	# The entries, source cores and sink cores of every route {Route:
+	# {Router: (incoming_port, outgoing_ports), ...}, ...}, {Route: [Core, ...],
+	# ...} and {Route: set([Core, ...]), ...}.
+	all_entries = {}
+	all_sources = {}
+	all_sinks   = {}
+	for router, cores in chips.itervalues():
+		for route, entry in router.routes.iteritems():
+			all_entries.setdefault(route, {})[router] = entry
+		for core in cores.itervalues():
+			for route in core.sources:
+				all_sources.setdefault(route, []).append(core)
+			for route in core.sinks:
+				all_sinks.setdefault(route, set()).add(core)
+	
+	problems = []
+	for route in sorted(set(all_entries).union(all_sources, all_sinks)):
+		entries = all_entries.get(route, {})
+		sinks   = all_sinks.get(route, set())
+		sources = all_sources.get(route, [])
+		if len(sources) != 1:
+			problems.append((route, "route has %d source cores"%(len(sources))))
+			continue
+		source = sources[0]
+		
+		reached  = set()
+		visited  = set()
+		to_visit = [(model.core_to_router(source), source)]
+		while to_visit:
+			router, prev_node = to_visit.pop()
+			
+			if router not in entries:
+				problems.append((route, "route sent to %s which has no entry for it"%(repr(router))))
+				continue
+			
+			if router in visited:
+				problems.append((route, "route loops back to %s"%(repr(router))))
+				continue
+			visited.add(router)
+			
+			incoming_port, outgoing_ports = entries[router]
+			if router.connections[incoming_port] is not prev_node:
+				problems.append((route, "route enters %s other than via its incoming port"%(repr(router))))
+			
+			if not outgoing_ports:
+				problems.append((route, "route ends at %s without reaching a core"%(repr(router))))
+			
+			for port in outgoing_ports:
+				node = router.connections[port]
+				if node is None:
+					problems.append((route, "route sent down a disconnected link %s of %s"%(
+					                 repr(port), repr(router))))
+				elif port in model.Router.INTERNAL_PORTS:
+					reached.add(node)
+				else:
+					to_visit.append((node, router))
+		
+		for router in sorted(set(entries) - visited, key = lambda router: router.position):
+			problems.append((route, "entry in %s is not reachable from the source"%(repr(router))))
+		for sink in sinks - reached:
+			problems.append((route, "sink %s is not reached"%(repr(sink))))
+		for core in reached - sinks:
+			problems.append((route, "route reaches %s which is not a sink"%(repr(core))))
+	
+	return problems